@@ -1,16 +1,144 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from app.tasks.config import DATABASE_URL  # Mantemos o import da URL aqui
+from sqlalchemy.pool import StaticPool
+from app.services.startup_report import lazy_import
+from app.tasks.config import (
+    DATABASE_URL,  # Mantemos o import da URL aqui
+    DATABASE_ASYNC_URL,
+    DATABASE_POOL_SIZE,
+    DATABASE_MAX_OVERFLOW,
+    DATABASE_POOL_TIMEOUT_SECONDS,
+    DATABASE_POOL_RECYCLE_SECONDS,
+    SQLITE_WAL_ENABLED,
+    SQLITE_BUSY_TIMEOUT_MS
+)
+
+# Async drivers used when DATABASE_ASYNC_URL is derived from DATABASE_URL
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+def _is_memory_sqlite(url) -> bool:
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+def _engine_options(url) -> dict:
+    if _is_memory_sqlite(url):
+        # Every connection to :memory: is a new database, so a single one is shared
+        return {'connect_args': {'check_same_thread': False}, 'poolclass': StaticPool}
+    options = {
+        'pool_size': DATABASE_POOL_SIZE,
+        'max_overflow': DATABASE_MAX_OVERFLOW,
+        'pool_timeout': DATABASE_POOL_TIMEOUT_SECONDS,
+        'pool_recycle': DATABASE_POOL_RECYCLE_SECONDS,
+        'pool_pre_ping': url.get_backend_name() != 'sqlite',
+    }
+    if url.get_backend_name() == 'sqlite':
+        # Connections are shared between the worker threads; the driver waits for locks up to the busy timeout
+        options['connect_args'] = {'check_same_thread': False, 'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}
+    return options
+
+def _configure_sqlite(engine, url):
+    """
+    Sets the SQLite pragmas on every new connection: WAL (readers no longer block the writer),
+    synchronous=NORMAL (safe with WAL, one fsync per checkpoint instead of per commit)
+    and busy_timeout.
+    """
+    use_wal = SQLITE_WAL_ENABLED and not _is_memory_sqlite(url)
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if use_wal:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.close()
+
+def create_db_engine(url: str = DATABASE_URL, **options):
+    """
+    Creates the SQLAlchemy engine for `url` with the pool settings from the configuration
+    (and the SQLite pragmas for SQLite). Keyword arguments override the engine options.
+    """
+    parsed = make_url(url)
+    engine = create_engine(url, **{**_engine_options(parsed), **options})
+    if parsed.get_backend_name() == 'sqlite':
+        _configure_sqlite(engine, parsed)
+    return engine
 
 # Apenas a lógica de conexão e configuração
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_db_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 def get_db():
+    """
+    FastAPI dependency that provides a database session and closes it after the request.
+    """
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def get_agent_or_404(db, agent_id: int):
+    """
+    Returns the agent `agent_id` or raises a 404 HTTPException, for the routers.
+    """
+    # Imported here because the models import Base from this module
+    from fastapi import HTTPException
+    from app.models.gmail_agents import GmailAgent
+
+    agent = db.query(GmailAgent).filter(GmailAgent.id == agent_id).first()
+    if not agent:
+        raise HTTPException(status_code=404, detail="Agent not found.")
+    return agent
+
+_async_engine = None
+_async_session_factory = None
+
+def async_database_url() -> str:
+    """
+    Returns DATABASE_ASYNC_URL, or DATABASE_URL with its async driver.
+    """
+    if DATABASE_ASYNC_URL:
+        return DATABASE_ASYNC_URL
+    url = make_url(DATABASE_URL)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise RuntimeError(f"No async driver known for {url.get_backend_name()}; set DATABASE_ASYNC_URL.")
+    return url.set(drivername=driver).render_as_string(hide_password=False)
+
+def get_async_engine():
+    """
+    Returns the shared async engine, created on first use (sqlalchemy.ext.asyncio and the
+    async driver are only imported then).
+    """
+    global _async_engine, _async_session_factory
+    if _async_engine is None:
+        asyncio_ext = lazy_import("sqlalchemy.ext.asyncio")
+        url = async_database_url()
+        parsed = make_url(url)
+        _async_engine = asyncio_ext.create_async_engine(url, **_engine_options(parsed))
+        if parsed.get_backend_name() == 'sqlite':
+            _configure_sqlite(_async_engine.sync_engine, parsed)
+        _async_session_factory = asyncio_ext.async_sessionmaker(_async_engine, expire_on_commit=False)
+    return _async_engine
+
+async def get_async_db():
+    """
+    FastAPI dependency that provides an AsyncSession, for async endpoints, so database
+    access does not block the event loop.
+    """
+    get_async_engine()
+    async with _async_session_factory() as db:
+        yield db
+
+async def dispose_async_engine():
+    global _async_engine, _async_session_factory
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+        _async_session_factory = None
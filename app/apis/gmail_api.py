@@ -1,11 +1,19 @@
 import base64
+import json
+import logging
 import os
 import re # Import to use regular expressions
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
+from functools import lru_cache
 from fastapi import HTTPException, status
 from email.mime.text import MIMEText
+from app.services.startup_report import lazy_import
+from app.services.mime_body import extract_body
+from app.services import rate_limiter, metrics
+from app.tasks.config import GMAIL_BATCH_SIZE, GMAIL_DISCOVERY_DOCUMENT, GMAIL_RATE_LIMIT_RETRIES
+
+# googleapiclient and google-auth are imported on first use (see lazy_import) to keep cold starts fast
+
+logger = logging.getLogger(__name__)
 
 # Scopes and other constants related to API configuration
 SCOPES = [
@@ -15,9 +23,31 @@ SCOPES = [
     'https://www.googleapis.com/auth/userinfo.profile'
 ]
 
-def get_gmail_service(client_id: str, client_secret: str, refresh_token: str):
+# Gmail rejects batches with more than 100 requests
+GMAIL_MAX_BATCH_SIZE = 100
+# Maximum number of message IDs per users.messages.batchModify call
+GMAIL_MAX_BATCH_MODIFY_IDS = 1000
+
+class HistoryCursorExpired(Exception):
     """
-    Authenticates and returns the Gmail API service to the agent using a refresh_token.
+    Raised when Gmail no longer has history records for the given startHistoryId.
+    """
+
+@lru_cache(maxsize=1)
+def _gmail_discovery_document() -> dict:
+    """
+    Loads and parses the Gmail discovery document once per process, from GMAIL_DISCOVERY_DOCUMENT
+    if set, otherwise from the static copy bundled with google-api-python-client.
+    """
+    if GMAIL_DISCOVERY_DOCUMENT:
+        with open(GMAIL_DISCOVERY_DOCUMENT, encoding='utf-8') as f:
+            return json.load(f)
+    discovery_cache = lazy_import('googleapiclient.discovery_cache')
+    return json.loads(discovery_cache.get_static_doc('gmail', 'v1'))
+
+def build_credentials(client_id: str, client_secret: str, refresh_token: str):
+    """
+    Builds (without refreshing) the OAuth credentials of an agent from its refresh_token.
     """
     credentials_info = {
         'client_id': client_id,
@@ -26,22 +56,89 @@ def get_gmail_service(client_id: str, client_secret: str, refresh_token: str):
         'token_uri': 'https://oauth2.googleapis.com/token'
     }
 
-    creds = Credentials.from_authorized_user_info(
+    credentials = lazy_import('google.oauth2.credentials')
+    return credentials.Credentials.from_authorized_user_info(
         info=credentials_info,
         scopes=SCOPES
     )
 
-    if not creds.valid:
+def refresh_credentials(creds):
+    """
+    Obtains a new access token for the given credentials.
+    """
+    transport = lazy_import('google.auth.transport.requests')
+    try:
+        creds.refresh(transport.Request())
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=f"Não foi possível refrescar o access token. Refresh token inválido ou expirado. Erro: {e}"
+        )
+
+def build_gmail_service(creds, quota_key=None):
+    """
+    Builds the Gmail API service object for the given credentials from the cached
+    discovery document, without fetching or re-parsing it. Its calls are charged to the
+    rate limiter bucket of `quota_key` (the mailbox), or to a shared one.
+    """
+    discovery = lazy_import('googleapiclient.discovery')
+    service = discovery.build_from_document(_gmail_discovery_document(), credentials=creds)
+    if quota_key is not None:
+        rate_limiter.bind_gmail_service(service, quota_key)
+    return service
+
+def is_rate_limit_error(error) -> bool:
+    """
+    True for Gmail rate-limit responses: HTTP 429, or 403 with a rateLimitExceeded reason.
+    """
+    resp = getattr(error, 'resp', None)
+    if resp is None:
+        return False
+    if resp.status == 429:
+        return True
+    content = getattr(error, 'content', b'') or b''
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', errors='ignore')
+    return resp.status == 403 and 'ratelimitexceeded' in content.lower()
+
+def _retry_after(error):
+    return rate_limiter.retry_after_seconds(getattr(error, 'resp', None))
+
+def execute_request(service, request):
+    """
+    Executes a Gmail API request after taking its quota units from the mailbox's bucket.
+    Rate-limit errors are retried up to GMAIL_RATE_LIMIT_RETRIES times, after the Retry-After
+    delay or an adaptive backoff (see rate_limiter.TokenBucket.throttled); other errors are raised.
+    """
+    bucket = rate_limiter.gmail_bucket_for(service)
+    units = rate_limiter.gmail_units(request)
+    operation = getattr(request, 'methodId', None) or 'unknown'
+    for attempt in range(GMAIL_RATE_LIMIT_RETRIES + 1):
+        bucket.acquire(units)
         try:
-            creds.refresh(Request())
+            with metrics.external_call('gmail', operation):
+                response = request.execute()
         except Exception as e:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail=f"Não foi possível refrescar o access token. Refresh token inválido ou expirado. Erro: {e}"
-            )
+            if attempt == GMAIL_RATE_LIMIT_RETRIES or not is_rate_limit_error(e):
+                raise
+            delay = bucket.throttled(_retry_after(e))
+            logger.warning("Gmail rate limit reached (%s), retrying in %.1fs.", bucket.name, delay)
+            continue
+        bucket.succeeded()
+        return response
 
-    service = build('gmail', 'v1', credentials=creds)
-    return service
+def get_gmail_service(client_id: str, client_secret: str, refresh_token: str):
+    """
+    Authenticates and returns the Gmail API service to the agent using a refresh_token.
+    Prefer app.services.gmail_client_cache.get_thread_gmail_service, which reuses
+    credentials and services between calls.
+    """
+    creds = build_credentials(client_id, client_secret, refresh_token)
+
+    if not creds.valid:
+        refresh_credentials(creds)
+
+    return build_gmail_service(creds)
 
 def send_email(service, to_email: str, from_email: str, subject: str, message_body: str, thread_id: str = None):
     """
@@ -67,11 +164,11 @@ def send_email(service, to_email: str, from_email: str, subject: str, message_bo
         if thread_id:
             body['threadId'] = thread_id # Add the threadId to ensure it is a reply in the same thread
 
-        send_message = service.users().messages().send(userId='me', body=body).execute()
-        print(f"Email enviado para {to_email}! Message Id: {send_message['id']}")
+        send_message = execute_request(service, service.users().messages().send(userId='me', body=body))
+        logger.info("Email enviado para %s! Message Id: %s", to_email, send_message['id'])
         return send_message
     except Exception as e:
-        print(f"Erro ao enviar e-mail para {to_email}: {e}")
+        logger.error("Erro ao enviar e-mail para %s: %s", to_email, e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Erro ao enviar e-mail: {e}"
@@ -82,17 +179,215 @@ def mark_email_as_read(service, msg_id: str):
     Marks the email with the given ID as read (removes the UNREAD label).
     """
     try:
-        service.users().messages().modify(
+        execute_request(service, service.users().messages().modify(
             userId='me',
             id=msg_id,
             body={'removeLabelIds': ['UNREAD']}
-        ).execute()
+        ))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Erro ao marcar e-mail como lido: {e}"
         )
 
+def batch_modify_messages(service, message_ids: list, add_label_ids: list = None, remove_label_ids: list = None):
+    """
+    Changes the labels of up to GMAIL_MAX_BATCH_MODIFY_IDS messages in a single
+    users.messages.batchModify call. The call applies to all the messages or fails as a whole.
+    """
+    body = {'ids': list(message_ids)}
+    if add_label_ids:
+        body['addLabelIds'] = add_label_ids
+    if remove_label_ids:
+        body['removeLabelIds'] = remove_label_ids
+    try:
+        execute_request(service, service.users().messages().batchModify(userId='me', body=body))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro ao alterar os marcadores de {len(body['ids'])} e-mails: {e}"
+        )
+
+def get_current_history_id(service) -> str:
+    """
+    Returns the mailbox's current historyId (from users.getProfile).
+    """
+    try:
+        profile = execute_request(service, service.users().getProfile(userId='me'))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro ao buscar perfil do Gmail: {e}"
+        )
+    return profile['historyId']
+
+def watch_mailbox(service, topic_name: str, label_ids: list = None) -> dict:
+    """
+    Registers (or renews) push notifications of the mailbox's changes to the Pub/Sub topic with
+    users.watch. Returns {'historyId', 'expiration'}, the expiration in milliseconds since the epoch.
+    """
+    body = {'topicName': topic_name}
+    if label_ids:
+        body['labelIds'] = label_ids
+        body['labelFilterBehavior'] = 'include'
+    try:
+        return execute_request(service, service.users().watch(userId='me', body=body))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro ao registrar notificações do Gmail: {e}"
+        )
+
+def stop_watch(service):
+    """
+    Stops the mailbox's push notifications (users.stop).
+    """
+    try:
+        execute_request(service, service.users().stop(userId='me'))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro ao cancelar notificações do Gmail: {e}"
+        )
+
+def list_history_added_messages(service, start_history_id: str, label_id: str = 'INBOX'):
+    """
+    Lists the messages added to the mailbox since `start_history_id` using users.history.list.
+    Returns a tuple (messages, history_id) where messages is a list of {'id', 'threadId', 'labelIds'}
+    dictionaries in history order and history_id is the mailbox's latest historyId.
+    Raises HistoryCursorExpired if the cursor is too old or invalid.
+    """
+    errors = lazy_import('googleapiclient.errors')
+    messages = {}
+    page_token = None
+    while True:
+        try:
+            response = execute_request(service, service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                historyTypes=['messageAdded'],
+                labelId=label_id,
+                pageToken=page_token
+            ))
+        except errors.HttpError as e:
+            if e.resp.status == 404:
+                raise HistoryCursorExpired(start_history_id) from e
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Erro ao buscar histórico da caixa de entrada: {e}"
+            )
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Erro ao buscar histórico da caixa de entrada: {e}"
+            )
+
+        for record in response.get('history', []):
+            for added in record.get('messagesAdded', []):
+                message = added['message']
+                messages[message['id']] = message
+
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return list(messages.values()), response['historyId']
+
+def _execute_batched(service, requests, batch_size: int = GMAIL_BATCH_SIZE):
+    """
+    Executes a list of Gmail API requests through the multipart batch endpoint,
+    sending at most `batch_size` requests per HTTP round trip. Each round trip first takes
+    the quota units of its requests from the mailbox's bucket, and requests that were
+    rate-limited are sent again (up to GMAIL_RATE_LIMIT_RETRIES times) after a backoff.
+    Returns a list of (response, error) tuples in the same order as `requests`.
+    """
+    batch_size = max(1, min(batch_size, GMAIL_MAX_BATCH_SIZE))
+    bucket = rate_limiter.gmail_bucket_for(service)
+    results = [(None, None)] * len(requests)
+
+    def callback(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    pending = list(range(len(requests)))
+    for attempt in range(GMAIL_RATE_LIMIT_RETRIES + 1):
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            bucket.acquire(sum(rate_limiter.gmail_units(requests[index]) for index in chunk))
+            batch = service.new_batch_http_request(callback=callback)
+            for index in chunk:
+                batch.add(requests[index], request_id=str(index))
+            try:
+                with metrics.external_call('gmail', 'batch', requests=len(chunk)):
+                    batch.execute()
+            except Exception as e:
+                # The whole round trip failed: report the error for every request in this chunk
+                for index in chunk:
+                    results[index] = (None, e)
+
+        limited = [index for index in pending if is_rate_limit_error(results[index][1])]
+        if not limited:
+            bucket.succeeded()
+            break
+        if attempt == GMAIL_RATE_LIMIT_RETRIES:
+            break
+        delay = bucket.throttled(_retry_after(results[limited[0]][1]))
+        logger.warning("Gmail rate limit reached for %d batched request(s) (%s), retrying in %.1fs.",
+                       len(limited), bucket.name, delay)
+        pending = limited
+    return results
+
+def batch_get_messages(service, message_ids: list, format: str = 'full', batch_size: int = GMAIL_BATCH_SIZE,
+                       fields: str = None, metadata_headers: list = None):
+    """
+    Fetches several messages with `messages.get` using batched requests.
+    `fields`, if given, is a partial-response mask that limits the returned fields, and
+    `metadata_headers` the headers returned with format='metadata'.
+    Returns a list of (message_id, message_data, error) tuples in the same order as `message_ids`.
+    """
+    extra = {'fields': fields} if fields else {}
+    if metadata_headers:
+        extra['metadataHeaders'] = metadata_headers
+    requests = [
+        service.users().messages().get(userId='me', id=msg_id, format=format, **extra)
+        for msg_id in message_ids
+    ]
+    results = _execute_batched(service, requests, batch_size)
+    return [(msg_id, data, error) for msg_id, (data, error) in zip(message_ids, results)]
+
+def batch_get_threads(service, thread_ids: list, format: str = 'full', batch_size: int = GMAIL_BATCH_SIZE,
+                      fields: str = None):
+    """
+    Fetches several threads with `threads.get` using batched requests.
+    `fields`, if given, is a partial-response mask that limits the returned fields.
+    Returns a list of (thread_id, thread_data, error) tuples in the same order as `thread_ids`.
+    """
+    extra = {'fields': fields} if fields else {}
+    requests = [
+        service.users().threads().get(userId='me', id=thread_id, format=format, **extra)
+        for thread_id in thread_ids
+    ]
+    results = _execute_batched(service, requests, batch_size)
+    return [(thread_id, data, error) for thread_id, (data, error) in zip(thread_ids, results)]
+
+def parse_history_message(msg: dict):
+    """
+    Converts a message resource into a conversation history entry with sender, date, and body.
+    """
+    headers = msg['payload']['headers']
+    sender = next((h['value'] for h in headers if h['name'] == 'From'), '')
+    date = next((h['value'] for h in headers if h['name'] == 'Date'), '')
+    body = extract_body(msg['payload'])
+
+    return {
+        'id': msg.get('id'),
+        'from': sender,
+        'date': date,
+        'body': body
+    }
+
+def _parse_thread(thread: dict):
+    """
+    Converts a thread resource into a list of messages with sender, date, and body.
+    """
+    return [parse_history_message(msg) for msg in thread.get('messages', [])]
 
 def fetch_thread_history(service, thread_id: str):
     """
@@ -100,33 +395,36 @@ def fetch_thread_history(service, thread_id: str):
     Returns a list of messages ordered by date, each with sender, date, and body.
     """
     try:
-        thread = service.users().threads().get(userId='me', id=thread_id, format='full').execute()
+        thread = execute_request(service, service.users().threads().get(userId='me', id=thread_id, format='full'))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Erro ao buscar histórico do thread: {e}"
         )
+    return _parse_thread(thread)
 
-    messages = thread.get('messages', [])
-    history = []
-    for msg in messages:
-        headers = msg['payload']['headers']
-        sender = next((h['value'] for h in headers if h['name'] == 'From'), '')
-        date = next((h['value'] for h in headers if h['name'] == 'Date'), '')
-        
-        body = ''
-        if 'parts' in msg['payload']:
-            for part in msg['payload']['parts']:
-                if part['mimeType'] == 'text/plain' and 'body' in part and 'data' in part['body']:
-                    body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-                    break
-        else:
-            if 'body' in msg['payload'] and 'data' in msg['payload']['body']:
-                body = base64.urlsafe_b64decode(msg['payload']['body']['data']).decode('utf-8')
-        
-        history.append({
-            'from': sender,
-            'date': date,
-            'body': body
-        })
-    return history
\ No newline at end of file
+def fetch_thread_histories(service, thread_ids: list):
+    """
+    Fetches the history of several Gmail threads in batched round trips.
+    Returns a dict mapping each thread ID to its list of messages. Threads that
+    could not be fetched are reported and left out of the result.
+    """
+    unique_ids = list(dict.fromkeys(thread_ids))
+    if len(unique_ids) == 1:
+        # A single thread is fetched without the batch overhead, its failure handled the same way
+        try:
+            fetched = [(unique_ids[0], execute_request(
+                service, service.users().threads().get(userId='me', id=unique_ids[0], format='full')
+            ), None)]
+        except Exception as e:
+            fetched = [(unique_ids[0], None, e)]
+    else:
+        fetched = batch_get_threads(service, unique_ids)
+
+    histories = {}
+    for thread_id, thread, error in fetched:
+        if error is not None:
+            logger.error("Erro ao buscar histórico do thread %s: %s", thread_id, error)
+            continue
+        histories[thread_id] = _parse_thread(thread)
+    return histories
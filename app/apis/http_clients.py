@@ -0,0 +1,84 @@
+import importlib.util
+import threading
+import httpx
+from app.tasks.config import (
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    HTTP_TIMEOUT_SECONDS,
+    HTTP_CONNECT_TIMEOUT_SECONDS,
+    HTTP2_ENABLED,
+    OPENAI_HTTP_MAX_CONNECTIONS,
+    OPENAI_HTTP_TIMEOUT_SECONDS
+)
+
+# Pool profiles: "default" for webhooks and OAuth, "openai" for the OpenAI clients, whose
+# generations take longer than the webhook timeout
+PROFILES = {
+    "default": {"timeout": HTTP_TIMEOUT_SECONDS, "max_connections": HTTP_MAX_CONNECTIONS},
+    "openai": {"timeout": OPENAI_HTTP_TIMEOUT_SECONDS, "max_connections": OPENAI_HTTP_MAX_CONNECTIONS},
+}
+
+_clients = {}  # (profile, is_async) -> httpx.Client or httpx.AsyncClient
+_clients_lock = threading.Lock()
+
+def http2_enabled() -> bool:
+    """
+    HTTP/2 is used when HTTP2_ENABLED is set and the h2 package is installed.
+    """
+    return HTTP2_ENABLED and importlib.util.find_spec("h2") is not None
+
+def _client_options(profile: str) -> dict:
+    settings = PROFILES[profile]
+    return {
+        "limits": httpx.Limits(
+            max_connections=settings["max_connections"],
+            max_keepalive_connections=min(HTTP_MAX_KEEPALIVE_CONNECTIONS, settings["max_connections"]),
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        "timeout": httpx.Timeout(settings["timeout"], connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+        "http2": http2_enabled(),
+    }
+
+def _get(profile: str, is_async: bool):
+    key = (profile, is_async)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None or client.is_closed:
+            options = _client_options(profile)
+            client = httpx.AsyncClient(**options) if is_async else httpx.Client(**options)
+            _clients[key] = client
+        return client
+
+def get_sync_client(profile: str = "default") -> httpx.Client:
+    """
+    Returns the shared blocking client of the profile (thread-safe), created on first use.
+    """
+    return _get(profile, False)
+
+def get_async_client(profile: str = "default") -> httpx.AsyncClient:
+    """
+    Returns the shared asyncio client of the profile, created on first use. Its connections
+    belong to the running event loop, so it is closed with the application (close_clients).
+    """
+    return _get(profile, True)
+
+async def get_http_client() -> httpx.AsyncClient:
+    """
+    FastAPI dependency that provides the shared asyncio client for webhook and OAuth calls,
+    so repeat requests to the same host reuse a kept-alive connection.
+    """
+    return get_async_client()
+
+async def close_clients():
+    """
+    Closes every shared client; the next get_*_client call creates a new one.
+    """
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        if isinstance(client, httpx.AsyncClient):
+            await client.aclose()
+        else:
+            client.close()
@@ -0,0 +1,69 @@
+import logging
+from datetime import datetime
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+def add_column(table: str, column: str, definition: str):
+    """
+    Returns a migration step that adds a column unless the table already has it
+    (tables created from the current models do).
+    """
+    def step(connection):
+        if column not in {col['name'] for col in inspect(connection).get_columns(table)}:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+    return step
+
+# Schema changes that create_all does not apply to existing databases (it only creates missing
+# tables), in order. Each one must be safe to run on a database created from the current models.
+# A step is an SQL statement or a callable that receives the connection.
+MIGRATIONS = [
+    (1, "Index gmail_agents.email_gmail (agent lookup by address)", [
+        "CREATE INDEX IF NOT EXISTS ix_gmail_agents_email_gmail ON gmail_agents (email_gmail)",
+    ]),
+    (2, "Index processing_jobs by agent and status (active job lookup)", [
+        "CREATE INDEX IF NOT EXISTS ix_processing_jobs_agent_status ON processing_jobs (agent_id, status)",
+    ]),
+    (3, "Count messages skipped by the processed-message ledger in processing_jobs", [
+        add_column("processing_jobs", "skipped", "INTEGER DEFAULT 0"),
+    ]),
+    (4, "Record the digests already sent for each summary batch", [
+        add_column("summary_batches", "digests_sent", "INTEGER DEFAULT 0"),
+    ]),
+    (5, "Index gmail_agents by lowercased address (case-insensitive lookup of push notifications)", [
+        "CREATE INDEX IF NOT EXISTS ix_gmail_agents_email_gmail_lower ON gmail_agents (lower(email_gmail))",
+    ]),
+    (6, "Mark stopped Gmail watches instead of deleting them (kept off by the renewer)", [
+        add_column("gmail_watches", "stopped_at", "DATETIME"),
+    ]),
+]
+
+def run_migrations(engine) -> list:
+    """
+    Applies the migrations that are not recorded in the schema_migrations table yet,
+    each in its own transaction. Returns the versions applied.
+    """
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, description VARCHAR, applied_at DATETIME)"
+        ))
+        applied_versions = {row[0] for row in connection.execute(text("SELECT version FROM schema_migrations"))}
+
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version in applied_versions:
+            continue
+        with engine.begin() as connection:
+            for statement in statements:
+                if callable(statement):
+                    statement(connection)
+                else:
+                    connection.execute(text(statement))
+            connection.execute(
+                text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"),
+                {"v": version, "d": description, "t": datetime.utcnow()}
+            )
+        logger.info("Applied database migration %s: %s", version, description)
+        applied.append(version)
+    return applied
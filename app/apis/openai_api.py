@@ -1,20 +1,186 @@
-from openai import OpenAI
 from dotenv import load_dotenv
+from app.apis.http_clients import get_sync_client, get_async_client as get_async_http_client
+from app.services import rate_limiter, metrics
+from app.services.startup_report import lazy_import
+from app.tasks.config import OPENAI_RATE_LIMIT_RETRIES
+import io
+import json
+import logging
 import os
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Optional OpenAI-compatible endpoint (e.g. a local stand-in for tests)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+SYSTEM_PROMPT = "You are a helpful assistant."
+CHAT_COMPLETIONS_ENDPOINT = "/v1/chat/completions"
+_client = None
+_async_client = None
+# The pooled HTTP clients the OpenAI clients above were built with
+_client_http = None
+_async_client_http = None
 
-def generate_text(prompt: str, model: str = "gpt-3.5-turbo", max_tokens: int = 300, temperature: float = 0.2) -> str:
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
+def get_client():
+    """
+    Returns the shared OpenAI client. The openai package is imported and the client
+    created on first use, which keeps it out of the application's cold start. Requests go
+    through the pooled "openai" HTTP client, and a new OpenAI client is built if that one
+    was closed and replaced.
+    """
+    global _client, _client_http
+    http_client = get_sync_client("openai")
+    if _client is None or _client_http is not http_client:
+        openai = lazy_import("openai")
+        # The SDK's own retries would resend rate-limited calls around the rate limiter
+        _client = openai.OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, http_client=http_client,
+                                max_retries=0)
+        _client_http = http_client
+    return _client
+
+def get_async_client():
+    """
+    Returns the shared asyncio OpenAI client, used for streaming from request handlers
+    without holding a threadpool worker.
+    """
+    global _async_client, _async_client_http
+    http_client = get_async_http_client("openai")
+    if _async_client is None or _async_client_http is not http_client:
+        openai = lazy_import("openai")
+        _async_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, http_client=http_client,
+                                           max_retries=0)
+        _async_client_http = http_client
+    return _async_client
+
+def build_chat_request(prompt: str, model: str = "gpt-3.5-turbo", max_tokens: int = 300, temperature: float = 0.2) -> dict:
+    """
+    Returns the chat completion request body used for a single-prompt generation.
+    """
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": prompt}
         ],
-        max_tokens=max_tokens,
-        temperature=temperature
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+    }
+
+def _rate_limited(error, attempt: int) -> bool:
+    """
+    Records a rate-limit error (openai.RateLimitError) in the rate limiter and tells whether
+    the call should be retried.
+    """
+    openai = lazy_import("openai")
+    if not isinstance(error, openai.RateLimitError) or attempt == OPENAI_RATE_LIMIT_RETRIES:
+        return False
+    response = getattr(error, 'response', None)
+    delay = rate_limiter.openai_throttled(rate_limiter.retry_after_seconds(response.headers if response is not None else None))
+    logger.warning("OpenAI rate limit reached, retrying in %.1fs.", delay)
+    return True
+
+def generate_text(prompt: str, model: str = "gpt-3.5-turbo", max_tokens: int = 300, temperature: float = 0.2) -> str:
+    """
+    Generates a chat completion once the rate limiter has room for its requests and tokens,
+    retrying rate-limited calls up to OPENAI_RATE_LIMIT_RETRIES times.
+    """
+    request = build_chat_request(prompt, model, max_tokens, temperature)
+    estimated_tokens = rate_limiter.estimate_openai_tokens(request)
+    for attempt in range(OPENAI_RATE_LIMIT_RETRIES + 1):
+        rate_limiter.acquire_openai(estimated_tokens)
+        try:
+            with metrics.external_call('openai', 'chat.completions.create', model=model):
+                response = get_client().chat.completions.create(**request)
+        except Exception as e:
+            if _rate_limited(e, attempt):
+                continue
+            raise
+        usage = getattr(response, 'usage', None)
+        rate_limiter.settle_openai(estimated_tokens, getattr(usage, 'total_tokens', None))
+        return response.choices[0].message.content.strip()
+
+async def stream_text(prompt: str, model: str = "gpt-3.5-turbo", max_tokens: int = 300, temperature: float = 0.2):
+    """
+    Streams a chat completion, yielding the generated text as it arrives. Waits for the rate
+    limiter without blocking the event loop; a rate-limited call is retried before the first chunk.
+    """
+    request = build_chat_request(prompt, model, max_tokens, temperature)
+    estimated_tokens = rate_limiter.estimate_openai_tokens(request)
+    for attempt in range(OPENAI_RATE_LIMIT_RETRIES + 1):
+        await rate_limiter.acquire_openai_async(estimated_tokens)
+        try:
+            # Timed until the stream is opened, i.e. the time to the response headers
+            with metrics.external_call('openai', 'chat.completions.stream', model=model):
+                stream = await get_async_client().chat.completions.create(**request, stream=True)
+            break
+        except Exception as e:
+            if _rate_limited(e, attempt):
+                continue
+            raise
+    generated = 0
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            generated += len(chunk.choices[0].delta.content)
+            yield chunk.choices[0].delta.content
+    # Streams report no usage: estimate it from the prompt and the generated text
+    rate_limiter.settle_openai(
+        estimated_tokens, estimated_tokens - request["max_tokens"] + (generated + 3) // 4
     )
-    return response.choices[0].message.content.strip()
+
+def submit_chat_batch(requests: list) -> str:
+    """
+    Submits chat completion requests to the Batch API as one JSONL file.
+
+    Args:
+        requests (list): (custom_id, request_body) tuples, the bodies as returned by build_chat_request.
+
+    Returns:
+        str: The ID of the created batch.
+    """
+    lines = [
+        json.dumps({"custom_id": custom_id, "method": "POST", "url": CHAT_COMPLETIONS_ENDPOINT, "body": body})
+        for custom_id, body in requests
+    ]
+    content = ("\n".join(lines) + "\n").encode("utf-8")
+
+    client = get_client()
+    with metrics.external_call('openai', 'batches.create', requests=len(requests)):
+        input_file = client.files.create(file=("requests.jsonl", io.BytesIO(content)), purpose="batch")
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=CHAT_COMPLETIONS_ENDPOINT,
+            completion_window="24h"
+        )
+    return batch.id
+
+def get_chat_batch_results(batch_id: str):
+    """
+    Checks a Batch API job.
+
+    Returns a tuple (status, results, errors). Once the batch has completed, results maps each
+    custom_id to the generated text and errors maps the custom_ids that failed to their error;
+    before that both are empty.
+    """
+    client = get_client()
+    with metrics.external_call('openai', 'batches.retrieve'):
+        batch = client.batches.retrieve(batch_id)
+    results = {}
+    errors = {}
+    if batch.status != "completed":
+        return batch.status, results, errors
+
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                errors[record["custom_id"]] = record.get("error") or response.get("body")
+                continue
+            results[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"].strip()
+    return batch.status, results, errors
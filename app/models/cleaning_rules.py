@@ -0,0 +1,12 @@
+from sqlalchemy import Column, Integer, Boolean, Text, DateTime, ForeignKey
+from app.apis.database_connection import Base
+
+class EmailCleaningRules(Base):
+    __tablename__ = 'email_cleaning_rules'
+    agent_id = Column(Integer, ForeignKey('gmail_agents.id'), primary_key=True)
+    strip_quotes = Column(Boolean, default=True)
+    strip_signatures = Column(Boolean, default=True)
+    strip_disclaimers = Column(Boolean, default=True)
+    strip_tracking = Column(Boolean, default=True)
+    custom_patterns = Column(Text)  # JSON list of regular expressions whose matches are removed
+    updated_at = Column(DateTime)
@@ -0,0 +1,9 @@
+from sqlalchemy import Column, Integer, Text, DateTime, ForeignKey
+from app.apis.database_connection import Base
+
+class EmailFilterRules(Base):
+    __tablename__ = 'email_filter_rules'
+    agent_id = Column(Integer, ForeignKey('gmail_agents.id'), primary_key=True)
+    ignored_categories = Column(Text)  # JSON list of Gmail label IDs
+    ignored_senders = Column(Text)  # JSON list of addresses and domains
+    updated_at = Column(DateTime)
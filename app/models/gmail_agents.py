@@ -5,7 +5,7 @@ class GmailAgent(Base):
     __tablename__ = 'gmail_agents'
     id = Column(Integer, primary_key=True)
     name = Column(String)
-    email_gmail = Column(String)
+    email_gmail = Column(String, index=True)
     client_id = Column(LargeBinary)
     client_secret = Column(LargeBinary)
     refresh_token = Column(LargeBinary)
\ No newline at end of file
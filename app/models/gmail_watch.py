@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from app.apis.database_connection import Base
+
+class GmailWatch(Base):
+    __tablename__ = 'gmail_watches'
+    agent_id = Column(Integer, ForeignKey('gmail_agents.id'), primary_key=True)
+    topic_name = Column(String)
+    history_id = Column(String)  # Mailbox historyId when the watch was registered
+    expiration = Column(DateTime, index=True)  # Renewed before this time
+    renewed_at = Column(DateTime)
+    # Highest historyId notified so far; notifications at or below it are duplicates
+    last_notified_history_id = Column(String)
+    last_notified_at = Column(DateTime)
+    error = Column(String)  # Last registration error
+    # Set when the watch is stopped through the API; the renewer leaves stopped watches alone
+    stopped_at = Column(DateTime)
@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
+from app.apis.database_connection import Base
+
+class ProcessingJob(Base):
+    __tablename__ = 'processing_jobs'
+    id = Column(String, primary_key=True)
+    agent_id = Column(Integer, ForeignKey('gmail_agents.id'), index=True)
+    status = Column(String, index=True)  # queued, running, succeeded or failed
+    created_at = Column(DateTime)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    # Progress counts, updated while the job runs
+    listed = Column(Integer, default=0)
+    ignored = Column(Integer, default=0)
+    skipped = Column(Integer, default=0)  # Already processed according to the ledger
+    processed = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    error = Column(String)
+
+    __table_args__ = (Index('ix_processing_jobs_agent_status', 'agent_id', 'status'),)
@@ -0,0 +1,8 @@
+from sqlalchemy import Column, String, Text, DateTime
+from app.apis.database_connection import Base
+
+class LLMCacheEntry(Base):
+    __tablename__ = 'llm_cache'
+    key = Column(String, primary_key=True)  # SHA-256 of model, prompt and generation parameters
+    response = Column(Text)
+    created_at = Column(DateTime, index=True)
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from app.apis.database_connection import Base
+
+class ProcessedMessage(Base):
+    __tablename__ = 'processed_messages'
+    agent_id = Column(Integer, ForeignKey('gmail_agents.id'), primary_key=True)
+    message_id = Column(String, primary_key=True)
+    thread_id = Column(String)
+    subject = Column(String)
+    sender = Column(String)
+    # Processing state: summarised (summary set), replied (replied_at set), acknowledged (marked as read)
+    summary = Column(Text)
+    reply_message_id = Column(String)
+    replied_at = Column(DateTime)
+    acknowledged_at = Column(DateTime)
+    updated_at = Column(DateTime, index=True)  # Used by the retention-based pruning
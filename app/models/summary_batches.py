@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey
+from app.apis.database_connection import Base
+
+class SummaryBatch(Base):
+    __tablename__ = 'summary_batches'
+    batch_id = Column(String, primary_key=True)  # OpenAI Batch API ID
+    agent_id = Column(Integer, ForeignKey('gmail_agents.id'), index=True)
+    # Batch API status (validating, in_progress, finalizing, ...) until the digest is sent or given up
+    status = Column(String, index=True)
+    items = Column(Text)  # JSON list of the summarized emails: id, subject, from, body
+    digests_sent = Column(Integer, default=0)  # Digests already emailed, skipped if the batch is processed again
+    created_at = Column(DateTime)
+    completed_at = Column(DateTime)
+    error = Column(String)
@@ -0,0 +1,8 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from app.apis.database_connection import Base
+
+class GmailSyncState(Base):
+    __tablename__ = 'gmail_sync_state'
+    agent_id = Column(Integer, ForeignKey('gmail_agents.id'), primary_key=True)
+    history_id = Column(String)  # Gmail historyId cursor of the last completed sync
+    updated_at = Column(DateTime)
@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index
+from app.apis.database_connection import Base
+
+class WebhookDelivery(Base):
+    __tablename__ = 'webhook_outbox'
+    id = Column(String, primary_key=True)
+    kind = Column(String)  # summary or reply
+    url = Column(String)
+    payload = Column(Text)  # JSON body
+    # Set by producers that may enqueue the same delivery twice (e.g. a retried pipeline run)
+    dedupe_key = Column(String, unique=True)
+    status = Column(String)  # pending, delivering, delivered or failed
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime)
+    created_at = Column(DateTime)
+    delivered_at = Column(DateTime)
+    response_code = Column(Integer)
+    last_error = Column(String)
+
+    __table_args__ = (Index('ix_webhook_outbox_status_next_attempt', 'status', 'next_attempt_at'),)
@@ -1,9 +1,15 @@
 from fastapi import APIRouter, HTTPException, Query, Depends
-from pydantic import BaseModel
-from app.apis.database_connection import SessionLocal
+from pydantic import BaseModel, validator
+from app.apis.database_connection import get_db, get_agent_or_404
 from app.models.gmail_agents import GmailAgent
-from app.services.encryption import get_cipher_suite
+from app.services.gmail_client_cache import get_thread_gmail_service
 from app.services.gmail_service import fetch_recent_emails
+from app.services.email_filters import (
+    get_agent_rules, save_agent_rules, get_filter_stats, validate_sender
+)
+from app.services.email_cleaner import (
+    get_agent_cleaning_rules, save_agent_cleaning_rules, clean_for_prompt, get_cleaning_stats, validate_pattern
+)
 from sqlalchemy.orm import Session
 
 router = APIRouter()
@@ -13,12 +19,27 @@ class EmailOut(BaseModel):
     subject: str
     content: str
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+class FilterRulesIn(BaseModel):
+    ignored_categories: list[str]
+    ignored_senders: list[str]
+
+    @validator("ignored_senders", each_item=True)
+    def validate_ignored_sender(cls, v):
+        return validate_sender(v)
+
+class CleaningRulesIn(BaseModel):
+    strip_quotes: bool = True
+    strip_signatures: bool = True
+    strip_disclaimers: bool = True
+    strip_tracking: bool = True
+    custom_patterns: list[str] = []
+
+    @validator("custom_patterns", each_item=True)
+    def validate_custom_pattern(cls, v):
+        return validate_pattern(v)
+
+class CleaningPreviewIn(BaseModel):
+    email_body: str
 
 @router.get("/emails/recent", response_model=list[EmailOut])
 def get_recent_emails(limit: int = Query(5, ge=1, le=50), agent_id: int = None, db: Session = Depends(get_db)):
@@ -31,15 +52,74 @@ def get_recent_emails(limit: int = Query(5, ge=1, le=50), agent_id: int = None,
         raise HTTPException(status_code=404, detail="Agent not found.")
 
     try:
-        cipher = get_cipher_suite()
-        client_id = cipher.decrypt(agent.client_id).decode()
-        client_secret = cipher.decrypt(agent.client_secret).decode()
-        refresh_token = cipher.decrypt(agent.refresh_token).decode()
-        emails = fetch_recent_emails(client_id, client_secret, refresh_token, max_results=limit)
+        service = get_thread_gmail_service(agent)
+        emails = fetch_recent_emails(service, max_results=limit, rules=get_agent_rules(db, agent.id))
         result = [
             EmailOut(sender=email['from'], subject=email['subject'], content=email['body'])
             for email in emails
         ]
         return result
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error retrieving emails: {str(e)}") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error retrieving emails: {str(e)}") 
+
+@router.get("/emails/filters/{agent_id}")
+def get_filter_rules(agent_id: int, db: Session = Depends(get_db)):
+    """
+    Returns the agent's ignore rules and the Gmail query they are pushed down as.
+    """
+    get_agent_or_404(db, agent_id)
+    return get_agent_rules(db, agent_id).to_dict()
+
+@router.put("/emails/filters/{agent_id}")
+def update_filter_rules(agent_id: int, data: FilterRulesIn, db: Session = Depends(get_db)):
+    """
+    Replaces the agent's ignore rules: Gmail label IDs (categories, SPAM, user labels)
+    and sender addresses or domains (a domain also matches its subdomains).
+    """
+    get_agent_or_404(db, agent_id)
+    return save_agent_rules(db, agent_id, data.ignored_categories, data.ignored_senders).to_dict()
+
+@router.get("/emails/filters/{agent_id}/stats")
+def filter_stats(agent_id: int, db: Session = Depends(get_db)):
+    """
+    Returns how many ignored messages of the agent were filtered by the Gmail query
+    (server-side) and locally, before or after downloading them (client-side).
+    """
+    get_agent_or_404(db, agent_id)
+    return get_filter_stats(agent_id)
+
+@router.get("/emails/cleaning/{agent_id}")
+def get_cleaning_rules(agent_id: int, db: Session = Depends(get_db)):
+    """
+    Returns the rules the agent's email bodies are cleaned with before the LLM calls.
+    """
+    get_agent_or_404(db, agent_id)
+    return get_agent_cleaning_rules(db, agent_id).to_dict()
+
+@router.put("/emails/cleaning/{agent_id}")
+def update_cleaning_rules(agent_id: int, data: CleaningRulesIn, db: Session = Depends(get_db)):
+    """
+    Replaces the agent's cleaning rules: which kinds of noise are stripped (quoted replies,
+    signatures, disclaimers, tracking links) and extra regular expressions whose matches are removed.
+    """
+    get_agent_or_404(db, agent_id)
+    return save_agent_cleaning_rules(
+        db, agent_id, data.strip_quotes, data.strip_signatures, data.strip_disclaimers,
+        data.strip_tracking, data.custom_patterns
+    ).to_dict()
+
+@router.post("/emails/cleaning/{agent_id}/preview")
+def preview_cleaning(agent_id: int, data: CleaningPreviewIn, db: Session = Depends(get_db)):
+    """
+    Cleans a body with the agent's rules and returns the text the LLM would get, with the tokens saved.
+    """
+    get_agent_or_404(db, agent_id)
+    return clean_for_prompt(data.email_body, get_agent_cleaning_rules(db, agent_id), record=False)
+
+@router.get("/emails/cleaning/{agent_id}/stats")
+def cleaning_stats(agent_id: int, db: Session = Depends(get_db)):
+    """
+    Returns how many tokens the cleaning removed from the agent's email bodies.
+    """
+    get_agent_or_404(db, agent_id)
+    return get_cleaning_stats(agent_id)
@@ -1,16 +1,28 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, validator
-from app.services.summary_gen import generate_email_summary
-import requests
+from typing import Optional
+from app.services.summary_gen import generate_email_summary, stream_email_summary
+from app.services import llm_cache, webhook_outbox
+from app.services.email_cleaner import clean_for_prompt, default_rules
+from app.tasks.config import PROMPT_CLEANING_ENABLED
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 class EmailTextIn(BaseModel):
     email_body: str
     language: str = "pt"
+    use_cache: bool = True
+    clean: bool = True
 
 class SummaryOut(BaseModel):
     summary: str
+    tokens_saved: int = 0
 
 class SendSummaryIn(BaseModel):
     summary: str
@@ -25,8 +37,10 @@ class SendSummaryIn(BaseModel):
 
 class SendSummaryOut(BaseModel):
     status: str
-    response_code: int
-    response_body: str
+    delivery_id: str
+    # Only known once the delivery has been attempted (GET /deliveries/{delivery_id})
+    response_code: Optional[int] = None
+    response_body: Optional[str] = None
 
 class SendReplyIn(BaseModel):
     reply: str
@@ -42,46 +56,129 @@ class SendReplyIn(BaseModel):
 
 class SendReplyOut(BaseModel):
     status: str
-    response_code: int
-    response_body: str
+    delivery_id: str
+    # Only known once the delivery has been attempted (GET /deliveries/{delivery_id})
+    response_code: Optional[int] = None
+    response_body: Optional[str] = None
+
+def _prompt_body(data: EmailTextIn) -> tuple:
+    # The body the LLM gets (cleaned with the default rules unless `clean` is false) and the tokens saved
+    if not data.clean or not PROMPT_CLEANING_ENABLED:
+        return data.email_body, 0
+    cleaned = clean_for_prompt(data.email_body, default_rules())
+    return cleaned["text"], cleaned["tokens_saved"]
 
 @router.post("/summary", response_model=SummaryOut)
 def summarize_email(data: EmailTextIn):
     try:
-        summary = generate_email_summary(data.email_body, language=data.language)
-        return {"summary": summary}
+        body, tokens_saved = _prompt_body(data)
+        summary = generate_email_summary(body, language=data.language, use_cache=data.use_cache)
+        return {"summary": summary, "tokens_saved": tokens_saved}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating summary: {str(e)}")
 
-@router.post("/send-summary", response_model=SendSummaryOut)
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/summary/stream")
+async def stream_summary(data: EmailTextIn):
+    """
+    Streams the summary as server-sent events: a `token` event per chunk of generated text,
+    then a `done` event with the full summary, the time to first token and the total duration
+    (in seconds) and the tokens saved by cleaning the body, or an `error` event if the generation fails.
+    """
+    async def events():
+        started = time.perf_counter()
+        first_token_at = None
+        parts = []
+        try:
+            body, tokens_saved = _prompt_body(data)
+            async for text in stream_email_summary(body, language=data.language, use_cache=data.use_cache):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(text)
+                yield _sse_event("token", {"text": text})
+        except Exception as e:
+            logger.error("Error streaming summary: %s", e)
+            yield _sse_event("error", {"detail": f"Error generating summary: {str(e)}"})
+            return
+        finished = time.perf_counter()
+        yield _sse_event("done", {
+            "summary": "".join(parts).strip(),
+            "ttft_seconds": round(first_token_at - started, 3) if first_token_at is not None else None,
+            "duration_seconds": round(finished - started, 3),
+            "tokens_saved": tokens_saved,
+        })
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/llm-cache/stats")
+def llm_cache_stats():
+    """
+    Returns the LLM response cache counters (hits per tier, misses, stores, evictions).
+    """
+    return llm_cache.get_stats()
+
+@router.post("/send-summary", response_model=SendSummaryOut, status_code=202)
 def send_summary(data: SendSummaryIn):
+    """
+    Queues the summary for delivery to recipient_url by the webhook outbox and returns at once.
+    """
     try:
         payload = {
             "summary": data.summary,
             "metadata": data.metadata
         }
-        response = requests.post(data.recipient_url, json=payload, timeout=10)
-        return {
-            "status": "success" if response.ok else "failed",
-            "response_code": response.status_code,
-            "response_body": response.text
-        }
+        delivery_id = webhook_outbox.enqueue(data.recipient_url, payload, kind="summary")
+        return {"status": "queued", "delivery_id": delivery_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error sending summary: {str(e)}")
 
-@router.post("/send-reply", response_model=SendReplyOut)
+@router.post("/send-reply", response_model=SendReplyOut, status_code=202)
 def send_reply(data: SendReplyIn):
+    """
+    Queues the reply for delivery to recipient_url by the webhook outbox and returns at once.
+    """
     try:
         payload = {
             "reply": data.reply,
             "recipient_email": data.recipient_email,
             "metadata": data.metadata
         }
-        response = requests.post(data.recipient_url, json=payload, timeout=10)
-        return {
-            "status": "success" if response.ok else "failed",
-            "response_code": response.status_code,
-            "response_body": response.text
-        }
+        delivery_id = webhook_outbox.enqueue(data.recipient_url, payload, kind="reply")
+        return {"status": "queued", "delivery_id": delivery_id}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error sending reply: {str(e)}") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error sending reply: {str(e)}")
+
+@router.get("/deliveries/stats")
+def delivery_stats():
+    """
+    Returns the number of webhook deliveries per status and the age of the oldest pending one.
+    """
+    return webhook_outbox.get_outbox_stats()
+
+@router.get("/deliveries/{delivery_id}")
+def get_delivery(delivery_id: str):
+    """
+    Returns the status of a webhook delivery: pending, delivering, delivered or failed, with the
+    number of attempts, the next attempt and the last response code or error.
+    """
+    delivery = webhook_outbox.get_delivery(delivery_id)
+    if delivery is None:
+        raise HTTPException(status_code=404, detail="Delivery not found")
+    return delivery
+
+@router.post("/deliveries/{delivery_id}/retry")
+def retry_delivery(delivery_id: str):
+    """
+    Queues a failed delivery again.
+    """
+    delivery = webhook_outbox.retry_delivery(delivery_id)
+    if delivery is None:
+        raise HTTPException(status_code=404, detail="Failed delivery not found")
+    return delivery
@@ -1,28 +1,49 @@
 
-from fastapi import APIRouter, Depends, HTTPException
-from app.tasks.tasks import process_emails_task
-from app.apis.database_connection import SessionLocal
-from app.models.gmail_agents import GmailAgent
+from fastapi import APIRouter, Depends, HTTPException, status
+from app.tasks.job_queue import enqueue_process_emails, get_job
+from app.apis.database_connection import get_db, get_agent_or_404
+from app.tasks.scheduler import scheduler
+from app.services import rate_limiter
 from sqlalchemy.orm import Session
 
 router = APIRouter()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-@router.post("/tasks/process-emails/{agent_id}")
+@router.post("/tasks/process-emails/{agent_id}", status_code=status.HTTP_202_ACCEPTED)
 def trigger_process_emails(agent_id: int, db: Session = Depends(get_db)):
-    agent = db.query(GmailAgent).filter(GmailAgent.id == agent_id).first()
-    if not agent:
-        raise HTTPException(status_code=404, detail="Agent not found.")
+    get_agent_or_404(db, agent_id)
+
+    # The job runs on the local worker pool; if the agent already has a queued or
+    # running job, that job is returned instead of starting a second one.
+    job, created = enqueue_process_emails(agent_id)
+
+    message = "queued" if created else "already queued or running"
+    return {
+        "message": f"Email processing task {message} for agent {agent_id}.",
+        "job_id": job["job_id"],
+        "status": job["status"],
+    }
+
+@router.get("/tasks/scheduler")
+def get_scheduler_status():
+    """
+    Returns the built-in scheduler's per-agent state: interval, last run, duration, and error.
+    """
+    return {"agents": scheduler.get_status()}
 
-    # This is where you would typically trigger a background task.
-    # For simplicity, we'll call the function directly.
-    # In a production environment, you would use a task queue like Celery.
-    process_emails_task(agent_id)
+@router.get("/tasks/rate-limits")
+def get_rate_limit_stats():
+    """
+    Returns the rate limiter's counters per bucket (Gmail quota per mailbox, OpenAI requests and
+    tokens per minute): calls, units, time spent waiting for quota and rate-limited responses.
+    """
+    return rate_limiter.get_stats()
 
-    return {"message": f"Email processing task started for agent {agent_id}."}
+@router.get("/tasks/{job_id}")
+def get_job_status(job_id: str):
+    """
+    Returns the status of an email processing job, with its progress counts and error.
+    """
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
@@ -0,0 +1,83 @@
+import base64
+import binascii
+import hmac
+import json
+import logging
+from fastapi import APIRouter, HTTPException, Depends, Request
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from app.apis.database_connection import get_db, get_agent_or_404
+from app.services.gmail_watch import register_watch, unregister_watch, list_watches, handle_notification
+from app.tasks.config import GMAIL_PUSH_TOKEN
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+class WatchIn(BaseModel):
+    topic_name: str = None  # Defaults to GMAIL_WATCH_TOPIC
+
+def _decode_notification(body: dict) -> dict:
+    """
+    Returns the Gmail notification ({'emailAddress', 'historyId'}) of a Pub/Sub push request,
+    whose message data is the base64-encoded notification, or of a plain notification body.
+    """
+    message = body.get("message")
+    if isinstance(message, dict):
+        try:
+            return json.loads(base64.b64decode(message.get("data", "")))
+        except (binascii.Error, ValueError):
+            raise ValueError("Invalid Pub/Sub message data.")
+    return body
+
+@router.post("/gmail/push")
+async def receive_push_notification(request: Request, token: str = None):
+    """
+    Receives Gmail push notifications from a Pub/Sub push subscription and queues the processing
+    of the notified mailbox (see gmail_watch.handle_notification). Malformed notifications and
+    unknown mailboxes are acknowledged too, since Pub/Sub would otherwise redeliver them.
+    """
+    if GMAIL_PUSH_TOKEN and not hmac.compare_digest(token or "", GMAIL_PUSH_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid push token.")
+    try:
+        notification = _decode_notification(await request.json())
+        email_address = notification["emailAddress"]
+        history_id = notification.get("historyId")
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        logger.warning("Ignoring malformed Gmail push notification: %s", e)
+        return {"action": "ignored"}
+
+    # handle_notification uses the database and the job queue, so it runs in the threadpool
+    result = await run_in_threadpool(handle_notification, email_address, history_id)
+    if result["action"] == "unknown_agent":
+        logger.warning("Gmail push notification for an unknown mailbox: %s", email_address)
+    return result
+
+@router.get("/gmail/watch")
+def get_watches(db: Session = Depends(get_db)):
+    """
+    Returns the agents' Gmail watches: topic, expiration, last renewal and last notification.
+    """
+    return {"watches": list_watches(db)}
+
+@router.post("/gmail/watch/{agent_id}")
+def create_watch(agent_id: int, data: WatchIn = None, db: Session = Depends(get_db)):
+    """
+    Registers (or renews) the agent's Gmail watch, so new mail is pushed instead of polled.
+    """
+    agent = get_agent_or_404(db, agent_id)
+    try:
+        return register_watch(db, agent, data.topic_name if data else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.delete("/gmail/watch/{agent_id}")
+def delete_watch(agent_id: int, db: Session = Depends(get_db)):
+    """
+    Stops the agent's Gmail watch.
+    """
+    agent = get_agent_or_404(db, agent_id)
+    if not unregister_watch(db, agent):
+        raise HTTPException(status_code=404, detail="The agent has no Gmail watch.")
+    return {"message": f"Gmail watch of agent {agent_id} stopped."}
@@ -0,0 +1,85 @@
+import logging
+import threading
+import time
+from app.apis.gmail_api import batch_modify_messages, GMAIL_MAX_BATCH_MODIFY_IDS
+from app.tasks.config import GMAIL_ACK_RETRIES
+
+logger = logging.getLogger(__name__)
+
+class AcknowledgementBuffer:
+    """
+    Collects message IDs whose labels must change (by default: mark as read) and applies
+    them with users.messages.batchModify, up to GMAIL_MAX_BATCH_MODIFY_IDS IDs per call,
+    instead of one messages.modify per message.
+
+    IDs are flushed when the buffer is full and when flush() is called (or the `with`
+    block exits). A failing call is retried; if it keeps failing, its IDs are split in
+    halves and retried separately, so one bad ID (e.g. a deleted message) does not keep
+    the others unacknowledged.
+
+    Args:
+        get_service (callable): Returns the Gmail service to use in the calling thread.
+        remove_label_ids (list, optional): Labels to remove. Default is ['UNREAD'].
+        add_label_ids (list, optional): Labels to add.
+        max_ids (int, optional): Buffered IDs that trigger a flush. Default is GMAIL_MAX_BATCH_MODIFY_IDS.
+    """
+    def __init__(self, get_service, remove_label_ids: list = None, add_label_ids: list = None,
+                 max_ids: int = GMAIL_MAX_BATCH_MODIFY_IDS):
+        self.get_service = get_service
+        self.remove_label_ids = ['UNREAD'] if remove_label_ids is None else remove_label_ids
+        self.add_label_ids = add_label_ids
+        self.max_ids = max(1, min(max_ids, GMAIL_MAX_BATCH_MODIFY_IDS))
+        self._ids = []
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.acknowledged = 0
+        self.failed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+    def add(self, msg_id: str):
+        with self._lock:
+            self._ids.append(msg_id)
+            full = len(self._ids) >= self.max_ids
+        if full:
+            self.flush()
+
+    def flush(self) -> list:
+        """
+        Applies the label change to the buffered IDs. Returns the IDs that could not be changed.
+        """
+        with self._lock:
+            ids = list(dict.fromkeys(self._ids))
+            self._ids.clear()
+        failed = []
+        for start in range(0, len(ids), self.max_ids):
+            failed.extend(self._modify(ids[start:start + self.max_ids], GMAIL_ACK_RETRIES))
+        if failed:
+            logger.warning("Could not change the labels of %d message(s): %s", len(failed), failed)
+        with self._lock:
+            self.failed.extend(failed)
+        return failed
+
+    def _modify(self, ids: list, attempts: int) -> list:
+        service = self.get_service()
+        for attempt in range(max(1, attempts)):
+            if attempt:
+                time.sleep(0.5 * 2 ** (attempt - 1))
+            try:
+                with self._lock:
+                    self.requests += 1
+                batch_modify_messages(service, ids, self.add_label_ids, self.remove_label_ids)
+                with self._lock:
+                    self.acknowledged += len(ids)
+                return []
+            except Exception as e:
+                error = e
+        if len(ids) == 1:
+            logger.error("Error changing the labels of message %s: %s", ids[0], error)
+            return ids
+        middle = len(ids) // 2
+        return self._modify(ids[:middle], 1) + self._modify(ids[middle:], 1)
@@ -0,0 +1,181 @@
+import logging
+import threading
+from collections import OrderedDict
+from app.services.openai_service import generate_text
+from app.services.startup_report import lazy_import
+from app.tasks.config import (
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_MAX_MESSAGES,
+    CONTEXT_MIN_MESSAGE_TOKENS,
+    CONTEXT_SUMMARY_TOKENS,
+    CONTEXT_SUMMARY_CACHE_SIZE,
+    TOKENIZER_MODEL
+)
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_HEADER = "Conversa até agora:\n"
+CONTEXT_FOOTER = "---\n"
+TRUNCATION_MARK = " [...]"
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+# thread_id -> (IDs of the summarized messages, summary), least recently used first
+_summaries = OrderedDict()
+_summaries_lock = threading.Lock()
+
+def _get_encoding():
+    """
+    Loads the tiktoken encoding of TOKENIZER_MODEL once. Returns None if tiktoken is not
+    installed or its encoding files cannot be loaded (e.g. no network on first use).
+    """
+    global _encoding, _encoding_loaded
+    if _encoding_loaded:
+        return _encoding
+    with _encoding_lock:
+        if not _encoding_loaded:
+            try:
+                tiktoken = lazy_import("tiktoken")
+                _encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+            except Exception as e:
+                logger.warning("Local tokenizer unavailable, estimating tokens from text length: %s", e)
+                _encoding = None
+            _encoding_loaded = True
+    return _encoding
+
+def count_tokens(text: str) -> int:
+    """
+    Counts the tokens of `text` with the local tokenizer (about 4 characters per token if unavailable).
+    """
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Keeps the beginning of `text` so that it fits in `max_tokens`, marking the cut.
+    """
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    keep = max(0, max_tokens - count_tokens(TRUNCATION_MARK))
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:keep * 4] + TRUNCATION_MARK
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:keep]) + TRUNCATION_MARK
+
+def _fair_shares(costs: list, budget: int) -> list:
+    """
+    Splits `budget` tokens between messages of the given costs (water-filling): messages that
+    fit in an equal share keep their full length, and what they leave unused is shared by the longer ones.
+    """
+    shares = [0] * len(costs)
+    remaining = budget
+    pending = sorted(range(len(costs)), key=lambda i: costs[i])
+    while pending:
+        share = remaining // len(pending)
+        index = pending[0]
+        if costs[index] <= share:
+            shares[index] = costs[index]
+            remaining -= costs[index]
+            pending.pop(0)
+        else:
+            for index in pending:
+                shares[index] = share
+            break
+    return shares
+
+def _format_message(msg: dict) -> str:
+    body = msg['body'].strip().replace('\n', ' ')
+    return f"{msg['from']}: {body}"
+
+def _message_key(msg: dict) -> str:
+    return msg.get('id') or f"{msg['from']}|{msg.get('date', '')}"
+
+def _summarize_older_messages(thread_id: str, older: list) -> str:
+    """
+    Returns a summary of the older messages of a thread. The summary is cached per thread and
+    rolled forward: when more messages fall out of the recent window, only those are folded into it.
+    """
+    keys = tuple(_message_key(msg) for msg in older)
+    previous_summary = ""
+    new_messages = older
+    if thread_id:
+        with _summaries_lock:
+            cached = _summaries.get(thread_id)
+            if cached is not None:
+                _summaries.move_to_end(thread_id)
+        if cached is not None:
+            cached_keys, cached_summary = cached
+            if cached_keys == keys:
+                return cached_summary
+            if keys[:len(cached_keys)] == cached_keys:
+                previous_summary = cached_summary
+                new_messages = older[len(cached_keys):]
+
+    # Each message gets a fair share of a bounded prompt, so summarizing stays cheap too
+    costs = [count_tokens(_format_message(msg)) for msg in new_messages]
+    shares = _fair_shares(costs, CONTEXT_TOKEN_BUDGET)
+    messages_text = "\n".join(
+        truncate_to_tokens(_format_message(msg), share) for msg, share in zip(new_messages, shares)
+    )
+    previous_part = f"Current summary of the conversation:\n{previous_summary}\n\n" if previous_summary else ""
+    prompt = (
+        f"{previous_part}"
+        f"Summarize the earlier part of this email conversation in a few lines, keeping names, "
+        f"decisions, dates and open questions. Answer in the language of the conversation.\n\n"
+        f"Messages:\n{messages_text}"
+    )
+    summary = generate_text(prompt, max_tokens=CONTEXT_SUMMARY_TOKENS)
+
+    if thread_id:
+        with _summaries_lock:
+            _summaries[thread_id] = (keys, summary)
+            _summaries.move_to_end(thread_id)
+            while len(_summaries) > CONTEXT_SUMMARY_CACHE_SIZE:
+                _summaries.popitem(last=False)
+    return summary
+
+def build_conversation_context(history: list, thread_id: str = None, token_budget: int = CONTEXT_TOKEN_BUDGET,
+                               max_messages: int = CONTEXT_MAX_MESSAGES) -> str:
+    """
+    Builds a textual context of the conversation for the AI that fits in `token_budget` tokens.
+
+    The most recent messages (up to `max_messages`, as many as can get at least
+    CONTEXT_MIN_MESSAGE_TOKENS each) are included, sharing the budget fairly: short messages
+    are kept whole and long ones truncated to equal shares. Older messages are replaced by a
+    rolling summary, cached per thread, so the context stays bounded however long the thread gets.
+    """
+    if not history:
+        return ""
+
+    available = token_budget - count_tokens(CONTEXT_HEADER) - count_tokens(CONTEXT_FOOTER)
+    window = min(max_messages, len(history), max(1, available // CONTEXT_MIN_MESSAGE_TOKENS))
+    recent = history[-window:]
+    older = history[:-window]
+
+    summary_part = ""
+    if older:
+        try:
+            summary = _summarize_older_messages(thread_id, older)
+            summary_part = truncate_to_tokens(
+                f"Resumo das mensagens anteriores: {summary.strip()}", CONTEXT_SUMMARY_TOKENS
+            ) + "\n"
+        except Exception as e:
+            logger.error("Error summarizing older messages of thread %s: %s", thread_id, e)
+        available -= count_tokens(summary_part)
+
+    lines = [_format_message(msg) for msg in recent]
+    # One token per line is kept for the line breaks
+    shares = _fair_shares([count_tokens(line) for line in lines], max(0, available - len(lines)))
+    context = CONTEXT_HEADER + summary_part
+    for line, share in zip(lines, shares):
+        truncated = truncate_to_tokens(line, share)
+        if truncated:
+            context += truncated + "\n"
+    context += CONTEXT_FOOTER
+    return context
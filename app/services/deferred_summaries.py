@@ -0,0 +1,189 @@
+import json
+import logging
+import threading
+from datetime import datetime
+from app.apis.database_connection import SessionLocal
+from app.apis.openai_api import build_chat_request, submit_chat_batch, get_chat_batch_results
+from app.models.gmail_agents import GmailAgent
+from app.models.summary_batches import SummaryBatch
+from app.services import llm_cache
+from app.services.gmail_client_cache import get_thread_gmail_service
+from app.services.openai_service import generate_text, text_cache_key
+from app.services.summary_gen import build_summary_prompt
+from app.tasks.config import LLM_CACHE_ENABLED, SUMMARY_BATCH_POLL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Emails per consolidated digest, as in the synchronous mode
+DIGEST_SIZE = 5
+# Batch API statuses after which the batch will not produce more output
+FINAL_BATCH_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+# Our own statuses once the batch has been dealt with
+DONE_STATUSES = ('sent', 'failed')
+
+_poller_thread = None
+_poller_stop = threading.Event()
+
+def _summary_key(email: dict) -> str:
+    return text_cache_key(build_summary_prompt(email['body']))
+
+def submit_deferred_summaries(agent_id: int, emails: list):
+    """
+    Queues the digest summaries of the processed emails as a single Batch API job.
+
+    Summaries already in the LLM cache are not requested again; if every summary is cached
+    the digest is sent right away. Returns the batch ID, or None if no batch was needed.
+    """
+    items = [
+        {'id': email['id'], 'subject': email['subject'], 'from': email['from'],
+         'body': email.get('prompt_body', email['body'])}
+        for email in emails
+    ]
+    requests = []
+    for item in items:
+        cached = llm_cache.get(_summary_key(item)) if LLM_CACHE_ENABLED else None
+        if cached is None:
+            requests.append((item['id'], build_chat_request(build_summary_prompt(item['body']))))
+
+    if not requests:
+        _send_digests(agent_id, items)
+        return None
+
+    batch_id = submit_chat_batch(requests)
+    db = SessionLocal()
+    try:
+        db.add(SummaryBatch(
+            batch_id=batch_id,
+            agent_id=agent_id,
+            status='validating',
+            items=json.dumps(items, ensure_ascii=False),
+            created_at=datetime.utcnow()
+        ))
+        db.commit()
+    finally:
+        db.close()
+    logger.info("Submitted %d summaries of agent %s as batch %s.", len(requests), agent_id, batch_id, extra={'agent_id': agent_id})
+    return batch_id
+
+def process_pending_summary_batches(agent_id: int = None) -> int:
+    """
+    Checks the unfinished summary batches (of one agent, or of all) and sends the digests of
+    those that completed. Summaries missing from a batch (failed requests, or an expired or
+    cancelled batch) are generated synchronously. Returns the number of batches finished.
+    """
+    db = SessionLocal()
+    try:
+        query = db.query(SummaryBatch).filter(SummaryBatch.status.notin_(DONE_STATUSES))
+        if agent_id is not None:
+            query = query.filter(SummaryBatch.agent_id == agent_id)
+        pending = [(batch.batch_id, batch.agent_id) for batch in query.order_by(SummaryBatch.created_at).all()]
+    finally:
+        db.close()
+
+    finished = 0
+    for batch_id, batch_agent_id in pending:
+        try:
+            if _process_batch(batch_id, batch_agent_id):
+                finished += 1
+        except Exception as e:
+            logger.error("Error processing summary batch %s: %s", batch_id, e)
+            _update_batch(batch_id, error=str(e))
+    return finished
+
+def _update_batch(batch_id: str, **fields):
+    db = SessionLocal()
+    try:
+        db.query(SummaryBatch).filter(SummaryBatch.batch_id == batch_id).update(fields)
+        db.commit()
+    finally:
+        db.close()
+
+def _process_batch(batch_id: str, agent_id: int) -> bool:
+    status, results, errors = get_chat_batch_results(batch_id)
+    if status not in FINAL_BATCH_STATUSES:
+        _update_batch(batch_id, status=status)
+        return False
+
+    db = SessionLocal()
+    try:
+        items, digests_sent = db.query(SummaryBatch.items, SummaryBatch.digests_sent).filter(
+            SummaryBatch.batch_id == batch_id
+        ).one()
+        items = json.loads(items)
+    finally:
+        db.close()
+
+    for item in items:
+        summary = results.get(item['id'])
+        if summary is not None and LLM_CACHE_ENABLED:
+            # Stored under the synchronous key, so the same email is never summarized twice
+            llm_cache.put(_summary_key(item), summary)
+        item['summary'] = summary
+    if errors:
+        logger.warning("Summary batch %s: %d request(s) failed, generating them directly.", batch_id, len(errors))
+
+    _send_digests(agent_id, items, batch_id, digests_sent or 0)
+    _update_batch(batch_id, status='sent', completed_at=datetime.utcnow(),
+                  error=None if status == 'completed' else f"Batch {status}")
+    return True
+
+def _send_digests(agent_id: int, items: list, batch_id: str = None, digests_sent: int = 0):
+    """
+    Emails the digests of `items`, DIGEST_SIZE summaries each. For a batch, each digest is recorded
+    as sent before the next one, so processing the batch again after a failure skips the first
+    `digests_sent` digests instead of sending them twice. Raises if a digest cannot be sent.
+    """
+    # Imported here because app.tasks.tasks imports this module
+    from app.tasks.tasks import send_consolidated_summary
+
+    chunks = range(digests_sent * DIGEST_SIZE, len(items), DIGEST_SIZE)
+    for item in items[digests_sent * DIGEST_SIZE:]:
+        if item.get('summary') is None:
+            # Cached summaries (and the ones the batch could not produce) come from the synchronous path
+            item['summary'] = generate_text(build_summary_prompt(item['body']))
+
+    db = SessionLocal()
+    try:
+        agent = db.query(GmailAgent).filter(GmailAgent.id == agent_id).first()
+        if not agent:
+            raise LookupError(f"Agent with ID {agent_id} not found.")
+        service = get_thread_gmail_service(agent)
+        agent_email = agent.email_gmail
+    finally:
+        db.close()
+
+    for start in chunks:
+        summaries = [
+            f"Assunto: {item['subject']}\nRemetente: {item['from']}\nSumário: {item['summary']}\n---"
+            for item in items[start:start + DIGEST_SIZE]
+        ]
+        if not send_consolidated_summary(service, agent_email, summaries):
+            raise RuntimeError(f"Digest {start // DIGEST_SIZE + 1} could not be sent.")
+        if batch_id is not None:
+            _update_batch(batch_id, digests_sent=start // DIGEST_SIZE + 1)
+
+def _poll_loop():
+    while not _poller_stop.wait(SUMMARY_BATCH_POLL_SECONDS):
+        try:
+            process_pending_summary_batches()
+        except Exception as e:
+            logger.exception("Summary batch poller failed: %s", e)
+
+def start_poller():
+    """
+    Starts a background thread that processes the pending summary batches every SUMMARY_BATCH_POLL_SECONDS.
+    """
+    global _poller_thread
+    if _poller_thread is not None:
+        return
+    _poller_stop.clear()
+    _poller_thread = threading.Thread(target=_poll_loop, name="summary-batch-poller", daemon=True)
+    _poller_thread.start()
+
+def stop_poller():
+    global _poller_thread
+    if _poller_thread is None:
+        return
+    _poller_stop.set()
+    _poller_thread.join()
+    _poller_thread = None
@@ -0,0 +1,357 @@
+import json
+import logging
+import re
+import regex
+import threading
+from datetime import datetime
+from app.models.cleaning_rules import EmailCleaningRules
+from app.services import metrics
+from app.services.context_builder import count_tokens
+from app.tasks.config import PROMPT_CLEANING_MAX_URL_CHARS, PROMPT_CLEANING_PATTERN_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Header lines that introduce the quoted previous message of a reply (Gmail, Apple Mail,
+# Outlook), in the languages the agents answer. Everything from the header on is dropped.
+# Gmail wraps long "On ... wrote:" lines, so the header may span two lines
+_REPLY_HEADER = re.compile(
+    r"^[ \t]*(?:"
+    r"(?P<attribution>(?:On|Em|El|Le|Am)\b[^\n]{0,250}(?:\n[^\n]{0,250})?"
+    r"\b(?:wrote|escreveu|escribió|a écrit|schrieb)[ \t]*:)[ \t]*$"
+    r"|-{2,}[ \t]*(?:Original Message|Mensagem original|Mensaje original|Message d'origine)[ \t]*-{2,}"
+    r"|_{10,}[ \t]*\n[ \t]*(?:From|De|Von)[ \t]*:"
+    r"|(?:From|De|Von)[ \t]*:[^\n]*\n[ \t]*(?:Sent|Enviado(?: em)?|Enviada(?: em)?|Date|Data|Gesendet)[ \t]*:"
+    r")",
+    re.IGNORECASE | re.MULTILINE
+)
+_REPLY_HEADER_KEYWORDS = ('wrote', 'escreveu', 'escribió', 'a écrit', 'schrieb', 'original', "message d'origine",
+                         'from:', 'from :', 'de:', 'de :', 'von:', 'von :')
+# Mail clients put the date of the quoted message in the "On ... wrote:" line; one without a
+# digit is a sentence of the message ("On second thought, here is what Ana wrote:")
+_DIGIT = re.compile(r"\d")
+# A forwarded message's header block (From:/Date:/Subject:) follows one of these markers; it
+# introduces the content being forwarded, not a quote, so it is not cut as a reply header
+_FORWARD_MARKER = re.compile(
+    r"^[ \t]*(?:-{2,}[ \t]*(?:Forwarded message|Mensagem encaminhada|Mensaje reenviado|Message transféré"
+    r"|Weitergeleitete Nachricht)[ \t]*-{2,}|Begin forwarded message:|Início da mensagem encaminhada:)[ \t]*$",
+    re.IGNORECASE | re.MULTILINE
+)
+_FORWARD_KEYWORDS = ('forwarded', 'encaminhada', 'reenviado', 'transféré', 'weitergeleitete')
+_QUOTED_LINE = re.compile(r"^[ \t]*>[^\n]*(?:\n|$)", re.MULTILINE)
+
+# RFC 3676 signature delimiter ("-- " on its own line; a bare "--" is too common in message
+# content, e.g. as a separator) and the signatures mobile clients append
+_SIGNATURE_DELIMITER = re.compile(r"^-- $", re.MULTILINE)
+_MOBILE_SIGNATURE = re.compile(
+    r"^[ \t]*(?:Sent from my \w+|Enviado do meu \w+|Enviado desde mi \w+|Envoyé de mon \w+"
+    r"|Get Outlook for \w+|Obtenha o Outlook para \w+|Sent from (?:Mail|Outlook|Yahoo Mail)[^\n]*)[^\n]*(?:\n|$)",
+    re.IGNORECASE | re.MULTILINE
+)
+_MOBILE_SIGNATURE_KEYWORDS = ('sent from', 'enviado d', 'envoyé de', 'outlook')
+# A sign-off followed by the sender's name and a contact block (title, phones, address, site)
+_SIGN_OFF = re.compile(
+    r"^[ \t]*(?:atenciosamente|att\.?|abraços?|abs\.?|cordialmente|saudações|obrigad[oa]|grat[oa]"
+    r"|best(?: regards| wishes)?|kind regards|regards|cheers|thanks|thank you|sincerely"
+    r"|saludos|un saludo|cordialement)[ \t]*[,.!]?[ \t]*$",
+    re.IGNORECASE | re.MULTILINE
+)
+_CONTACT = re.compile(r"@[\w-]+\.\w|\+?\d[\d ().-]{7,}\d|https?://|www\.|\|", re.IGNORECASE)
+# Longest contact block removed after a sign-off; anything longer is taken for message content
+SIGNATURE_MAX_LINES = 10
+SIGNATURE_MAX_LINE_CHARS = 100
+_SIGN_OFF_WINDOW = 2 * (SIGNATURE_MAX_LINES + 2) * (SIGNATURE_MAX_LINE_CHARS + 1)
+
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n")
+_DISCLAIMER = re.compile(
+    r"confidentiality notice|this (?:e-?mail|message)\b[^\n]{0,80}\bconfidential"
+    r"|if you (?:are not|have received this)[^\n]{0,40}(?:intended recipient|in error)"
+    r"|aviso (?:legal|de confidencialidade)|(?:esta|essa) (?:mensagem|e-?mail)\b[^\n]{0,80}\bconfidencia"
+    r"|se (?:você|vc) não (?:é|for) o destinatário|caso (?:tenha recebido|você tenha recebido) (?:esta|essa)"
+    r"|(?:please )?consider the environment before printing|antes de imprimir,? pense"
+    r"|este (?:mensaje|correo)\b[^\n]{0,80}\bconfidencial",
+    re.IGNORECASE
+)
+_DISCLAIMER_KEYWORDS = ('confidential', 'confidencia', 'intended recipient', 'in error', 'aviso',
+                       'destinatário', 'tenha recebido', 'before printing', 'antes de imprimir')
+
+_URL = re.compile(r"https?://[^\s<>\"')\]]+")
+_TRACKING_PARAMS = (
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid', '_hsenc', '_hsmi', 'mkt_tok',
+    'trk', 'trkcampaign', 'sc_channel', 'yclid', 'igshid', 'ref_src', 'oly_anon_id', 'oly_enc_id',
+)
+# Removed from the query string in place, so the rest of the URL keeps its exact encoding
+_TRACKING_PARAM = re.compile(
+    r"(?<=[?&])(?:utm_[^=&#]*|" + "|".join(map(re.escape, _TRACKING_PARAMS)) + r")=[^&#]*&?", re.IGNORECASE
+)
+_DANGLING_QUERY = re.compile(r"[?&]+(?=#|$)")
+_URL_ORIGIN = re.compile(r"https?://[^/?#]+")
+# Newsletter footer lines: unsubscribe and "view in browser" links
+_LIST_FOOTER = re.compile(
+    r"\b(?:unsubscribe|descadastr\w*|cancelar (?:a )?inscrição|darse de baja|se désinscrire"
+    r"|view (?:this email |it )?in (?:your )?browser|visualizar (?:no|em seu|este e-?mail no) navegador"
+    r"|manage (?:your )?(?:email )?preferences)\b",
+    re.IGNORECASE
+)
+# Lines where the footer phrase starts further in are content, not a footer link
+LIST_FOOTER_MAX_OFFSET = 200
+_LIST_FOOTER_KEYWORDS = ('unsubscribe', 'descadastr', 'inscrição', 'de baja', 'désinscrire', 'browser',
+                         'navegador', 'preferences')
+
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+def _mentions(lowered: str, keywords: tuple) -> bool:
+    return any(keyword in lowered for keyword in keywords)
+
+def _collapse_whitespace(text: str) -> str:
+    text = '\n'.join(line.rstrip() for line in text.split('\n'))
+    if '\n\n\n' in text:
+        text = _BLANK_LINES.sub('\n\n', text)
+    return text.strip()
+
+def _strip_tracking_params(match) -> str:
+    url = match.group(0)
+    if '?' in url:
+        url = _DANGLING_QUERY.sub('', _TRACKING_PARAM.sub('', url))
+    if len(url) > PROMPT_CLEANING_MAX_URL_CHARS:
+        # Redirect and click-tracking links: the host is all the model can use
+        url = _URL_ORIGIN.match(url).group(0) + "/…"
+    return url
+
+def _find_reply_header(text: str):
+    forwards = set()
+    if _mentions(text.lower(), _FORWARD_KEYWORDS):
+        forwards = {marker.end() for marker in _FORWARD_MARKER.finditer(text)}
+    for match in _REPLY_HEADER.finditer(text):
+        attribution = match.group('attribution')
+        if attribution is not None and not _DIGIT.search(attribution):
+            continue
+        # The header block right below a forward marker belongs to the forwarded message
+        if forwards and any(end <= match.start() and not text[end:match.start()].strip() for end in forwards):
+            continue
+        return match
+    return None
+
+def _is_list_footer(text: str, start: int, end: int) -> bool:
+    match = _LIST_FOOTER.search(text, start, end)
+    return match is not None and match.start() - start <= LIST_FOOTER_MAX_OFFSET
+
+def _strip_list_footer(text: str) -> str:
+    # Only the lines holding a footer keyword are matched against the footer phrases
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        # Lowercasing changed the length (e.g. "İ"), so its offsets do not map back to the text
+        return ''.join(line for line in text.splitlines(keepends=True) if not _is_list_footer(line, 0, len(line)))
+    lines = set()
+    for keyword in _LIST_FOOTER_KEYWORDS:
+        index = lowered.find(keyword)
+        while index != -1:
+            start = lowered.rfind('\n', 0, index) + 1
+            end = lowered.find('\n', index)
+            end = len(text) if end == -1 else end + 1
+            lines.add((start, end))
+            index = lowered.find(keyword, end)
+    parts = []
+    kept_from = 0
+    for start, end in sorted(lines):
+        if _is_list_footer(text, start, end):
+            parts.append(text[kept_from:start])
+            kept_from = end
+    if not parts:
+        return text
+    parts.append(text[kept_from:])
+    return ''.join(parts)
+
+def _strip_sign_off(text: str) -> str:
+    # Only the end of the body can hold a sign-off with a short enough block below it
+    start = max(0, len(text) - _SIGN_OFF_WINDOW)
+    if start:
+        start = text.find('\n', start) + 1
+    last = None
+    for last in _SIGN_OFF.finditer(text, start):
+        pass
+    # A sign-off that opens the message ("Thanks!\n...") is not a signature
+    if last is None or not text[:last.start()].strip():
+        return text
+    lines = [line for line in text[last.end():].split('\n') if line.strip()]
+    # Keep the sign-off and the name; drop the contact block below them
+    block = lines[1:]
+    if (not block or len(block) > SIGNATURE_MAX_LINES
+            or any(len(line) > SIGNATURE_MAX_LINE_CHARS for line in block)
+            or not any(_CONTACT.search(line) for line in block)):
+        return text
+    return text[:last.end()] + ('\n' + lines[0] if lines else '')
+
+class CleaningRules:
+    """
+    A compiled prompt cleaning rule set.
+
+    Each kind of noise is removed with patterns compiled once at import (the custom patterns
+    when the rule set is built, each run with a timeout), so cleaning a body is a handful of
+    regex passes over it:
+    quoted replies are cut at the first reply header, disclaimers dropped by paragraph, signatures
+    cut at their delimiter or below the sign-off and name, tracking parameters removed and opaque
+    redirect URLs shortened.
+    """
+    def __init__(self, strip_quotes: bool = True, strip_signatures: bool = True, strip_disclaimers: bool = True,
+                 strip_tracking: bool = True, custom_patterns: list = None, agent_id: int = None):
+        self.agent_id = agent_id
+        self.strip_quotes = strip_quotes
+        self.strip_signatures = strip_signatures
+        self.strip_disclaimers = strip_disclaimers
+        self.strip_tracking = strip_tracking
+        self.custom_patterns = [pattern for pattern in (custom_patterns or []) if pattern.strip()]
+        # Compiled with `regex`, which can stop a match that backtracks for too long
+        self._custom = [regex.compile(pattern, regex.IGNORECASE | regex.MULTILINE) for pattern in self.custom_patterns]
+
+    def clean(self, text: str) -> str:
+        """
+        Returns `text` without the noise the rule set removes. A body that would end up empty
+        (e.g. a bare forward of a quoted message) is returned with only its whitespace collapsed.
+        """
+        if not text:
+            return text
+        cleaned = text.replace('\r\n', '\n')
+        # Each pass first looks for its keywords with a plain substring search, which is much
+        # cheaper than running the regex over a body that has nothing for it to remove
+        lowered = cleaned.lower()
+        if self.strip_quotes:
+            if _mentions(lowered, _REPLY_HEADER_KEYWORDS):
+                match = _find_reply_header(cleaned)
+                if match:
+                    cleaned = cleaned[:match.start()]
+            if '>' in cleaned:
+                cleaned = _QUOTED_LINE.sub('', cleaned)
+        # Disclaimers go first, as they usually sit right below the signature block
+        if self.strip_disclaimers and _mentions(lowered, _DISCLAIMER_KEYWORDS):
+            paragraphs = _PARAGRAPH_BREAK.split(cleaned)
+            kept = [paragraph for paragraph in paragraphs
+                    if not (_mentions(paragraph.lower(), _DISCLAIMER_KEYWORDS) and _DISCLAIMER.search(paragraph))]
+            if len(kept) < len(paragraphs):
+                cleaned = '\n\n'.join(kept)
+        if self.strip_signatures:
+            if '-- ' in cleaned:
+                match = _SIGNATURE_DELIMITER.search(cleaned)
+                if match:
+                    cleaned = cleaned[:match.start()]
+            if _mentions(lowered, _MOBILE_SIGNATURE_KEYWORDS):
+                cleaned = _MOBILE_SIGNATURE.sub('', cleaned)
+            cleaned = _strip_sign_off(cleaned)
+        if self.strip_tracking:
+            if _mentions(lowered, _LIST_FOOTER_KEYWORDS):
+                cleaned = _strip_list_footer(cleaned)
+            if '://' in cleaned:
+                cleaned = _URL.sub(_strip_tracking_params, cleaned)
+        for pattern in self._custom:
+            try:
+                cleaned = pattern.sub('', cleaned, timeout=PROMPT_CLEANING_PATTERN_TIMEOUT)
+            except TimeoutError:
+                logger.warning("Custom cleaning pattern %r timed out after %.2fs, skipped", pattern.pattern,
+                               PROMPT_CLEANING_PATTERN_TIMEOUT, extra={'agent_id': self.agent_id})
+        cleaned = _collapse_whitespace(cleaned)
+        if not cleaned:
+            return _collapse_whitespace(text.replace('\r\n', '\n'))
+        return cleaned
+
+    def to_dict(self) -> dict:
+        return {
+            "agent_id": self.agent_id,
+            "strip_quotes": self.strip_quotes,
+            "strip_signatures": self.strip_signatures,
+            "strip_disclaimers": self.strip_disclaimers,
+            "strip_tracking": self.strip_tracking,
+            "custom_patterns": self.custom_patterns,
+        }
+
+def validate_pattern(pattern: str) -> str:
+    try:
+        regex.compile(pattern)
+    except regex.error as e:
+        raise ValueError(f"Invalid cleaning pattern {pattern!r}: {e}")
+    return pattern
+
+_default_rules = CleaningRules()
+_agent_rules = {}  # agent_id -> CleaningRules
+_rules_lock = threading.Lock()
+
+# agent_id -> token counters of the cleaned bodies
+_stats = {}
+_stats_lock = threading.Lock()
+
+def default_rules() -> CleaningRules:
+    return _default_rules
+
+def get_agent_cleaning_rules(db, agent_id: int) -> CleaningRules:
+    """
+    Returns the agent's compiled cleaning rules (the default ones if the agent has none), compiled once.
+    """
+    with _rules_lock:
+        rules = _agent_rules.get(agent_id)
+    if rules is not None:
+        return rules
+
+    row = db.query(EmailCleaningRules).filter(EmailCleaningRules.agent_id == agent_id).first()
+    if row:
+        rules = CleaningRules(row.strip_quotes, row.strip_signatures, row.strip_disclaimers, row.strip_tracking,
+                              json.loads(row.custom_patterns or "[]"), agent_id)
+    else:
+        rules = CleaningRules(agent_id=agent_id)
+    with _rules_lock:
+        _agent_rules[agent_id] = rules
+    return rules
+
+def save_agent_cleaning_rules(db, agent_id: int, strip_quotes: bool, strip_signatures: bool,
+                              strip_disclaimers: bool, strip_tracking: bool, custom_patterns: list) -> CleaningRules:
+    """
+    Stores the agent's cleaning rules and returns them compiled.
+    """
+    row = db.query(EmailCleaningRules).filter(EmailCleaningRules.agent_id == agent_id).first()
+    if not row:
+        row = EmailCleaningRules(agent_id=agent_id)
+    row.strip_quotes = strip_quotes
+    row.strip_signatures = strip_signatures
+    row.strip_disclaimers = strip_disclaimers
+    row.strip_tracking = strip_tracking
+    row.custom_patterns = json.dumps(custom_patterns)
+    row.updated_at = datetime.utcnow()
+    db.add(row)
+    db.commit()
+
+    rules = CleaningRules(strip_quotes, strip_signatures, strip_disclaimers, strip_tracking, custom_patterns, agent_id)
+    with _rules_lock:
+        _agent_rules[agent_id] = rules
+    return rules
+
+def clean_for_prompt(text: str, rules: CleaningRules, record: bool = True) -> dict:
+    """
+    Cleans an email body before it goes into a prompt and reports what that saved:
+    returns the cleaned text with the token counts before and after, recorded (unless
+    `record` is false, e.g. for previews) in the stats of the rule set's agent.
+    """
+    cleaned = rules.clean(text)
+    original_tokens = count_tokens(text) if text else 0
+    tokens = count_tokens(cleaned) if cleaned != text else original_tokens
+    saved = original_tokens - tokens
+    if not record:
+        return {"text": cleaned, "original_tokens": original_tokens, "tokens": tokens, "tokens_saved": saved}
+    with _stats_lock:
+        counters = _stats.setdefault(rules.agent_id, {"calls": 0, "original_tokens": 0, "cleaned_tokens": 0})
+        counters["calls"] += 1
+        counters["original_tokens"] += original_tokens
+        counters["cleaned_tokens"] += tokens
+    if saved > 0:
+        metrics.PROMPT_TOKENS_SAVED.inc(saved, agent_id=metrics.agent_label(rules.agent_id))
+    logger.debug("Prompt cleaning: %d -> %d tokens", original_tokens, tokens, extra={'agent_id': rules.agent_id})
+    return {"text": cleaned, "original_tokens": original_tokens, "tokens": tokens, "tokens_saved": saved}
+
+def get_cleaning_stats(agent_id: int = None) -> dict:
+    """
+    Returns the agent's cleaning counters: bodies cleaned, their tokens before and after,
+    the tokens saved and their share of the original tokens.
+    """
+    with _stats_lock:
+        counters = dict(_stats.get(agent_id, {"calls": 0, "original_tokens": 0, "cleaned_tokens": 0}))
+    counters["tokens_saved"] = counters["original_tokens"] - counters["cleaned_tokens"]
+    counters["saved_fraction"] = (
+        round(counters["tokens_saved"] / counters["original_tokens"], 3) if counters["original_tokens"] else None
+    )
+    return counters
@@ -0,0 +1,181 @@
+import json
+import re
+import threading
+from datetime import datetime
+from app.models.filter_rules import EmailFilterRules
+from app.tasks.config import GMAIL_FILTER_STATS
+
+# Default email categories to ignore
+IGNORED_CATEGORIES = [
+    'CATEGORY_PROMOTIONS',
+    'CATEGORY_SOCIAL',
+    'CATEGORY_UPDATES', # Meta emails often land here
+    'CATEGORY_FORUMS',
+    'SPAM'
+]
+
+# Default senders to ignore (case-insensitive): full addresses, or domains,
+# which also match their subdomains (e.g. 'instagram.com' matches 'mail.instagram.com')
+IGNORED_SENDERS = [
+    'security@facebookmail.com',
+    'noreply@mail.instagram.com',
+    'facebookmail.com', # Domains to grab multiple emails from the same source
+    'instagram.com',
+    'meta.com',
+    'mail.meta.com',
+    # Add other senders or domains as needed
+]
+
+# Labels that Gmail search can express
+LABEL_QUERIES = {
+    'CATEGORY_PERSONAL': 'category:primary',
+    'CATEGORY_PROMOTIONS': 'category:promotions',
+    'CATEGORY_SOCIAL': 'category:social',
+    'CATEGORY_UPDATES': 'category:updates',
+    'CATEGORY_FORUMS': 'category:forums',
+    'IMPORTANT': 'is:important',
+    'STARRED': 'is:starred',
+}
+# messages.list leaves these out unless includeSpamTrash is set
+EXCLUDED_BY_DEFAULT = {'SPAM', 'TRASH'}
+
+_SENDER_PATTERN = re.compile(r'^[^\s@{}()"]*@?[^\s@{}()"]+$')
+
+class FilterRules:
+    """
+    A compiled ignore rule set.
+
+    Rules Gmail can evaluate (categories and senders) are turned into a messages.list query,
+    so those messages are never listed. The full set is still checked locally, for listings that
+    cannot take a query (history.list) and for labels Gmail search cannot express (user labels):
+    labels by set membership and senders by exact address or by walking the domain's suffixes,
+    so each check costs a few set lookups whatever the number of rules.
+    """
+    def __init__(self, ignored_categories: list, ignored_senders: list, agent_id: int = None):
+        self.agent_id = agent_id
+        self.ignored_categories = [label.strip() for label in ignored_categories if label.strip()]
+        self.ignored_senders = [sender.strip().lower() for sender in ignored_senders if sender.strip()]
+        self._labels = frozenset(self.ignored_categories)
+        self._addresses = frozenset(sender for sender in self.ignored_senders if '@' in sender.lstrip('@'))
+        self._domains = frozenset(sender.lstrip('@.') for sender in self.ignored_senders if '@' not in sender.lstrip('@'))
+
+        terms = [LABEL_QUERIES[label] for label in self.ignored_categories if label in LABEL_QUERIES]
+        terms += [f"from:{sender.lstrip('@')}" for sender in self.ignored_senders]
+        # {a b} is an OR in Gmail search
+        self.ignored_query = f"{{{' '.join(terms)}}}" if terms else ""
+        self.query = f"-{self.ignored_query}" if terms else ""
+        # Labels that only the local check can catch
+        self.client_side_labels = sorted(
+            label for label in self._labels if label not in LABEL_QUERIES and label not in EXCLUDED_BY_DEFAULT
+        )
+
+    def ignores_labels(self, label_ids: list) -> bool:
+        return any(label in self._labels for label in label_ids)
+
+    def ignores_sender(self, sender: str) -> bool:
+        # Extract only the sender's email address (if name is present, e.g. "Name <email@example.com>")
+        match = re.search(r'<([^>]+)>', sender)
+        address = (match.group(1) if match else sender).strip().lower()
+        if address in self._addresses:
+            return True
+        domain = address.rpartition('@')[2]
+        while domain:
+            if domain in self._domains:
+                return True
+            domain = domain.partition('.')[2]
+        return False
+
+    def ignores(self, sender: str, label_ids: list) -> bool:
+        return self.ignores_labels(label_ids) or self.ignores_sender(sender)
+
+    def to_dict(self) -> dict:
+        return {
+            "agent_id": self.agent_id,
+            "ignored_categories": self.ignored_categories,
+            "ignored_senders": self.ignored_senders,
+            "gmail_query": self.query,
+            "client_side_labels": self.client_side_labels,
+        }
+
+def validate_sender(sender: str) -> str:
+    sender = sender.strip().lower()
+    if not _SENDER_PATTERN.match(sender):
+        raise ValueError(f"Invalid sender rule: {sender!r}. Use an email address or a domain.")
+    return sender
+
+_default_rules = FilterRules(IGNORED_CATEGORIES, IGNORED_SENDERS)
+_agent_rules = {}  # agent_id -> FilterRules
+_rules_lock = threading.Lock()
+
+# agent_id -> counters of where ignored messages were filtered
+_stats = {}
+_stats_lock = threading.Lock()
+
+def default_rules() -> FilterRules:
+    return _default_rules
+
+def get_agent_rules(db, agent_id: int) -> FilterRules:
+    """
+    Returns the agent's compiled rule set (the default one if the agent has none), compiled once.
+    """
+    with _rules_lock:
+        rules = _agent_rules.get(agent_id)
+    if rules is not None:
+        return rules
+
+    row = db.query(EmailFilterRules).filter(EmailFilterRules.agent_id == agent_id).first()
+    if row:
+        rules = FilterRules(json.loads(row.ignored_categories), json.loads(row.ignored_senders), agent_id)
+    else:
+        rules = FilterRules(IGNORED_CATEGORIES, IGNORED_SENDERS, agent_id)
+    with _rules_lock:
+        _agent_rules[agent_id] = rules
+    return rules
+
+def save_agent_rules(db, agent_id: int, ignored_categories: list, ignored_senders: list) -> FilterRules:
+    """
+    Stores the agent's rule set and returns it compiled.
+    """
+    row = db.query(EmailFilterRules).filter(EmailFilterRules.agent_id == agent_id).first()
+    if not row:
+        row = EmailFilterRules(agent_id=agent_id)
+    row.ignored_categories = json.dumps(ignored_categories)
+    row.ignored_senders = json.dumps(ignored_senders)
+    row.updated_at = datetime.utcnow()
+    db.add(row)
+    db.commit()
+
+    rules = FilterRules(ignored_categories, ignored_senders, agent_id)
+    with _rules_lock:
+        _agent_rules[agent_id] = rules
+    return rules
+
+def record_filtered(rules: FilterRules, where: str, amount: int = 1):
+    """
+    Counts messages of the rule set's agent: 'listed' (returned by Gmail), or filtered
+    'server_side' (by the Gmail query), 'before_fetch' (by the listed labels or the metadata,
+    before the body is downloaded) or 'after_fetch'.
+    """
+    if amount <= 0:
+        return
+    with _stats_lock:
+        counters = _stats.setdefault(rules.agent_id, {
+            "listed": 0, "server_side": 0, "before_fetch": 0, "after_fetch": 0
+        })
+        counters[where] += amount
+
+def get_filter_stats(agent_id: int = None) -> dict:
+    """
+    Returns the agent's filter counters and the share of ignored messages filtered
+    server-side and client-side (before and after downloading the message).
+    """
+    with _stats_lock:
+        counters = dict(_stats.get(agent_id, {"listed": 0, "server_side": 0, "before_fetch": 0, "after_fetch": 0}))
+    filtered = counters["server_side"] + counters["before_fetch"] + counters["after_fetch"]
+    client_side = counters["before_fetch"] + counters["after_fetch"]
+    # The server-side count needs GMAIL_FILTER_STATS; without it the fractions only cover client-side filtering
+    counters["server_side_counted"] = GMAIL_FILTER_STATS
+    counters["filtered"] = filtered
+    counters["server_side_fraction"] = round(counters["server_side"] / filtered, 3) if filtered else None
+    counters["client_side_fraction"] = round(client_side / filtered, 3) if filtered else None
+    return counters
@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from app.apis.gmail_api import build_credentials, refresh_credentials, build_gmail_service
+from app.services.encryption import get_cipher_suite
+from app.tasks.config import (
+    GMAIL_CLIENT_CACHE_MAX_SIZE,
+    GMAIL_CLIENT_CACHE_TTL_SECONDS,
+    GMAIL_TOKEN_REFRESH_MARGIN_SECONDS
+)
+
+class _CachedClient:
+    """
+    Decrypted credentials for one agent. The lock makes concurrent callers share a single
+    token refresh. Services are not cached here: googleapiclient services (httplib2) are not
+    thread-safe, so each thread builds its own from these credentials.
+    """
+    def __init__(self, encrypted_refresh_token: bytes):
+        self.encrypted_refresh_token = encrypted_refresh_token
+        self.created_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.credentials = None
+
+# agent_id -> _CachedClient, ordered from least to most recently used
+_clients = OrderedDict()
+_clients_lock = threading.Lock()
+# Per-thread services: the scheduler, the job queue, the pipeline stages and the API
+# threadpool can all call Gmail for the same agent at once
+_thread_services = threading.local()
+
+def _get_entry(agent) -> _CachedClient:
+    with _clients_lock:
+        entry = _clients.get(agent.id)
+        expired = entry is not None and time.monotonic() - entry.created_at > GMAIL_CLIENT_CACHE_TTL_SECONDS
+        # A different refresh token in the DB means the agent was re-authorized
+        stale = entry is not None and entry.encrypted_refresh_token != agent.refresh_token
+        if entry is None or expired or stale:
+            entry = _CachedClient(agent.refresh_token)
+            _clients[agent.id] = entry
+        _clients.move_to_end(agent.id)
+        while len(_clients) > GMAIL_CLIENT_CACHE_MAX_SIZE:
+            _clients.popitem(last=False)
+        return entry
+
+def _token_is_fresh(creds) -> bool:
+    if not creds.token or not creds.expiry:
+        return False
+    # google-auth stores expiry as a naive UTC datetime
+    return creds.expiry - datetime.utcnow() > timedelta(seconds=GMAIL_TOKEN_REFRESH_MARGIN_SECONDS)
+
+def _fresh_credentials(entry: _CachedClient, agent):
+    if entry.credentials is not None and _token_is_fresh(entry.credentials):
+        return entry.credentials
+
+    with entry.lock:
+        # Another caller may have refreshed the token while we were waiting
+        if entry.credentials is None:
+            cipher = get_cipher_suite()
+            entry.credentials = build_credentials(
+                cipher.decrypt(agent.client_id).decode(),
+                cipher.decrypt(agent.client_secret).decode(),
+                cipher.decrypt(agent.refresh_token).decode()
+            )
+        if not _token_is_fresh(entry.credentials):
+            try:
+                refresh_credentials(entry.credentials)
+            except Exception:
+                invalidate_agent_gmail_client(agent.id)
+                raise
+        return entry.credentials
+
+def get_agent_gmail_credentials(agent):
+    """
+    Returns the agent's OAuth credentials with a valid access token, decrypting them and
+    refreshing the token only when needed. Concurrent callers for the same agent wait
+    for a single refresh.
+    """
+    return _fresh_credentials(_get_entry(agent), agent)
+
+def get_thread_gmail_service(agent):
+    """
+    Returns a Gmail service for the agent that belongs to the calling thread, sharing the
+    cached credentials (with a valid access token). Every caller must use it instead of
+    sharing a service between threads.
+    """
+    creds = get_agent_gmail_credentials(agent)
+    services = getattr(_thread_services, 'services', None)
+    if services is None:
+        services = _thread_services.services = {}
+    cached = services.get(agent.id)
+    if cached is None or cached[0] is not creds:
+        cached = services[agent.id] = (creds, build_gmail_service(creds, quota_key=agent.id))
+    return cached[1]
+
+def invalidate_agent_gmail_client(agent_id: int):
+    """
+    Drops the cached credentials of an agent (e.g. after a new refresh token was saved).
+    """
+    with _clients_lock:
+        _clients.pop(agent_id, None)
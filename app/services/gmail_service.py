@@ -1,7 +1,18 @@
-from app.apis.gmail_api import get_gmail_service, send_email, mark_email_as_read
+from app.apis.gmail_api import (
+    send_email, mark_email_as_read, batch_get_messages,
+    get_current_history_id, list_history_added_messages, HistoryCursorExpired, execute_request
+)
+from app.models.sync_state import GmailSyncState
+from app.services.email_filters import FilterRules, default_rules, record_filtered
+from app.services.ack_buffer import AcknowledgementBuffer
+from app.services.mime_body import extract_body
+from app.tasks.config import GMAIL_BATCH_SIZE, GMAIL_RESYNC_MAX_RESULTS, GMAIL_FILTER_STATS, GMAIL_FETCH_MODE
 from fastapi import HTTPException, status
-import re 
-import base64
+from datetime import datetime
+import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 
@@ -13,103 +24,232 @@ SCOPES = [
     'https://www.googleapis.com/auth/userinfo.profile'
 ]
 
-def fetch_recent_emails(client_id: str, client_secret: str, refresh_token: str, max_results: int = 5):
+def fetch_recent_emails(service, max_results: int = 5, rules: FilterRules = None):
     """
     Fetches the most recent emails from the Gmail inbox, ignoring promotions, spam,
-    and other categories, and specific senders.
+    and other categories, and specific senders (the given rule set, or the default one).
     Returns a list of dictionaries with sender, subject, body, and labels.
     """
-    service = get_gmail_service(client_id, client_secret, refresh_token)
-    
+    rules = rules or default_rules()
+    return _fetch_and_filter_messages(service, list_recent_messages(service, max_results, rules), rules)
+
+def _list_messages(service, rules: FilterRules, max_results: int, label_ids: list = None):
+    """
+    Runs messages.list with the Gmail query of the ignore rules, so ignored messages are not listed.
+    """
+    params = {'userId': 'me', 'maxResults': max_results}
+    if label_ids:
+        params['labelIds'] = label_ids
     try:
-        # Removed labelIds=['INBOX'] to fetch emails from all categories and filter later
-        results = service.users().messages().list(userId='me', maxResults=max_results).execute()
+        results = execute_request(service, service.users().messages().list(q=rules.query or None, **params))
+        messages = results.get('messages', [])
+        record_filtered(rules, 'listed', len(messages))
+        if GMAIL_FILTER_STATS and rules.ignored_query:
+            # Same listing restricted to the ignored messages, to count what the query left out
+            ignored = execute_request(service, service.users().messages().list(
+                q=rules.ignored_query, fields='messages/id', **params
+            ))
+            record_filtered(rules, 'server_side', len(ignored.get('messages', [])))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Erro ao buscar e-mails: {e}"
         )
+    return messages
 
-    messages = results.get('messages', [])
-    emails = []
-    
-    # Set email categories to ignore
-    IGNORED_CATEGORIES = [
-        'CATEGORY_PROMOTIONS',
-        'CATEGORY_SOCIAL',
-        'CATEGORY_UPDATES', # Meta emails often land here
-        'CATEGORY_FORUMS',
-        'SPAM'
-    ]
-
-    # Define specific senders to ignore (case-insensitive)
-    # Add the email addresses or domains you want to ignore here
-    IGNORED_SENDERS = [
-        'security@facebookmail.com',
-        'noreply@mail.instagram.com',
-        'facebookmail.com', # Domains to grab multiple emails from the same source
-        'instagram.com',
-        'meta.com',
-        'mail.meta.com',
-        # Add other senders or domains as needed
-    ]
-
-    for msg in messages:
+def list_recent_messages(service, max_results: int = 5, rules: FilterRules = None):
+    """
+    Lists the IDs of the most recent messages not excluded by the ignore rules,
+    as {'id', 'threadId'} dictionaries.
+    """
+    # Removed labelIds=['INBOX'] to fetch emails from all categories; ignored ones are filtered by the query
+    return _list_messages(service, rules or default_rules(), max_results)
+
+def list_new_messages(service, db, agent_id: int, rules: FilterRules = None, acks: AcknowledgementBuffer = None):
+    """
+    Lists the messages added to the inbox since the agent's last sync, using the stored
+    Gmail historyId cursor. If there is no cursor, or Gmail no longer has history for it,
+    falls back to a bounded resync of the newest unread messages.
+    Ignored messages dropped here are marked as read through `acks` (immediately if not given).
+    Returns a tuple (messages, history_id) where messages are {'id', 'threadId'} dictionaries.
+    """
+    rules = rules or default_rules()
+    state = db.query(GmailSyncState).filter(GmailSyncState.agent_id == agent_id).first()
+
+    if state and state.history_id:
         try:
-            msg_data = service.users().messages().get(userId='me', id=msg['id'], format='full').execute()
-            headers = msg_data['payload']['headers']
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '')
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), '')
-            label_ids = msg_data.get('labelIds', [])
-            
-            should_ignore = False
-
-            # Filter by category (if the email has any of the ignored categories)
-            for label in label_ids:
-                if label in IGNORED_CATEGORIES:
-                    should_ignore = True
-                    break
-
-            # Filter by sender (if not already ignored by category)
-            if not should_ignore:
-                # Extract only the sender's email address (if name is present, e.g. "Name <email@example.com>")
-                sender_email_match = re.search(r'<([^>]+)>', sender)
-                sender_address = sender_email_match.group(1).lower() if sender_email_match else sender.lower()
-
-                for ignored_sender in IGNORED_SENDERS:
-                    # Checks if the ignored sender is contained in the sender's email address
-                    if ignored_sender.lower() in sender_address:
-                        should_ignore = True
-                        break
-
-            if should_ignore:
-                print(f"Ignorando e-mail indesejado: '{subject}' de '{sender}' (Labels: {label_ids})")
-                # Mark as read to not process again in future runs
-                mark_email_as_read(service, msg['id'])
-                continue # Skip to the next email
-            
-            # Extract email body (plain text only)
-            body = ''
-            if 'parts' in msg_data['payload']:
-                for part in msg_data['payload']['parts']:
-                    if part['mimeType'] == 'text/plain' and 'body' in part and 'data' in part['body']:
-                        body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-                        break
-            else:
-                if 'body' in msg_data['payload'] and 'data' in msg_data['payload']['body']:
-                    body = base64.urlsafe_b64decode(msg_data['payload']['body']['data']).decode('utf-8')
-            
-            emails.append({
-                'id': msg['id'],
-                'threadId': msg['threadId'],
-                'subject': subject,
-                'from': sender,
-                'body': body,
-                'labelIds': label_ids
-            })
-        except Exception as e:
-            print(f"Erro ao processar mensagem {msg.get('id', 'N/A')}: {e}")
+            added, history_id = list_history_added_messages(service, state.history_id)
+            record_filtered(rules, 'listed', len(added))
+            # Only unread messages still need processing (our own replies are never UNREAD)
+            messages = [msg for msg in added if 'UNREAD' in msg.get('labelIds', [])]
+            # history.list takes no query, but it returns the labels, so ignored categories
+            # are dropped (and marked read) without downloading the messages
+            ignored = [msg for msg in messages if rules.ignores_labels(msg.get('labelIds', []))]
+            if ignored:
+                buffer = acks if acks is not None else AcknowledgementBuffer(lambda: service)
+                for msg in ignored:
+                    buffer.add(msg['id'])
+                if acks is None:
+                    buffer.flush()
+                record_filtered(rules, 'before_fetch', len(ignored))
+                messages = [msg for msg in messages if not rules.ignores_labels(msg.get('labelIds', []))]
+            return messages, history_id
+        except HistoryCursorExpired:
+            logger.warning("History cursor %s expired for agent %s, running a full resync.", state.history_id, agent_id,
+                           extra={'agent_id': agent_id})
+
+    # Read the cursor before listing so that nothing arriving during the resync is missed
+    history_id = get_current_history_id(service)
+    return _list_messages(service, rules, GMAIL_RESYNC_MAX_RESULTS, label_ids=['INBOX', 'UNREAD']), history_id
+
+def save_history_cursor(db, agent_id: int, history_id: str):
+    """
+    Stores the agent's Gmail historyId cursor for the next incremental sync.
+    """
+    state = db.query(GmailSyncState).filter(GmailSyncState.agent_id == agent_id).first()
+    if not state:
+        state = GmailSyncState(agent_id=agent_id)
+    state.history_id = history_id
+    state.updated_at = datetime.utcnow()
+    db.add(state)
+    db.commit()
+
+# Phase one of the two-phase fetch: labels and the headers used by the filters and the parser
+METADATA_HEADERS = ['Subject', 'From', 'Date', 'Content-Type']
+METADATA_FIELDS = 'id,threadId,labelIds,payload/headers'
+# Phase two: only the body parts (the top-level headers come from phase one)
+BODY_FIELDS = 'id,payload(mimeType,filename,body(data,attachmentId),parts)'
+
+def _response_size(data) -> int:
+    # Size of the JSON Gmail returned (before any transport compression)
+    return len(json.dumps(data, separators=(',', ':'))) if data else 0
+
+def iter_fetched_messages(service, messages: list, batch_size: int = GMAIL_BATCH_SIZE,
+                          rules: FilterRules = None, acks: AcknowledgementBuffer = None,
+                          on_ignored=None, transfer: dict = None, mode: str = GMAIL_FETCH_MODE,
+                          on_error=None):
+    """
+    Fetches the given messages ({'id', 'threadId'} dictionaries) one batch at a time and
+    yields (msg, msg_data) tuples in order, so that only one batch of bodies is held at once.
+    Messages that could not be fetched are reported, passed to on_error(msg) if given, and skipped.
+
+    With mode="two-phase" and a rule set, the labels and headers are fetched first
+    (format=metadata with a `fields` mask) and only the messages that pass the rules have their
+    body parts fetched; ignored ones are marked as read (through `acks` if given) and passed
+    to on_ignored(msg). If given, `transfer` accumulates the 'metadata_bytes' and 'body_bytes'
+    of the responses.
+    """
+    transfer = transfer if transfer is not None else {}
+    transfer.setdefault('metadata_bytes', 0)
+    transfer.setdefault('body_bytes', 0)
+    two_phase = mode == "two-phase" and rules is not None
+
+    for start in range(0, len(messages), batch_size):
+        chunk = messages[start:start + batch_size]
+        if not two_phase:
+            fetched = batch_get_messages(service, [msg['id'] for msg in chunk], format='full', batch_size=batch_size)
+            for msg, (msg_id, msg_data, error) in zip(chunk, fetched):
+                if error is not None:
+                    logger.error("Erro ao buscar mensagem %s: %s", msg_id, error)
+                    if on_error is not None:
+                        on_error(msg)
+                    continue
+                transfer['body_bytes'] += _response_size(msg_data)
+                yield msg, msg_data
             continue
+
+        metadata = batch_get_messages(
+            service, [msg['id'] for msg in chunk], format='metadata', batch_size=batch_size,
+            fields=METADATA_FIELDS, metadata_headers=METADATA_HEADERS
+        )
+        wanted = []
+        for msg, (msg_id, msg_data, error) in zip(chunk, metadata):
+            if error is not None:
+                logger.error("Erro ao buscar mensagem %s: %s", msg_id, error)
+                if on_error is not None:
+                    on_error(msg)
+                continue
+            transfer['metadata_bytes'] += _response_size(msg_data)
+            headers = msg_data.get('payload', {}).get('headers', [])
+            sender = next((h['value'] for h in headers if h['name'] == 'From'), '')
+            if rules.ignores(sender, msg_data.get('labelIds', [])):
+                record_filtered(rules, 'before_fetch')
+                subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '')
+                logger.info("Ignorando e-mail indesejado: '%s' de '%s' (Labels: %s)", subject, sender, msg_data.get('labelIds', []))
+                if acks is not None:
+                    acks.add(msg_id)
+                else:
+                    mark_email_as_read(service, msg_id)
+                if on_ignored is not None:
+                    on_ignored(msg)
+                continue
+            wanted.append((msg, msg_data))
+
+        bodies = batch_get_messages(
+            service, [msg['id'] for msg, _ in wanted], format='full', batch_size=batch_size, fields=BODY_FIELDS
+        )
+        for (msg, msg_data), (msg_id, body_data, error) in zip(wanted, bodies):
+            if error is not None:
+                logger.error("Erro ao buscar mensagem %s: %s", msg_id, error)
+                if on_error is not None:
+                    on_error(msg)
+                continue
+            transfer['body_bytes'] += _response_size(body_data)
+            payload = body_data.get('payload', {})
+            payload['headers'] = msg_data.get('payload', {}).get('headers', [])
+            yield msg, dict(msg_data, payload=payload)
+
+def _fetch_and_filter_messages(service, messages: list, rules: FilterRules = None):
+    """
+    Fetches the given messages ({'id', 'threadId'} dictionaries), marks the unwanted ones
+    as read and returns the remaining ones as dictionaries with sender, subject, body, and labels.
+    """
+    emails = []
+    # The unwanted messages are marked as read together, in one batchModify call
+    with AcknowledgementBuffer(lambda: service) as acks:
+        for msg, msg_data in iter_fetched_messages(service, messages, rules=rules or default_rules(), acks=acks):
+            email = parse_message(service, msg, msg_data, rules, acks)
+            if email is not None:
+                emails.append(email)
     return emails
 
+def parse_message(service, msg: dict, msg_data: dict, rules: FilterRules = None, acks: AcknowledgementBuffer = None):
+    """
+    Parses a fetched message into a dictionary with sender, subject, body, and labels.
+    Unwanted messages (ignored categories or senders, by the given rule set or the default one)
+    are marked as read, through `acks` if given, and None is returned.
+    """
+    rules = rules or default_rules()
+    try:
+        headers = msg_data['payload']['headers']
+        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '')
+        sender = next((h['value'] for h in headers if h['name'] == 'From'), '')
+        date = next((h['value'] for h in headers if h['name'] == 'Date'), '')
+        label_ids = msg_data.get('labelIds', [])
+        
+        # Filter by category or sender (rules Gmail could not apply, e.g. for history listings)
+        if rules.ignores(sender, label_ids):
+            record_filtered(rules, 'after_fetch')
+            logger.info("Ignorando e-mail indesejado: '%s' de '%s' (Labels: %s)", subject, sender, label_ids)
+            # Mark as read to not process again in future runs
+            if acks is not None:
+                acks.add(msg['id'])
+            else:
+                mark_email_as_read(service, msg['id'])
+            return None
+        
+        # Extract email body (plain text, or HTML converted to text)
+        body = extract_body(msg_data['payload'])
 
+        return {
+            'id': msg['id'],
+            'threadId': msg['threadId'],
+            'subject': subject,
+            'from': sender,
+            'date': date,
+            'body': body,
+            'labelIds': label_ids
+        }
+    except Exception as e:
+        logger.error("Erro ao processar mensagem %s: %s", msg.get('id', 'N/A'), e)
+        return None
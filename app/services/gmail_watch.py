@@ -0,0 +1,190 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from app.apis.database_connection import SessionLocal
+from app.apis.gmail_api import watch_mailbox, stop_watch
+from app.models.gmail_agents import GmailAgent
+from app.models.gmail_watch import GmailWatch
+from app.models.sync_state import GmailSyncState
+from app.services.gmail_client_cache import get_thread_gmail_service
+from app.tasks.job_queue import enqueue_process_emails
+from app.tasks.config import (
+    GMAIL_WATCH_TOPIC,
+    GMAIL_WATCH_LABEL_IDS,
+    GMAIL_WATCH_RENEW_BEFORE_SECONDS,
+    GMAIL_WATCH_CHECK_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+_renewer_thread = None
+_renewer_stop = threading.Event()
+# Serialises the duplicate check of notifications with the update of the last notified historyId
+_notification_lock = threading.Lock()
+
+def watch_to_dict(watch: GmailWatch) -> dict:
+    return {
+        "agent_id": watch.agent_id,
+        "topic_name": watch.topic_name,
+        "history_id": watch.history_id,
+        "expiration": watch.expiration.isoformat() if watch.expiration else None,
+        "renewed_at": watch.renewed_at.isoformat() if watch.renewed_at else None,
+        "last_notified_history_id": watch.last_notified_history_id,
+        "last_notified_at": watch.last_notified_at.isoformat() if watch.last_notified_at else None,
+        "error": watch.error,
+        "stopped_at": watch.stopped_at.isoformat() if watch.stopped_at else None,
+    }
+
+def register_watch(db, agent: GmailAgent, topic_name: str = None) -> dict:
+    """
+    Registers (or renews) the agent's Gmail watch on the topic and stores its expiration,
+    resuming a stopped watch. A failed registration is stored in the watch's error and raised.
+    """
+    topic_name = topic_name or GMAIL_WATCH_TOPIC
+    if not topic_name:
+        raise ValueError("GMAIL_WATCH_TOPIC is not configured.")
+    watch = db.get(GmailWatch, agent.id) or GmailWatch(agent_id=agent.id)
+    watch.topic_name = topic_name
+    watch.stopped_at = None
+    db.add(watch)
+    try:
+        response = watch_mailbox(get_thread_gmail_service(agent), topic_name, GMAIL_WATCH_LABEL_IDS)
+    except Exception as e:
+        watch.error = str(getattr(e, 'detail', e))
+        db.commit()
+        raise
+    watch.history_id = str(response['historyId'])
+    watch.expiration = datetime.utcfromtimestamp(int(response['expiration']) / 1000)
+    watch.renewed_at = datetime.utcnow()
+    watch.error = None
+    db.commit()
+    return watch_to_dict(watch)
+
+def unregister_watch(db, agent: GmailAgent) -> bool:
+    """
+    Stops the agent's Gmail watch. Returns False if the agent had none, or it was already stopped.
+    The row is kept, marked as stopped, so the renewer does not register the watch again.
+    """
+    watch = db.get(GmailWatch, agent.id)
+    if watch is None or watch.stopped_at is not None:
+        return False
+    stop_watch(get_thread_gmail_service(agent))
+    watch.stopped_at = datetime.utcnow()
+    watch.expiration = None
+    db.commit()
+    return True
+
+def list_watches(db) -> list:
+    return [watch_to_dict(watch) for watch in db.query(GmailWatch).order_by(GmailWatch.agent_id).all()]
+
+def renew_due_watches() -> int:
+    """
+    Registers a watch for every agent that has none (or a failed one) and renews the watches
+    expiring within GMAIL_WATCH_RENEW_BEFORE_SECONDS. Watches stopped through the API are
+    skipped. Returns the number registered.
+    """
+    renew_before = datetime.utcnow() + timedelta(seconds=GMAIL_WATCH_RENEW_BEFORE_SECONDS)
+    db = SessionLocal()
+    try:
+        watches = {agent_id: (expiration, stopped_at) for agent_id, expiration, stopped_at in
+                   db.query(GmailWatch.agent_id, GmailWatch.expiration, GmailWatch.stopped_at).all()}
+        agents = []
+        for agent in db.query(GmailAgent).filter(GmailAgent.refresh_token.isnot(None)).all():
+            expiration, stopped_at = watches.get(agent.id, (None, None))
+            if stopped_at is None and (expiration is None or expiration <= renew_before):
+                agents.append(agent)
+        registered = 0
+        for agent in agents:
+            try:
+                register_watch(db, agent)
+                registered += 1
+            except Exception as e:
+                logger.error("Could not register the Gmail watch of agent %s: %s", agent.id, getattr(e, 'detail', e),
+                             extra={'agent_id': agent.id})
+        return registered
+    finally:
+        db.close()
+
+def _history_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def handle_notification(email_address: str, history_id) -> dict:
+    """
+    Handles a Gmail push notification: finds the agent of the mailbox and queues the processing
+    of its mailbox, unless the notification is a duplicate or older than the agent's sync cursor.
+
+    Notifications that arrive while the agent has a queued job are coalesced into it (the job
+    reads all the changes since the cursor); while a job is running, a single follow-up job is
+    queued for the changes it may have missed.
+
+    Returns {'agent_id', 'action', 'job_id'}, the action being one of 'queued', 'coalesced',
+    'follow_up', 'duplicate', 'stale' or 'unknown_agent'.
+    """
+    notified = _history_id(history_id)
+    db = SessionLocal()
+    try:
+        # Pub/Sub sends the canonical lowercase address; agents may be stored with another case
+        agent = db.query(GmailAgent).filter(func.lower(GmailAgent.email_gmail) == email_address.lower()).first()
+        if agent is None:
+            return {"agent_id": None, "action": "unknown_agent", "job_id": None}
+        agent_id = agent.id
+
+        with _notification_lock:
+            watch = db.get(GmailWatch, agent_id)
+            if watch is None:
+                # Notifications can arrive for watches registered outside this API
+                watch = GmailWatch(agent_id=agent_id)
+                db.add(watch)
+            last_notified = _history_id(watch.last_notified_history_id)
+            if notified is not None and last_notified is not None and notified <= last_notified:
+                return {"agent_id": agent_id, "action": "duplicate", "job_id": None}
+            if notified is not None:
+                watch.last_notified_history_id = str(notified)
+            watch.last_notified_at = datetime.utcnow()
+            db.commit()
+
+        cursor = db.get(GmailSyncState, agent_id)
+        if notified is not None and cursor is not None and (_history_id(cursor.history_id) or 0) >= notified:
+            return {"agent_id": agent_id, "action": "stale", "job_id": None}
+    finally:
+        db.close()
+
+    job, created = enqueue_process_emails(agent_id, follow_up=True)
+    if created:
+        action = "queued"
+    else:
+        action = "follow_up" if job["status"] == 'running' else "coalesced"
+    return {"agent_id": agent_id, "action": action, "job_id": job["job_id"]}
+
+def _renew_loop():
+    while True:
+        try:
+            renew_due_watches()
+        except Exception as e:
+            logger.exception("Gmail watch renewal failed: %s", e)
+        if _renewer_stop.wait(GMAIL_WATCH_CHECK_SECONDS):
+            return
+
+def start_renewer():
+    """
+    Starts a background thread that registers missing watches and renews expiring ones,
+    now and every GMAIL_WATCH_CHECK_SECONDS.
+    """
+    global _renewer_thread
+    if _renewer_thread is not None:
+        return
+    _renewer_stop.clear()
+    _renewer_thread = threading.Thread(target=_renew_loop, name="gmail-watch-renewer", daemon=True)
+    _renewer_thread.start()
+
+def stop_renewer():
+    global _renewer_thread
+    if _renewer_thread is None:
+        return
+    _renewer_stop.set()
+    _renewer_thread.join()
+    _renewer_thread = None
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from app.apis.database_connection import SessionLocal
+from app.models.llm_cache import LLMCacheEntry
+from app.tasks.config import (
+    LLM_CACHE_MEMORY_SIZE,
+    LLM_CACHE_MAX_ENTRIES,
+    LLM_CACHE_TTL_SECONDS
+)
+
+# The persistent tier is pruned (expired and excess entries) once every this many stores
+_PRUNE_EVERY = 100
+
+_memory = OrderedDict()  # key -> (response, stored_at monotonic time)
+_lock = threading.Lock()
+_stats = {
+    "memory_hits": 0,
+    "persistent_hits": 0,
+    "misses": 0,
+    "stores": 0,
+    "evictions": 0,
+}
+_stores_since_prune = 0
+
+def cache_key(**params) -> str:
+    """
+    Returns a content address for an LLM call: the SHA-256 of its model, prompt and
+    generation parameters.
+    """
+    payload = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _count(name: str, amount: int = 1):
+    with _lock:
+        _stats[name] += amount
+
+def _remember(key: str, response: str):
+    with _lock:
+        _memory[key] = (response, time.monotonic())
+        _memory.move_to_end(key)
+        while len(_memory) > LLM_CACHE_MEMORY_SIZE:
+            _memory.popitem(last=False)
+            _stats["evictions"] += 1
+
+def get(key: str):
+    """
+    Returns the cached response for `key`, looking in memory first and then in the
+    database, or None if there is no fresh entry.
+    """
+    with _lock:
+        cached = _memory.get(key)
+        if cached is not None:
+            response, stored_at = cached
+            if time.monotonic() - stored_at <= LLM_CACHE_TTL_SECONDS:
+                _memory.move_to_end(key)
+                _stats["memory_hits"] += 1
+                return response
+            del _memory[key]
+
+    db = SessionLocal()
+    try:
+        entry = db.query(LLMCacheEntry).filter(LLMCacheEntry.key == key).first()
+        if entry and entry.created_at >= datetime.utcnow() - timedelta(seconds=LLM_CACHE_TTL_SECONDS):
+            response = entry.response
+        else:
+            response = None
+    finally:
+        db.close()
+
+    if response is None:
+        _count("misses")
+        return None
+    _count("persistent_hits")
+    _remember(key, response)
+    return response
+
+def put(key: str, response: str):
+    """
+    Stores a response in both cache tiers.
+    """
+    global _stores_since_prune
+    _remember(key, response)
+
+    db = SessionLocal()
+    try:
+        db.merge(LLMCacheEntry(key=key, response=response, created_at=datetime.utcnow()))
+        db.commit()
+    finally:
+        db.close()
+
+    with _lock:
+        _stats["stores"] += 1
+        _stores_since_prune += 1
+        should_prune = _stores_since_prune >= _PRUNE_EVERY
+        if should_prune:
+            _stores_since_prune = 0
+    if should_prune:
+        prune()
+
+def prune():
+    """
+    Deletes expired entries from the persistent tier, then the oldest ones beyond LLM_CACHE_MAX_ENTRIES.
+    """
+    db = SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(seconds=LLM_CACHE_TTL_SECONDS)
+        removed = db.query(LLMCacheEntry).filter(LLMCacheEntry.created_at < cutoff).delete()
+
+        excess = db.query(LLMCacheEntry).count() - LLM_CACHE_MAX_ENTRIES
+        if excess > 0:
+            oldest = db.query(LLMCacheEntry.key).order_by(LLMCacheEntry.created_at).limit(excess).scalar_subquery()
+            removed += db.query(LLMCacheEntry).filter(LLMCacheEntry.key.in_(oldest)).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+    if removed:
+        _count("evictions", removed)
+
+def get_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+        stats["memory_entries"] = len(_memory)
+    lookups = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+    stats["hit_ratio"] = round((stats["memory_hits"] + stats["persistent_hits"]) / lookups, 4) if lookups else 0.0
+    return stats
@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from app.apis.database_connection import SessionLocal
+from app.models.message_ledger import ProcessedMessage
+from app.tasks.config import LEDGER_RETENTION_DAYS, LEDGER_PRUNE_INTERVAL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Message IDs per IN (...) query, below SQLite's bound parameter limit
+_QUERY_CHUNK = 500
+
+_last_prune = None
+_prune_lock = threading.Lock()
+
+def _state(entry: ProcessedMessage) -> dict:
+    return {
+        'message_id': entry.message_id,
+        'thread_id': entry.thread_id,
+        'subject': entry.subject,
+        'from': entry.sender,
+        'summary': entry.summary,
+        'replied': entry.replied_at is not None,
+        'acknowledged': entry.acknowledged_at is not None,
+    }
+
+def load_states(agent_id: int, message_ids: list) -> dict:
+    """
+    Returns the ledger state of the agent's messages that have one, as a dict mapping each
+    message ID to {'message_id', 'thread_id', 'subject', 'from', 'summary', 'replied', 'acknowledged'}.
+    """
+    states = {}
+    db = SessionLocal()
+    try:
+        for start in range(0, len(message_ids), _QUERY_CHUNK):
+            entries = (
+                db.query(ProcessedMessage)
+                .filter(
+                    ProcessedMessage.agent_id == agent_id,
+                    ProcessedMessage.message_id.in_(message_ids[start:start + _QUERY_CHUNK])
+                )
+                .all()
+            )
+            states.update((entry.message_id, _state(entry)) for entry in entries)
+    finally:
+        db.close()
+    return states
+
+def _update(agent_id: int, message_id: str, **fields):
+    db = SessionLocal()
+    try:
+        entry = db.get(ProcessedMessage, (agent_id, message_id))
+        if entry is None:
+            entry = ProcessedMessage(agent_id=agent_id, message_id=message_id)
+            db.add(entry)
+        for name, value in fields.items():
+            setattr(entry, name, value)
+        entry.updated_at = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+def record_summary(agent_id: int, email: dict, summary: str):
+    """
+    Records that the email was summarised, keeping what the consolidated digest needs.
+    """
+    _update(agent_id, email['id'], thread_id=email.get('threadId'), subject=email.get('subject'),
+            sender=email.get('from'), summary=summary)
+
+def record_reply(agent_id: int, email: dict, reply_message_id: str):
+    """
+    Records that the reply to the email was sent.
+    """
+    _update(agent_id, email['id'], thread_id=email.get('threadId'), subject=email.get('subject'),
+            sender=email.get('from'), reply_message_id=reply_message_id, replied_at=datetime.utcnow())
+
+def record_acknowledged(agent_id: int, message_ids: list):
+    """
+    Records that the messages were marked as read, in one UPDATE per chunk of IDs.
+    """
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        for start in range(0, len(message_ids), _QUERY_CHUNK):
+            chunk = message_ids[start:start + _QUERY_CHUNK]
+            existing = {
+                message_id for (message_id,) in db.query(ProcessedMessage.message_id).filter(
+                    ProcessedMessage.agent_id == agent_id, ProcessedMessage.message_id.in_(chunk)
+                )
+            }
+            db.query(ProcessedMessage).filter(
+                ProcessedMessage.agent_id == agent_id, ProcessedMessage.message_id.in_(existing)
+            ).update({'acknowledged_at': now, 'updated_at': now}, synchronize_session=False)
+            db.add_all(
+                ProcessedMessage(agent_id=agent_id, message_id=message_id, acknowledged_at=now, updated_at=now)
+                for message_id in chunk if message_id not in existing
+            )
+        db.commit()
+    finally:
+        db.close()
+
+def prune(retention_days: int = LEDGER_RETENTION_DAYS) -> int:
+    """
+    Deletes the ledger entries not updated within the retention period. Returns the number deleted.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    db = SessionLocal()
+    try:
+        deleted = db.query(ProcessedMessage).filter(ProcessedMessage.updated_at < cutoff).delete(
+            synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+    return deleted
+
+def prune_if_due() -> int:
+    """
+    Runs prune() if it has not run in this process within LEDGER_PRUNE_INTERVAL_SECONDS.
+    """
+    global _last_prune
+    with _prune_lock:
+        now = time.monotonic()
+        if _last_prune is not None and now - _last_prune < LEDGER_PRUNE_INTERVAL_SECONDS:
+            return 0
+        _last_prune = now
+    deleted = prune()
+    if deleted:
+        logger.info("Pruned %d processed-message ledger entries older than %d days.", deleted, LEDGER_RETENTION_DAYS)
+    return deleted
@@ -0,0 +1,281 @@
+import bisect
+import importlib.util
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from app.tasks.config import METRICS_ENABLED, METRICS_AGENT_LABELS, OTEL_TRACING_ENABLED
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histograms, from a cache hit to a slow LLM call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """
+    A monotonically increasing count per combination of label values.
+    """
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> list:
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    """
+    Observations (durations, in seconds) counted in cumulative buckets per combination of
+    label values, with their sum and count, like a Prometheus histogram.
+    """
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def collect(self) -> list:
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+STAGE_SECONDS = Histogram(
+    "gmail_agent_stage_duration_seconds",
+    "Duration of each email pipeline stage call.",
+    ("stage", "agent_id", "outcome")
+)
+EXTERNAL_CALL_SECONDS = Histogram(
+    "gmail_agent_external_call_duration_seconds",
+    "Duration of each call to Gmail, OpenAI or a webhook, without the time waiting for the rate limiter.",
+    ("service", "operation", "outcome")
+)
+RUNS_TOTAL = Counter("gmail_agent_runs_total", "Email processing runs.", ("agent_id", "outcome"))
+RUN_SECONDS = Histogram(
+    "gmail_agent_run_duration_seconds", "Duration of the email processing runs.", ("agent_id", "outcome")
+)
+EMAILS_TOTAL = Counter(
+    "gmail_agent_emails_total",
+    "Emails seen by the processing runs, by result (processed, ignored, skipped, failed).",
+    ("agent_id", "result")
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "gmail_agent_http_request_duration_seconds",
+    "Duration of the API requests, by route template and status code.",
+    ("method", "route", "status")
+)
+UNHANDLED_ERRORS_TOTAL = Counter(
+    "gmail_agent_unhandled_errors_total", "Exceptions caught by the generic exception handler.", ("route",)
+)
+PROMPT_TOKENS_SAVED = Counter(
+    "gmail_agent_prompt_tokens_saved_total",
+    "Tokens removed from the email bodies by the prompt cleaning, before the LLM calls.",
+    ("agent_id",)
+)
+
+_REGISTRY = [STAGE_SECONDS, EXTERNAL_CALL_SECONDS, RUNS_TOTAL, RUN_SECONDS, EMAILS_TOTAL,
+             HTTP_REQUEST_SECONDS, UNHANDLED_ERRORS_TOTAL, PROMPT_TOKENS_SAVED]
+
+def render() -> str:
+    """
+    Returns every metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+def agent_label(agent_id) -> str:
+    # With METRICS_AGENT_LABELS=false all agents share one series, keeping the cardinality fixed
+    return str(agent_id) if METRICS_AGENT_LABELS else ""
+
+def error_outcome(error) -> str:
+    """
+    Returns the outcome label of a failed call: "rate_limited" for HTTP 429, otherwise "error".
+    """
+    resp = getattr(error, 'resp', None)  # googleapiclient HttpError
+    status = getattr(resp, 'status', None) or getattr(error, 'status_code', None)  # openai.APIStatusError
+    return "rate_limited" if status == 429 else "error"
+
+# --- Tracing ---
+
+_tracer = None
+_tracer_loaded = False
+_tracer_lock = threading.Lock()
+
+def _get_tracer():
+    """
+    Returns the OpenTelemetry tracer, or None if tracing is disabled or opentelemetry is not installed.
+    Exporting the spans is configured the standard OpenTelemetry way (e.g. opentelemetry-instrument).
+    """
+    global _tracer, _tracer_loaded
+    if _tracer_loaded:
+        return _tracer
+    with _tracer_lock:
+        if not _tracer_loaded:
+            if OTEL_TRACING_ENABLED and importlib.util.find_spec("opentelemetry") is not None:
+                from opentelemetry import trace
+                _tracer = trace.get_tracer("gmail-agent")
+            elif OTEL_TRACING_ENABLED:
+                logger.warning("OTEL_TRACING_ENABLED is set but opentelemetry-api is not installed; spans are disabled.")
+            _tracer_loaded = True
+    return _tracer
+
+# Used instead of a span when tracing is off, so the hot path only pays for the timing
+_NO_SPAN = nullcontext()
+
+@contextmanager
+def external_call(service: str, operation: str, **attributes):
+    """
+    Times a call to an external service (and wraps it in a span when tracing is enabled).
+    The outcome label is "ok", "rate_limited" or "error", from the exception raised, if any;
+    calls that fail without raising set it in the yielded dictionary (call["outcome"]).
+    """
+    started = time.perf_counter()
+    call = {"outcome": "ok"}
+    tracer = _get_tracer()
+    span = _NO_SPAN if tracer is None else tracer.start_as_current_span(
+        f"{service} {operation}", attributes={"service": service, "operation": operation, **attributes}
+    )
+    with span:
+        try:
+            yield call
+        except BaseException as e:
+            call["outcome"] = error_outcome(e)
+            raise
+        finally:
+            EXTERNAL_CALL_SECONDS.observe(
+                time.perf_counter() - started, service=service, operation=operation, outcome=call["outcome"]
+            )
+
+@contextmanager
+def stage(name: str, agent_id):
+    """
+    Times a stage of an agent's email processing, with outcome "ok" or "error".
+    """
+    started = time.perf_counter()
+    outcome = "ok"
+    tracer = _get_tracer()
+    span = _NO_SPAN if tracer is None else tracer.start_as_current_span(
+        f"stage {name}", attributes={"stage": name, "agent_id": str(agent_id)}
+    )
+    with span:
+        try:
+            yield
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage=name, agent_id=agent_label(agent_id), outcome=outcome)
+
+def timed_iter(iterable, name: str, agent_id):
+    """
+    Yields the items of `iterable`, timing the production of each one as the `name` stage.
+    """
+    iterator = iter(iterable)
+    agent = agent_label(agent_id)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        except Exception:
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage=name, agent_id=agent, outcome="error")
+            raise
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=name, agent_id=agent, outcome="ok")
+        yield item
+
+def record_run(agent_id, seconds: float, stats: dict = None):
+    """
+    Records a processing run: its duration and outcome, and the emails per result from its statistics.
+    """
+    agent = agent_label(agent_id)
+    outcome = "ok" if stats is not None else "error"
+    RUNS_TOTAL.inc(agent_id=agent, outcome=outcome)
+    RUN_SECONDS.observe(seconds, agent_id=agent, outcome=outcome)
+    for result in ('processed', 'ignored', 'skipped', 'failed'):
+        if stats and stats.get(result):
+            EMAILS_TOTAL.inc(stats[result], agent_id=agent, result=result)
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records the duration of each HTTP request by route template
+    (e.g. /api/tasks/{job_id}), so paths with IDs do not create a series each.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status[0])
+            )
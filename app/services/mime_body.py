@@ -0,0 +1,90 @@
+import base64
+import codecs
+import html
+import re
+from app.tasks.config import EMAIL_BODY_MAX_BYTES
+
+_CHARSET = re.compile(r'charset\s*=\s*"?([\w.:-]+)', re.IGNORECASE)
+_HIDDEN_BLOCKS = re.compile(r'<(script|style|head)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_COMMENTS = re.compile(r'<!--.*?-->', re.DOTALL)
+_LINE_BREAKS = re.compile(r'<(br|/p|/div|/li|/tr|/h[1-6]|/blockquote)\b[^>]*>', re.IGNORECASE)
+_TAGS = re.compile(r'<[^>]+>')
+_SPACES = re.compile(r'[ \t\r\f\v]+')
+_BLANK_LINES = re.compile(r'\n\s*\n+')
+
+def _header(part: dict, name: str) -> str:
+    name = name.lower()
+    return next((h['value'] for h in part.get('headers', []) if h['name'].lower() == name), '')
+
+def _is_attachment(part: dict) -> bool:
+    body = part.get('body', {})
+    return bool(
+        part.get('filename')
+        or body.get('attachmentId')
+        or _header(part, 'Content-Disposition').lower().startswith('attachment')
+    )
+
+def decode_part_data(part: dict, max_bytes: int = EMAIL_BODY_MAX_BYTES) -> str:
+    """
+    Decodes at most `max_bytes` bytes of a part's base64url body data, in the part's charset.
+    Only the needed prefix of the encoded data is decoded.
+    """
+    data = part.get('body', {}).get('data')
+    if not data:
+        return ''
+    # 4 base64 characters encode 3 bytes
+    encoded = data[:-(-max_bytes // 3) * 4] if max_bytes > 0 else data
+    raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+    if max_bytes > 0:
+        raw = raw[:max_bytes]
+
+    match = _CHARSET.search(_header(part, 'Content-Type'))
+    charset = match.group(1) if match else 'utf-8'
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        charset = 'utf-8'
+    # A character cut by the byte limit is replaced instead of failing the whole body
+    return raw.decode(charset, errors='replace')
+
+def html_to_text(markup: str) -> str:
+    """
+    Converts HTML to plain text with a few regular expressions: drops scripts, styles and
+    tags, keeps block boundaries as line breaks and unescapes entities.
+    """
+    text = _HIDDEN_BLOCKS.sub('', markup)
+    text = _COMMENTS.sub('', text)
+    text = _LINE_BREAKS.sub('\n', text)
+    text = html.unescape(_TAGS.sub('', text))
+    text = _SPACES.sub(' ', text)
+    return _BLANK_LINES.sub('\n\n', text).strip()
+
+def extract_body(payload: dict, max_bytes: int = EMAIL_BODY_MAX_BYTES) -> str:
+    """
+    Returns the text body of a Gmail message payload.
+
+    The MIME tree is walked iteratively (depth-first, in document order), so nested
+    multipart/alternative and multipart/mixed parts are found at any depth. The first
+    text/plain part is used; if there is none, the first text/html part is converted to text.
+    Attachment parts are skipped without being decoded, and at most `max_bytes` bytes of the
+    chosen part are decoded (0 for no limit).
+    """
+    html_part = None
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        children = part.get('parts')
+        if children:
+            stack.extend(reversed(children))
+            continue
+        if _is_attachment(part):
+            continue
+        mime_type = part.get('mimeType', '').lower()
+        if mime_type == 'text/plain' and part.get('body', {}).get('data'):
+            return decode_part_data(part, max_bytes)
+        if mime_type == 'text/html' and html_part is None and part.get('body', {}).get('data'):
+            html_part = part
+
+    if html_part is not None:
+        return html_to_text(decode_part_data(html_part, max_bytes))
+    return ''
@@ -1,7 +1,57 @@
-from app.apis.openai_api import generate_text as call_openai_api
+import asyncio
+from app.apis.openai_api import generate_text as call_openai_api, stream_text as stream_openai_api, SYSTEM_PROMPT
+from app.services import llm_cache
+from app.tasks.config import LLM_CACHE_ENABLED
 
-def generate_text(prompt: str, model: str = "gpt-3.5-turbo", max_tokens: int = 300, temperature: float = 0.2) -> str:
+def text_cache_key(prompt: str, model: str = "gpt-3.5-turbo", max_tokens: int = 300, temperature: float = 0.2) -> str:
+    """
+    Returns the LLM cache key of a generate_text call.
+    """
+    return llm_cache.cache_key(
+        model=model, system=SYSTEM_PROMPT, prompt=prompt, max_tokens=max_tokens, temperature=temperature
+    )
+
+def generate_text(prompt: str, model: str = "gpt-3.5-turbo", max_tokens: int = 300, temperature: float = 0.2,
+                  use_cache: bool = True) -> str:
     """
     Função de serviço que chama a API da OpenAI.
+    Identical calls (same model, prompt and parameters) are answered from the LLM cache;
+    pass use_cache=False to always call the API (the fresh response is still stored).
+    """
+    if not LLM_CACHE_ENABLED:
+        return call_openai_api(prompt, model, max_tokens, temperature)
+
+    key = text_cache_key(prompt, model, max_tokens, temperature)
+    if use_cache:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            return cached
+
+    response = call_openai_api(prompt, model, max_tokens, temperature)
+    llm_cache.put(key, response)
+    return response
+
+async def stream_text(prompt: str, model: str = "gpt-3.5-turbo", max_tokens: int = 300, temperature: float = 0.2,
+                      use_cache: bool = True):
+    """
+    Streaming version of generate_text: yields the response text as it is generated.
+    A cached response is yielded at once; a streamed one is cached when it completes.
     """
-    return call_openai_api(prompt, model, max_tokens, temperature)
+    if not LLM_CACHE_ENABLED:
+        async for text in stream_openai_api(prompt, model, max_tokens, temperature):
+            yield text
+        return
+
+    key = text_cache_key(prompt, model, max_tokens, temperature)
+    if use_cache:
+        # The persistent tier is SQLite, so lookups and stores run off the event loop
+        cached = await asyncio.to_thread(llm_cache.get, key)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    async for text in stream_openai_api(prompt, model, max_tokens, temperature):
+        parts.append(text)
+        yield text
+    await asyncio.to_thread(llm_cache.put, key, "".join(parts).strip())
@@ -0,0 +1,234 @@
+import asyncio
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from app.tasks.config import (
+    RATE_LIMIT_ENABLED,
+    GMAIL_QUOTA_UNITS_PER_SECOND,
+    OPENAI_REQUESTS_PER_MINUTE,
+    OPENAI_TOKENS_PER_MINUTE,
+    RATE_LIMIT_BACKOFF_BASE_SECONDS,
+    RATE_LIMIT_BACKOFF_MAX_SECONDS
+)
+
+# Gmail per-user quota units of each method (https://developers.google.com/gmail/api/reference/quota)
+GMAIL_METHOD_UNITS = {
+    'gmail.users.getProfile': 1,
+    'gmail.users.history.list': 2,
+    'gmail.users.labels.get': 1,
+    'gmail.users.labels.list': 1,
+    'gmail.users.messages.attachments.get': 5,
+    'gmail.users.messages.batchModify': 50,
+    'gmail.users.messages.get': 5,
+    'gmail.users.messages.list': 5,
+    'gmail.users.messages.modify': 5,
+    'gmail.users.messages.send': 100,
+    'gmail.users.threads.get': 10,
+    'gmail.users.threads.list': 10,
+    'gmail.users.stop': 50,
+    'gmail.users.watch': 100,
+}
+DEFAULT_GMAIL_UNITS = 5
+
+class TokenBucket:
+    """
+    A token bucket refilled at `rate` per second up to `capacity`. Callers reserve their cost
+    up front (the balance may go negative) and wait until it is paid back, so waiters are
+    served in order and a sync and an async caller share the same bucket.
+
+    throttled() blocks the bucket after a rate-limited response: for the Retry-After delay if
+    the server sent one, otherwise for a backoff that doubles with each consecutive throttle.
+    """
+    def __init__(self, name: str, rate: float, capacity: float = None):
+        self.name = name
+        self.rate = rate if RATE_LIMIT_ENABLED and rate and rate > 0 else None
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._consecutive_throttles = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "acquired": 0, "units": 0, "waited": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0,
+            "throttled": 0, "backoff_seconds": 0.0,
+        }
+
+    def _reserve(self, amount: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._stats["acquired"] += 1
+            self._stats["units"] += amount
+            if self.rate is None:
+                wait = max(0.0, self._blocked_until - now)
+            else:
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                # A single cost above the capacity would never fit
+                self._tokens -= min(amount, self.capacity)
+                wait = max(-self._tokens / self.rate if self._tokens < 0 else 0.0, self._blocked_until - now)
+            if wait > 0:
+                self._stats["waited"] += 1
+                self._stats["wait_seconds"] += wait
+                self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], wait)
+            return wait
+
+    def acquire(self, amount: float = 1) -> float:
+        """
+        Takes `amount` tokens, sleeping until they are available. Returns the time waited.
+        """
+        wait = self._reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, amount: float = 1) -> float:
+        """
+        Same as acquire, without blocking the event loop.
+        """
+        wait = self._reserve(amount)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def adjust(self, amount: float):
+        """
+        Gives back (negative amount) or takes more tokens once the real cost of a call is known.
+        """
+        if self.rate is None or not amount:
+            return
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens - amount)
+            self._stats["units"] += amount
+
+    def throttled(self, retry_after: float = None) -> float:
+        """
+        Records a rate-limited response and blocks the bucket. Returns the delay applied.
+        """
+        with self._lock:
+            self._consecutive_throttles += 1
+            if retry_after is not None:
+                delay = min(retry_after, RATE_LIMIT_BACKOFF_MAX_SECONDS)
+            else:
+                delay = min(
+                    RATE_LIMIT_BACKOFF_MAX_SECONDS,
+                    RATE_LIMIT_BACKOFF_BASE_SECONDS * 2 ** (self._consecutive_throttles - 1)
+                )
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+            self._stats["throttled"] += 1
+            self._stats["backoff_seconds"] += delay
+            return delay
+
+    def succeeded(self):
+        """
+        Resets the backoff after a call that was not rate-limited.
+        """
+        if self._consecutive_throttles:
+            with self._lock:
+                self._consecutive_throttles = 0
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["wait_seconds"] = round(stats["wait_seconds"], 3)
+        stats["max_wait_seconds"] = round(stats["max_wait_seconds"], 3)
+        stats["backoff_seconds"] = round(stats["backoff_seconds"], 3)
+        stats["rate_per_second"] = self.rate
+        return stats
+
+_gmail_buckets = {}  # quota key (agent ID) -> TokenBucket
+_gmail_buckets_lock = threading.Lock()
+# Gmail service -> quota key of its mailbox
+_service_quota_keys = weakref.WeakKeyDictionary()
+
+openai_requests = TokenBucket("openai_requests", OPENAI_REQUESTS_PER_MINUTE / 60, OPENAI_REQUESTS_PER_MINUTE)
+openai_tokens = TokenBucket("openai_tokens", OPENAI_TOKENS_PER_MINUTE / 60, OPENAI_TOKENS_PER_MINUTE)
+
+def gmail_bucket(quota_key) -> TokenBucket:
+    """
+    Returns the bucket of a mailbox's per-user quota, created on first use.
+    """
+    with _gmail_buckets_lock:
+        bucket = _gmail_buckets.get(quota_key)
+        if bucket is None:
+            bucket = _gmail_buckets[quota_key] = TokenBucket(f"gmail:{quota_key}", GMAIL_QUOTA_UNITS_PER_SECOND)
+        return bucket
+
+def bind_gmail_service(service, quota_key):
+    """
+    Associates a Gmail service with its mailbox, so its calls are charged to that mailbox's bucket.
+    """
+    _service_quota_keys[service] = quota_key
+    return service
+
+def gmail_bucket_for(service) -> TokenBucket:
+    return gmail_bucket(_service_quota_keys.get(service, "default"))
+
+def gmail_units(request) -> int:
+    """
+    Returns the quota units of a Gmail API request (googleapiclient HttpRequest).
+    """
+    return GMAIL_METHOD_UNITS.get(getattr(request, 'methodId', None), DEFAULT_GMAIL_UNITS)
+
+def estimate_openai_tokens(request_body: dict) -> int:
+    """
+    Estimates the tokens of a chat completion before it is sent: about 4 characters per prompt
+    token plus the completion limit. The difference with the reported usage is settled afterwards.
+    """
+    characters = sum(len(message.get('content') or '') for message in request_body.get('messages', []))
+    return (characters + 3) // 4 + request_body.get('max_tokens', 0)
+
+def acquire_openai(estimated_tokens: int) -> float:
+    return openai_requests.acquire(1) + openai_tokens.acquire(estimated_tokens)
+
+async def acquire_openai_async(estimated_tokens: int) -> float:
+    return await openai_requests.acquire_async(1) + await openai_tokens.acquire_async(estimated_tokens)
+
+def settle_openai(estimated_tokens: int, used_tokens: int = None):
+    """
+    Corrects the token bucket with the usage reported by OpenAI and resets the backoff.
+    """
+    if used_tokens is not None:
+        openai_tokens.adjust(used_tokens - estimated_tokens)
+    openai_requests.succeeded()
+    openai_tokens.succeeded()
+
+def openai_throttled(retry_after: float = None) -> float:
+    openai_tokens.throttled(retry_after)
+    return openai_requests.throttled(retry_after)
+
+def retry_after_seconds(headers) -> float:
+    """
+    Parses a Retry-After header (seconds or an HTTP date) from a mapping of headers.
+    Returns None if it is missing or invalid.
+    """
+    value = (headers.get('Retry-After') or headers.get('retry-after')) if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def get_stats() -> dict:
+    """
+    Returns each bucket's counters: calls, units, how many calls waited and for how long,
+    rate-limited responses and backoff time. Wait time growing with throughput means the
+    work is quota-bound rather than latency-bound.
+    """
+    with _gmail_buckets_lock:
+        gmail = {str(key): bucket.get_stats() for key, bucket in _gmail_buckets.items()}
+    openai = {"openai_requests": openai_requests.get_stats(), "openai_tokens": openai_tokens.get_stats()}
+    buckets = list(gmail.values()) + list(openai.values())
+    return {
+        "enabled": RATE_LIMIT_ENABLED,
+        "gmail": gmail,
+        **openai,
+        "total_wait_seconds": round(sum(bucket["wait_seconds"] for bucket in buckets), 3),
+        "total_throttled": sum(bucket["throttled"] for bucket in buckets),
+    }
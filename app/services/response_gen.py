@@ -1,6 +1,6 @@
 from app.services.openai_service import generate_text
 
-def generate_email_response(email_body: str, context: str = "", language: str = "pt") -> str:
+def generate_email_response(email_body: str, context: str = "", language: str = "pt", use_cache: bool = True) -> str:
     """
     Generates a polite, clear, objective, and coherent email response based on the provided email body
 and optional context.
@@ -11,6 +11,7 @@ and optional context.
     Default is an empty string.
     language (str, optional): The desired language for the response (e.g., "pt" for Portuguese,
     "en" for English). Default is "pt".
+    use_cache (bool, optional): Whether an identical earlier response may be reused. Default is True.
 
     Returns:
         str: The AI generated email response.
@@ -29,4 +30,4 @@ Responda de forma educada, clara, objetiva e coerente, como se fosse o destinat
 A resposta deve ser apropriada para enviar ao remetente do e-mail.
 Responda no idioma: {language}."""
 
-    return generate_text(prompt, max_tokens=400, temperature=0.3)
+    return generate_text(prompt, max_tokens=400, temperature=0.3, use_cache=use_cache)
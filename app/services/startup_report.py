@@ -0,0 +1,72 @@
+import importlib
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Imported first by main.py, so this is (approximately) when the application started loading
+_started_at = time.perf_counter()
+_phases = {}
+_lazy_imports = {}
+_imported_at = None
+_app_ready_at = None
+_first_request_at = None
+_lock = threading.Lock()
+
+@contextmanager
+def record_phase(name: str):
+    """
+    Records how long the wrapped startup phase took.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases[name] = time.perf_counter() - start
+
+def lazy_import(module_name: str):
+    """
+    Imports a heavy module on first use and records how long the import took.
+    """
+    # A module shows up in sys.modules as soon as its import starts, so only modules whose
+    # import has finished here are returned without taking the lock
+    if module_name in _lazy_imports:
+        return sys.modules[module_name]
+    with _lock:
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        _lazy_imports.setdefault(module_name, time.perf_counter() - start)
+    return module
+
+def mark_imported():
+    global _imported_at
+    _imported_at = time.perf_counter()
+
+def mark_app_ready():
+    global _app_ready_at
+    _app_ready_at = time.perf_counter()
+
+def mark_first_request():
+    global _first_request_at
+    if _first_request_at is None:
+        _first_request_at = time.perf_counter()
+
+def first_request_seen() -> bool:
+    return _first_request_at is not None
+
+def _since_start(moment):
+    return round((moment - _started_at) * 1000, 2) if moment is not None else None
+
+def get_startup_report() -> dict:
+    """
+    Returns the startup timings in milliseconds: startup phases, deferred imports
+    (measured when they first happened), and the time until the application module was
+    imported, until the app was ready and until the first request.
+    """
+    return {
+        "phases_ms": {name: round(seconds * 1000, 2) for name, seconds in _phases.items()},
+        "lazy_imports_ms": {name: round(seconds * 1000, 2) for name, seconds in _lazy_imports.items()},
+        "time_to_import_ms": _since_start(_imported_at),
+        "time_to_ready_ms": _since_start(_app_ready_at),
+        "time_to_first_request_ms": _since_start(_first_request_at),
+    }
@@ -1,9 +1,19 @@
-from app.services.openai_service import generate_text
+from app.services.openai_service import generate_text, stream_text
 
-def generate_email_summary(email_body: str, language: str = "pt") -> str:
-    prompt = (
+def build_summary_prompt(email_body: str, language: str = "pt") -> str:
+    return (
         f"Please summarize the following email very accurately., "
         f"keeping only the essential information, in a maximum of 5 lines. "
         f"Answer in the language: {language}.\n\nE-mail:\n{email_body}"
     )
-    return generate_text(prompt)
+
+def generate_email_summary(email_body: str, language: str = "pt", use_cache: bool = True) -> str:
+    prompt = build_summary_prompt(email_body, language)
+    return generate_text(prompt, use_cache=use_cache)
+
+async def stream_email_summary(email_body: str, language: str = "pt", use_cache: bool = True):
+    """
+    Yields the summary of the email as it is generated.
+    """
+    async for text in stream_text(build_summary_prompt(email_body, language), use_cache=use_cache):
+        yield text
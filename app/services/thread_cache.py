@@ -0,0 +1,101 @@
+import logging
+import threading
+from collections import OrderedDict
+from app.apis.gmail_api import batch_get_threads, batch_get_messages, parse_history_message
+from app.tasks.config import THREAD_CACHE_MAX_THREADS, THREAD_CACHE_MAX_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+class ThreadCache:
+    """
+    Parsed conversation histories keyed by (agent_id, threadId).
+
+    For each thread only the list of message IDs is fetched (threads.get with format=minimal);
+    messages already in the cache, including those fetched or sent earlier in the same run,
+    are reused and only the unseen ones are downloaded. Threads are evicted least recently
+    used first once there are more than `max_threads` threads or `max_messages` messages.
+    """
+    def __init__(self, max_threads: int = THREAD_CACHE_MAX_THREADS, max_messages: int = THREAD_CACHE_MAX_MESSAGES):
+        self.max_threads = max_threads
+        self.max_messages = max_messages
+        # (agent_id, thread_id) -> {message_id: history entry}, least recently used first
+        self._threads = OrderedDict()
+        self._message_count = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def remember_message(self, agent_id: int, thread_id: str, message: dict):
+        """
+        Stores a parsed message ({'id', 'from', 'date', 'body'}) of a thread.
+        """
+        if not thread_id or not message.get('id'):
+            return
+        entry = {key: message.get(key, '') for key in ('id', 'from', 'date', 'body')}
+        with self._lock:
+            messages = self._threads.setdefault((agent_id, thread_id), {})
+            if entry['id'] not in messages:
+                self._message_count += 1
+            messages[entry['id']] = entry
+            self._threads.move_to_end((agent_id, thread_id))
+            self._evict()
+
+    def get_histories(self, service, agent_id: int, thread_ids: list) -> dict:
+        """
+        Returns a dict mapping each thread ID to its history (list of messages in thread order),
+        downloading only the messages that are not cached yet. Threads that could not be
+        fetched are reported and left out of the result.
+        """
+        unique_ids = list(dict.fromkeys(thread_id for thread_id in thread_ids if thread_id))
+        thread_message_ids = {}
+        for thread_id, thread, error in batch_get_threads(service, unique_ids, format='minimal', fields='messages/id'):
+            if error is not None:
+                logger.error("Erro ao buscar histórico do thread %s: %s", thread_id, error)
+                continue
+            thread_message_ids[thread_id] = [msg['id'] for msg in thread.get('messages', [])]
+
+        with self._lock:
+            missing = []
+            for thread_id, message_ids in thread_message_ids.items():
+                cached = self._threads.get((agent_id, thread_id), {})
+                for msg_id in message_ids:
+                    if msg_id in cached:
+                        self.hits += 1
+                    else:
+                        self.misses += 1
+                        missing.append((thread_id, msg_id))
+
+        fetched = batch_get_messages(service, [msg_id for _, msg_id in missing], format='full')
+        failed_threads = set()
+        for (thread_id, _), (msg_id, msg_data, error) in zip(missing, fetched):
+            if error is not None:
+                logger.error("Erro ao buscar mensagem %s do thread %s: %s", msg_id, thread_id, error)
+                failed_threads.add(thread_id)
+                continue
+            self.remember_message(agent_id, thread_id, parse_history_message(msg_data))
+
+        histories = {}
+        with self._lock:
+            for thread_id, message_ids in thread_message_ids.items():
+                cached = self._threads.get((agent_id, thread_id), {})
+                # Forget messages that are no longer in the thread (e.g. deleted)
+                for msg_id in set(cached) - set(message_ids):
+                    del cached[msg_id]
+                    self._message_count -= 1
+                history = [cached[msg_id] for msg_id in message_ids if msg_id in cached]
+                if thread_id in failed_threads and not history:
+                    continue
+                histories[thread_id] = history
+                if (agent_id, thread_id) in self._threads:
+                    self._threads.move_to_end((agent_id, thread_id))
+        return histories
+
+    def _evict(self):
+        # Called with the lock held; never evicts the thread that was just used
+        while len(self._threads) > 1 and (
+            len(self._threads) > self.max_threads or self._message_count > self.max_messages
+        ):
+            _, messages = self._threads.popitem(last=False)
+            self._message_count -= len(messages)
+
+thread_cache = ThreadCache()
@@ -0,0 +1,387 @@
+import json
+import logging
+import random
+import threading
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+import httpx
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from app.apis.database_connection import SessionLocal
+from app.apis.http_clients import get_sync_client
+from app.models.webhook_outbox import WebhookDelivery
+from app.services import metrics
+from app.services.rate_limiter import retry_after_seconds
+from app.tasks.config import (
+    WEBHOOK_DISPATCH_WORKERS,
+    WEBHOOK_DESTINATION_CONCURRENCY,
+    WEBHOOK_BATCH_SIZE,
+    WEBHOOK_MAX_ATTEMPTS,
+    WEBHOOK_BACKOFF_BASE_SECONDS,
+    WEBHOOK_BACKOFF_MAX_SECONDS,
+    WEBHOOK_DISPATCH_POLL_SECONDS,
+    WEBHOOK_RETENTION_DAYS
+)
+
+# Due entries read per dispatcher pass; each destination takes at most its free slots in batches
+CLAIM_SCAN_LIMIT = 1000
+# Client errors worth retrying; any other 4xx means the request itself is rejected
+RETRYABLE_CLIENT_ERRORS = (408, 425, 429)
+PRUNE_INTERVAL_SECONDS = 3600
+
+logger = logging.getLogger(__name__)
+
+_dispatcher_thread = None
+_dispatcher_stop = threading.Event()
+# Set by enqueue so the dispatcher does not wait for the next poll
+_wake = threading.Event()
+_executor = None
+_last_prune = None
+# Batches being delivered, per host and per URL. Each host is its own lane: a slow host only
+# fills its WEBHOOK_DESTINATION_CONCURRENCY slots, and the other hosts keep being claimed
+_in_flight_hosts = defaultdict(int)
+_in_flight_urls = defaultdict(int)
+_in_flight_lock = threading.Lock()
+
+def delivery_to_dict(delivery: WebhookDelivery) -> dict:
+    return {
+        "delivery_id": delivery.id,
+        "kind": delivery.kind,
+        "url": delivery.url,
+        "status": delivery.status,
+        "attempts": delivery.attempts or 0,
+        "next_attempt_at": delivery.next_attempt_at.isoformat() if delivery.next_attempt_at else None,
+        "created_at": delivery.created_at.isoformat() if delivery.created_at else None,
+        "delivered_at": delivery.delivered_at.isoformat() if delivery.delivered_at else None,
+        "response_code": delivery.response_code,
+        "last_error": delivery.last_error,
+    }
+
+def enqueue(url: str, payload: dict, kind: str, dedupe_key: str = None) -> str:
+    """
+    Stores a webhook delivery for the dispatcher and returns its ID. With a dedupe_key, a
+    delivery enqueued earlier with the same key is returned instead of a new one.
+    """
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        if dedupe_key is not None:
+            existing = db.query(WebhookDelivery.id).filter(WebhookDelivery.dedupe_key == dedupe_key).scalar()
+            if existing:
+                return existing
+        delivery = WebhookDelivery(
+            id=str(uuid.uuid4()),
+            kind=kind,
+            url=url,
+            payload=json.dumps(payload, ensure_ascii=False),
+            dedupe_key=dedupe_key,
+            status='pending',
+            attempts=0,
+            next_attempt_at=now,
+            created_at=now
+        )
+        db.add(delivery)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Enqueued concurrently with the same dedupe_key
+            db.rollback()
+            return db.query(WebhookDelivery.id).filter(WebhookDelivery.dedupe_key == dedupe_key).scalar()
+        delivery_id = delivery.id
+    finally:
+        db.close()
+    _wake.set()
+    return delivery_id
+
+def get_delivery(delivery_id: str):
+    db = SessionLocal()
+    try:
+        delivery = db.get(WebhookDelivery, delivery_id)
+        return delivery_to_dict(delivery) if delivery else None
+    finally:
+        db.close()
+
+def retry_delivery(delivery_id: str):
+    """
+    Puts a failed delivery back in the queue with its attempts reset. Returns the delivery,
+    or None if there is no failed delivery with that ID.
+    """
+    db = SessionLocal()
+    try:
+        delivery = db.get(WebhookDelivery, delivery_id)
+        if delivery is None or delivery.status != 'failed':
+            return None
+        delivery.status = 'pending'
+        delivery.attempts = 0
+        delivery.next_attempt_at = datetime.utcnow()
+        db.commit()
+        result = delivery_to_dict(delivery)
+    finally:
+        db.close()
+    _wake.set()
+    return result
+
+def get_outbox_stats() -> dict:
+    """
+    Returns the number of deliveries per status and the age of the oldest pending one, in seconds.
+    """
+    db = SessionLocal()
+    try:
+        counts = dict(
+            db.query(WebhookDelivery.status, func.count(WebhookDelivery.id)).group_by(WebhookDelivery.status).all()
+        )
+        oldest_pending = (
+            db.query(func.min(WebhookDelivery.created_at))
+            .filter(WebhookDelivery.status.in_(('pending', 'delivering')))
+            .scalar()
+        )
+    finally:
+        db.close()
+    stats = {status: counts.get(status, 0) for status in ('pending', 'delivering', 'delivered', 'failed')}
+    stats["oldest_pending_seconds"] = (
+        round((datetime.utcnow() - oldest_pending).total_seconds(), 1) if oldest_pending else None
+    )
+    return stats
+
+def _host(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+def _claim() -> list:
+    """
+    Marks due deliveries as 'delivering' and returns them grouped in batches (same URL, up to
+    WEBHOOK_BATCH_SIZE each), filling only the free slots: WEBHOOK_DESTINATION_CONCURRENCY
+    batches in flight per host and WEBHOOK_DISPATCH_WORKERS overall. The claimed batches are
+    counted as in flight until _finish.
+    """
+    with _in_flight_lock:
+        free_workers = WEBHOOK_DISPATCH_WORKERS - sum(_in_flight_hosts.values())
+        busy_hosts = {host for host, count in _in_flight_hosts.items() if count >= WEBHOOK_DESTINATION_CONCURRENCY}
+        busy_urls = [url for url, count in _in_flight_urls.items() if count and _host(url) in busy_hosts]
+        in_flight = dict(_in_flight_hosts)
+    if free_workers <= 0:
+        return []
+
+    db = SessionLocal()
+    try:
+        query = db.query(WebhookDelivery).filter(
+            WebhookDelivery.status == 'pending', WebhookDelivery.next_attempt_at <= datetime.utcnow()
+        )
+        if busy_urls:
+            # Keeps the scan from being filled with deliveries no slot can take
+            query = query.filter(WebhookDelivery.url.notin_(busy_urls))
+        due = query.order_by(WebhookDelivery.next_attempt_at, WebhookDelivery.created_at).limit(CLAIM_SCAN_LIMIT).all()
+        batches_by_host = defaultdict(list)
+        open_batches = {}  # url -> batch being filled
+        claimed = 0
+        for delivery in due:
+            batch = open_batches.get(delivery.url)
+            if batch is None or len(batch) >= WEBHOOK_BATCH_SIZE:
+                host = _host(delivery.url)
+                host_batches = batches_by_host[host]
+                if claimed >= free_workers or len(host_batches) + in_flight.get(host, 0) >= WEBHOOK_DESTINATION_CONCURRENCY:
+                    continue
+                batch = []
+                host_batches.append(batch)
+                open_batches[delivery.url] = batch
+                claimed += 1
+            delivery.status = 'delivering'
+            batch.append({
+                "id": delivery.id, "kind": delivery.kind, "url": delivery.url,
+                "payload": delivery.payload, "attempts": delivery.attempts or 0,
+            })
+        db.commit()
+    finally:
+        db.close()
+    batches = [batch for host_batches in batches_by_host.values() for batch in host_batches]
+    with _in_flight_lock:
+        for batch in batches:
+            _in_flight_hosts[_host(batch[0]["url"])] += 1
+            _in_flight_urls[batch[0]["url"]] += 1
+    return batches
+
+def _finish(batch: list, future):
+    # Frees the batch's slot and wakes the dispatcher to claim for it right away
+    url = batch[0]["url"]
+    with _in_flight_lock:
+        host = _host(url)
+        _in_flight_hosts[host] -= 1
+        if not _in_flight_hosts[host]:
+            del _in_flight_hosts[host]
+        _in_flight_urls[url] -= 1
+        if not _in_flight_urls[url]:
+            del _in_flight_urls[url]
+    error = future.exception()
+    if error is not None:
+        logger.error("Webhook dispatcher error: %s", error)
+    _wake.set()
+
+def _backoff_seconds(attempts: int) -> float:
+    # Exponential, with jitter so deliveries that failed together do not retry together
+    delay = min(WEBHOOK_BACKOFF_MAX_SECONDS, WEBHOOK_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+def _record_result(batch: list, response_code: int = None, error: str = None,
+                   permanent: bool = False, retry_after: float = None):
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        for item in batch:
+            delivery = db.get(WebhookDelivery, item["id"])
+            if delivery is None:
+                continue
+            delivery.attempts = item["attempts"] + 1
+            delivery.response_code = response_code
+            delivery.last_error = error
+            if error is None:
+                delivery.status = 'delivered'
+                delivery.delivered_at = now
+            elif permanent or delivery.attempts >= WEBHOOK_MAX_ATTEMPTS:
+                delivery.status = 'failed'
+            else:
+                delay = max(_backoff_seconds(delivery.attempts), min(retry_after or 0, WEBHOOK_BACKOFF_MAX_SECONDS))
+                delivery.status = 'pending'
+                delivery.next_attempt_at = now + timedelta(seconds=delay)
+        db.commit()
+    finally:
+        db.close()
+
+def _deliver(batch: list):
+    """
+    Posts a batch (see _post). Any error besides the HTTP ones, e.g. a payload that is not
+    valid JSON or a database error while recording the result, is recorded as a retryable
+    failure, so the batch does not stay 'delivering' until the next restart.
+    """
+    try:
+        _post(batch)
+    except Exception as e:
+        logger.exception("Webhook delivery to %s failed: %s", batch[0]["url"], e)
+        _record_result(batch, error=f"{type(e).__name__}: {e}")
+
+def _idempotency_key(batch: list) -> str:
+    # A single delivery keeps its ID; a batch gets a key derived from the IDs it holds
+    if len(batch) == 1:
+        return batch[0]["id"]
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, ",".join(sorted(item["id"] for item in batch))))
+
+def _post(batch: list):
+    """
+    Posts a batch: a single delivery is sent as its payload, several as {"deliveries": [...]}.
+    The Idempotency-Key header and the delivery IDs let the receiver drop the duplicates that
+    retries can produce.
+    """
+    if len(batch) == 1:
+        body = json.loads(batch[0]["payload"])
+    else:
+        body = {"deliveries": [
+            {"id": item["id"], "kind": item["kind"], "payload": json.loads(item["payload"])} for item in batch
+        ]}
+    headers = {"Idempotency-Key": _idempotency_key(batch)}
+    url = batch[0]["url"]
+    try:
+        with metrics.external_call('webhook', 'post', host=urlsplit(url).netloc, deliveries=len(batch)) as call:
+            response = get_sync_client().post(url, json=body, headers=headers, follow_redirects=True)
+            if response.is_error:
+                call["outcome"] = "rate_limited" if response.status_code == 429 else "error"
+    except httpx.HTTPError as e:
+        logger.warning("Webhook delivery to %s failed: %s", url, e)
+        _record_result(batch, error=f"{type(e).__name__}: {e}")
+        return
+    if not response.is_error:
+        _record_result(batch, response_code=response.status_code)
+        return
+    logger.warning("Webhook delivery to %s failed with HTTP %s.", url, response.status_code)
+    _record_result(
+        batch,
+        response_code=response.status_code,
+        error=f"HTTP {response.status_code}: {response.text[:500]}",
+        permanent=response.is_client_error and response.status_code not in RETRYABLE_CLIENT_ERRORS,
+        retry_after=retry_after_seconds(response.headers)
+    )
+
+def dispatch_pending() -> int:
+    """
+    Runs one dispatcher pass: claims the due deliveries that fit in the free slots (see _claim)
+    and hands them to the worker pool without waiting for them, so a slow destination never
+    holds up the others. Each finished batch wakes the dispatcher to claim again.
+    Returns the number of deliveries started.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=WEBHOOK_DISPATCH_WORKERS, thread_name_prefix="webhook-dispatch")
+    batches = _claim()
+    for batch in batches:
+        future = _executor.submit(_deliver, batch)
+        future.add_done_callback(lambda future, batch=batch: _finish(batch, future))
+    return sum(len(batch) for batch in batches)
+
+def prune(retention_days: int = WEBHOOK_RETENTION_DAYS) -> int:
+    """
+    Deletes the delivered and failed entries older than the retention period. Returns the number deleted.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    db = SessionLocal()
+    try:
+        deleted = db.query(WebhookDelivery).filter(
+            WebhookDelivery.status.in_(('delivered', 'failed')), WebhookDelivery.created_at < cutoff
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+    return deleted
+
+def _dispatch_loop():
+    global _last_prune
+    while not _dispatcher_stop.is_set():
+        _wake.clear()
+        try:
+            dispatched = dispatch_pending()
+            now = datetime.utcnow()
+            if _last_prune is None or (now - _last_prune).total_seconds() >= PRUNE_INTERVAL_SECONDS:
+                _last_prune = now
+                prune()
+        except Exception as e:
+            logger.exception("Webhook dispatcher failed: %s", e)
+            dispatched = 0
+        if not dispatched:
+            _wake.wait(WEBHOOK_DISPATCH_POLL_SECONDS)
+
+def start_dispatcher():
+    """
+    Starts the background dispatcher. Deliveries left 'delivering' by a previous process are
+    put back in the queue first, so a delivery cut off by a restart is retried.
+    """
+    global _dispatcher_thread
+    if _dispatcher_thread is not None:
+        return
+    db = SessionLocal()
+    try:
+        requeued = db.query(WebhookDelivery).filter(WebhookDelivery.status == 'delivering').update(
+            {'status': 'pending'}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+    if requeued:
+        logger.info("Re-queued %d interrupted webhook delivery(ies).", requeued)
+
+    _dispatcher_stop.clear()
+    _dispatcher_thread = threading.Thread(target=_dispatch_loop, name="webhook-dispatcher", daemon=True)
+    _dispatcher_thread.start()
+
+def stop_dispatcher():
+    """
+    Stops the dispatcher, waiting for the deliveries in flight. Pending deliveries stay in the outbox.
+    """
+    global _dispatcher_thread, _executor
+    if _dispatcher_thread is None:
+        return
+    _dispatcher_stop.set()
+    _wake.set()
+    _dispatcher_thread.join()
+    _dispatcher_thread = None
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
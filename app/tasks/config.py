@@ -5,4 +5,169 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./agents.db")
 # instead of hardcoding them in the source code.
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 RECIPIENT_URL = os.getenv("RECIPIENT_URL", "https://webhook.site/1ae1e971-df02-4165-b3b4-762afddfbffc")
-REPLY_URL = os.getenv("REPLY_URL", "https://webhook.site/1ae1e971-df02-4165-b3b4-762afddfbffc")
\ No newline at end of file
+REPLY_URL = os.getenv("REPLY_URL", "https://webhook.site/1ae1e971-df02-4165-b3b4-762afddfbffc")
+
+# Number of Gmail API requests sent per batch round trip (Gmail allows up to 100)
+GMAIL_BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", "50"))
+
+
+# "incremental" syncs only messages added since the last run using Gmail historyId cursors,
+# "full" re-lists the newest messages on every run
+GMAIL_SYNC_MODE = os.getenv("GMAIL_SYNC_MODE", "incremental")
+# Maximum number of unread messages listed when there is no valid history cursor
+GMAIL_RESYNC_MAX_RESULTS = int(os.getenv("GMAIL_RESYNC_MAX_RESULTS", "10"))
+
+# In-process cache of decrypted agent credentials and Gmail service objects
+GMAIL_CLIENT_CACHE_MAX_SIZE = int(os.getenv("GMAIL_CLIENT_CACHE_MAX_SIZE", "256"))
+GMAIL_CLIENT_CACHE_TTL_SECONDS = int(os.getenv("GMAIL_CLIENT_CACHE_TTL_SECONDS", "3600"))
+# Access tokens are refreshed when they expire in less than this many seconds
+GMAIL_TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("GMAIL_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+
+# Optional path to a vendored Gmail discovery document (defaults to the copy bundled with google-api-python-client)
+GMAIL_DISCOVERY_DOCUMENT = os.getenv("GMAIL_DISCOVERY_DOCUMENT")
+
+# process_emails_task pipeline: size of the queues between stages and workers per stage
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "10"))
+PIPELINE_LLM_CONCURRENCY = int(os.getenv("PIPELINE_LLM_CONCURRENCY", "4"))
+PIPELINE_SEND_CONCURRENCY = int(os.getenv("PIPELINE_SEND_CONCURRENCY", "2"))
+
+# Built-in scheduler that periodically processes every agent's mailbox
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "false").lower() == "true"
+SCHEDULER_INTERVAL_SECONDS = float(os.getenv("SCHEDULER_INTERVAL_SECONDS", "60"))
+# Agents without new mail back off up to this interval
+SCHEDULER_MAX_INTERVAL_SECONDS = float(os.getenv("SCHEDULER_MAX_INTERVAL_SECONDS", "900"))
+SCHEDULER_MAX_CONCURRENCY = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "8"))
+
+# Local worker pool of the SQLite-backed job queue behind POST /api/tasks/process-emails
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Minimum time between progress updates written to a running job
+JOB_PROGRESS_INTERVAL_SECONDS = float(os.getenv("JOB_PROGRESS_INTERVAL_SECONDS", "1"))
+
+# Cache of LLM responses keyed by a hash of model, prompt and generation parameters
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_MEMORY_SIZE = int(os.getenv("LLM_CACHE_MEMORY_SIZE", "1024"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Conversation context for replies: token budget, number of recent messages and the minimum
+# share of each; older messages are replaced by a cached rolling summary
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_MAX_MESSAGES = int(os.getenv("CONTEXT_MAX_MESSAGES", "6"))
+CONTEXT_MIN_MESSAGE_TOKENS = int(os.getenv("CONTEXT_MIN_MESSAGE_TOKENS", "64"))
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "200"))
+CONTEXT_SUMMARY_CACHE_SIZE = int(os.getenv("CONTEXT_SUMMARY_CACHE_SIZE", "512"))
+# Model whose tokenizer (tiktoken) is used to count tokens locally
+TOKENIZER_MODEL = os.getenv("TOKENIZER_MODEL", "gpt-3.5-turbo")
+
+# Cache of parsed thread messages reused between emails and runs
+THREAD_CACHE_MAX_THREADS = int(os.getenv("THREAD_CACHE_MAX_THREADS", "1000"))
+THREAD_CACHE_MAX_MESSAGES = int(os.getenv("THREAD_CACHE_MAX_MESSAGES", "10000"))
+
+# Digest summaries: "sync" generates each one inline, "deferred" submits them after the run as one
+# OpenAI Batch API job, polled every SUMMARY_BATCH_POLL_SECONDS, and sends the digest once it completes
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "sync")
+SUMMARY_BATCH_POLL_SECONDS = float(os.getenv("SUMMARY_BATCH_POLL_SECONDS", "60"))
+
+# Count the messages excluded by the Gmail query of the ignore rules, so the share filtered
+# server-side can be reported. Off by default: it costs one extra messages.list (5 quota
+# units and a round trip) per listing, so enable it only while tuning the rules
+GMAIL_FILTER_STATS = os.getenv("GMAIL_FILTER_STATS", "false").lower() == "true"
+
+# Attempts for each users.messages.batchModify call of the acknowledgement buffer before the
+# IDs are split in halves to isolate the ones that keep failing
+GMAIL_ACK_RETRIES = int(os.getenv("GMAIL_ACK_RETRIES", "3"))
+
+# Bytes of an email body part that are decoded (longer bodies are cut; 0 for no limit)
+EMAIL_BODY_MAX_BYTES = int(os.getenv("EMAIL_BODY_MAX_BYTES", "65536"))
+
+# "two-phase" fetches the headers and labels of new messages first (format=metadata) and the
+# bodies only of those that pass the ignore rules; "full" downloads every message whole
+GMAIL_FETCH_MODE = os.getenv("GMAIL_FETCH_MODE", "two-phase")
+
+# Database engine: connection pool, and for SQLite the WAL journal and the time a
+# connection waits for a lock before failing with "database is locked"
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "10"))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "10"))
+DATABASE_POOL_TIMEOUT_SECONDS = float(os.getenv("DATABASE_POOL_TIMEOUT_SECONDS", "30"))
+DATABASE_POOL_RECYCLE_SECONDS = int(os.getenv("DATABASE_POOL_RECYCLE_SECONDS", "1800"))
+SQLITE_WAL_ENABLED = os.getenv("SQLITE_WAL_ENABLED", "true").lower() == "true"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Async engine for the async endpoints; derived from DATABASE_URL (sqlite+aiosqlite,
+# postgresql+asyncpg) unless set
+DATABASE_ASYNC_URL = os.getenv("DATABASE_ASYNC_URL")
+
+# Processed-message ledger: entries older than the retention are pruned, at most once per interval
+LEDGER_RETENTION_DAYS = int(os.getenv("LEDGER_RETENTION_DAYS", "30"))
+LEDGER_PRUNE_INTERVAL_SECONDS = int(os.getenv("LEDGER_PRUNE_INTERVAL_SECONDS", "3600"))
+
+# Shared HTTP clients (webhooks and OAuth, OpenAI): keep-alive connection pool and timeouts.
+# HTTP/2 is negotiated when enabled and the h2 package is installed (pip install "httpx[http2]")
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "30"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "10"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+OPENAI_HTTP_MAX_CONNECTIONS = int(os.getenv("OPENAI_HTTP_MAX_CONNECTIONS", "20"))
+OPENAI_HTTP_TIMEOUT_SECONDS = float(os.getenv("OPENAI_HTTP_TIMEOUT_SECONDS", "120"))
+
+# Webhook outbox: summaries and replies posted to recipient URLs are stored and delivered by a
+# background dispatcher, with at most WEBHOOK_DESTINATION_CONCURRENCY requests in flight per host
+# and exponential backoff between attempts. WEBHOOK_BATCH_SIZE > 1 posts up to that many payloads
+# for the same URL in one request ({"deliveries": [...]})
+WEBHOOK_DISPATCH_WORKERS = int(os.getenv("WEBHOOK_DISPATCH_WORKERS", "8"))
+WEBHOOK_DESTINATION_CONCURRENCY = int(os.getenv("WEBHOOK_DESTINATION_CONCURRENCY", "2"))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "1"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_BACKOFF_BASE_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_BASE_SECONDS", "2"))
+WEBHOOK_BACKOFF_MAX_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_MAX_SECONDS", "600"))
+WEBHOOK_DISPATCH_POLL_SECONDS = float(os.getenv("WEBHOOK_DISPATCH_POLL_SECONDS", "1"))
+# Delivered and failed entries are deleted after this many days
+WEBHOOK_RETENTION_DAYS = int(os.getenv("WEBHOOK_RETENTION_DAYS", "7"))
+# Also send each processed email's summary to RECIPIENT_URL and reply to REPLY_URL through the outbox
+WEBHOOK_PIPELINE_ENABLED = os.getenv("WEBHOOK_PIPELINE_ENABLED", "false").lower() == "true"
+
+# Gmail push notifications: users.watch publishes mailbox changes to a Pub/Sub topic
+# (projects/<project>/topics/<topic>) whose push subscription calls POST /api/gmail/push.
+# Watches expire after 7 days and are renewed when less than GMAIL_WATCH_RENEW_BEFORE_SECONDS
+# remain (checked every GMAIL_WATCH_CHECK_SECONDS); GMAIL_PUSH_TOKEN, if set, must be passed
+# as the endpoint's ?token= query parameter
+GMAIL_WATCH_ENABLED = os.getenv("GMAIL_WATCH_ENABLED", "false").lower() == "true"
+GMAIL_WATCH_TOPIC = os.getenv("GMAIL_WATCH_TOPIC")
+GMAIL_WATCH_LABEL_IDS = [label for label in os.getenv("GMAIL_WATCH_LABEL_IDS", "INBOX").split(",") if label]
+GMAIL_WATCH_RENEW_BEFORE_SECONDS = int(os.getenv("GMAIL_WATCH_RENEW_BEFORE_SECONDS", "86400"))
+GMAIL_WATCH_CHECK_SECONDS = int(os.getenv("GMAIL_WATCH_CHECK_SECONDS", "3600"))
+GMAIL_PUSH_TOKEN = os.getenv("GMAIL_PUSH_TOKEN")
+
+# Quota-aware rate limiting: token buckets for the Gmail per-user quota (units per second, each
+# method weighted by its cost) and for OpenAI requests and tokens per minute. Rate-limited calls
+# (HTTP 429) are retried after Retry-After, or after a backoff that doubles from
+# RATE_LIMIT_BACKOFF_BASE_SECONDS up to RATE_LIMIT_BACKOFF_MAX_SECONDS while they keep failing
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+GMAIL_QUOTA_UNITS_PER_SECOND = float(os.getenv("GMAIL_QUOTA_UNITS_PER_SECOND", "250"))
+GMAIL_RATE_LIMIT_RETRIES = int(os.getenv("GMAIL_RATE_LIMIT_RETRIES", "3"))
+OPENAI_REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "500"))
+OPENAI_TOKENS_PER_MINUTE = float(os.getenv("OPENAI_TOKENS_PER_MINUTE", "200000"))
+OPENAI_RATE_LIMIT_RETRIES = int(os.getenv("OPENAI_RATE_LIMIT_RETRIES", "3"))
+RATE_LIMIT_BACKOFF_BASE_SECONDS = float(os.getenv("RATE_LIMIT_BACKOFF_BASE_SECONDS", "1"))
+RATE_LIMIT_BACKOFF_MAX_SECONDS = float(os.getenv("RATE_LIMIT_BACKOFF_MAX_SECONDS", "60"))
+
+# Observability: LOG_FORMAT is "text" or "json" (one JSON object per line, with the extra fields
+# of each record). Prometheus metrics are served at GET /metrics; METRICS_AGENT_LABELS=false
+# drops the agent_id label, for deployments with many agents. OTEL_TRACING_ENABLED wraps the
+# external calls and pipeline stages in OpenTelemetry spans (needs opentelemetry-api, and an
+# SDK/exporter configured e.g. with opentelemetry-instrument)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_AGENT_LABELS = os.getenv("METRICS_AGENT_LABELS", "true").lower() == "true"
+OTEL_TRACING_ENABLED = os.getenv("OTEL_TRACING_ENABLED", "false").lower() == "true"
+
+# Prompt cleaning: quoted replies, signatures, legal disclaimers and tracking-link noise are
+# stripped from the email bodies before they are sent to the LLM, with per-agent rules
+# (PUT /api/emails/cleaning/{agent_id}). URLs longer than PROMPT_CLEANING_MAX_URL_CHARS after
+# dropping their tracking parameters are shortened to their host. The agents' custom patterns
+# come from the API, so each one gets at most PROMPT_CLEANING_PATTERN_TIMEOUT seconds per body
+PROMPT_CLEANING_ENABLED = os.getenv("PROMPT_CLEANING_ENABLED", "true").lower() == "true"
+PROMPT_CLEANING_MAX_URL_CHARS = int(os.getenv("PROMPT_CLEANING_MAX_URL_CHARS", "100"))
+PROMPT_CLEANING_PATTERN_TIMEOUT = float(os.getenv("PROMPT_CLEANING_PATTERN_TIMEOUT", "0.1"))
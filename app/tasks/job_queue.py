@@ -0,0 +1,176 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from app.apis.database_connection import SessionLocal
+from app.models.jobs import ProcessingJob
+from app.tasks.config import JOB_WORKERS, JOB_PROGRESS_INTERVAL_SECONDS
+from app.tasks.tasks import run_email_processing
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+_executor = None
+# Serialises the "is there already a job for this agent?" check with the insert
+_enqueue_lock = threading.Lock()
+# Agents whose running job must be followed by another one (changes arrived while it ran)
+_follow_ups = set()
+
+def job_to_dict(job: ProcessingJob) -> dict:
+    return {
+        "job_id": job.id,
+        "agent_id": job.agent_id,
+        "status": job.status,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "progress": {
+            "listed": job.listed or 0,
+            "ignored": job.ignored or 0,
+            "skipped": job.skipped or 0,
+            "processed": job.processed or 0,
+            "failed": job.failed or 0,
+        },
+        "error": job.error,
+    }
+
+def start():
+    """
+    Starts the local worker pool and re-queues the jobs left unfinished by a previous process.
+    """
+    global _executor
+    if _executor is not None:
+        return
+    _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job-worker")
+
+    db = SessionLocal()
+    try:
+        pending = (
+            db.query(ProcessingJob)
+            .filter(ProcessingJob.status.in_(ACTIVE_STATUSES))
+            .order_by(ProcessingJob.created_at)
+            .all()
+        )
+        for job in pending:
+            job.status = 'queued'
+        db.commit()
+        pending_ids = [job.id for job in pending]
+    finally:
+        db.close()
+
+    for job_id in pending_ids:
+        _executor.submit(_run_job, job_id)
+    if pending_ids:
+        logger.info("Re-queued %d unfinished job(s).", len(pending_ids))
+
+def stop():
+    """
+    Stops the worker pool. Jobs that have not started stay queued in the database
+    and are picked up again by the next start().
+    """
+    global _executor
+    if _executor is None:
+        return
+    _executor.shutdown(wait=True, cancel_futures=True)
+    _executor = None
+
+def enqueue_process_emails(agent_id: int, follow_up: bool = False):
+    """
+    Queues an email processing job for the agent and returns (job, created).
+    If the agent already has a queued or running job, that job is returned instead
+    of creating a new one. With follow_up, a running job is followed by one more job
+    once it finishes (however many follow-ups are requested meanwhile), for changes
+    the running job may have missed.
+    """
+    if _executor is None:
+        start()
+
+    with _enqueue_lock:
+        db = SessionLocal()
+        try:
+            existing = (
+                db.query(ProcessingJob)
+                .filter(ProcessingJob.agent_id == agent_id, ProcessingJob.status.in_(ACTIVE_STATUSES))
+                .first()
+            )
+            if existing:
+                if follow_up and existing.status == 'running':
+                    _follow_ups.add(agent_id)
+                return job_to_dict(existing), False
+
+            job = ProcessingJob(
+                id=uuid.uuid4().hex,
+                agent_id=agent_id,
+                status='queued',
+                created_at=datetime.utcnow()
+            )
+            db.add(job)
+            db.commit()
+            db.refresh(job)
+            result = job_to_dict(job)
+        finally:
+            db.close()
+
+    _executor.submit(_run_job, result["job_id"])
+    return result, True
+
+def get_job(job_id: str):
+    """
+    Returns the job as a dictionary, or None if it does not exist.
+    """
+    db = SessionLocal()
+    try:
+        job = db.query(ProcessingJob).filter(ProcessingJob.id == job_id).first()
+        return job_to_dict(job) if job else None
+    finally:
+        db.close()
+
+def _update_job(job_id: str, **fields):
+    db = SessionLocal()
+    try:
+        db.query(ProcessingJob).filter(ProcessingJob.id == job_id).update(fields)
+        db.commit()
+    finally:
+        db.close()
+
+def _run_job(job_id: str):
+    db = SessionLocal()
+    try:
+        job = db.query(ProcessingJob).filter(ProcessingJob.id == job_id).first()
+        if not job or job.status != 'queued':
+            return
+        agent_id = job.agent_id
+        job.status = 'running'
+        job.started_at = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+    last_write = [0.0]
+
+    def on_progress(stats: dict):
+        # Progress is written at most once per interval; the final counts are always written
+        now = time.monotonic()
+        if now - last_write[0] >= JOB_PROGRESS_INTERVAL_SECONDS:
+            last_write[0] = now
+            _update_job(job_id, **stats)
+
+    try:
+        stats = run_email_processing(agent_id, on_progress=on_progress)
+        _update_job(job_id, status='succeeded', finished_at=datetime.utcnow(), **stats)
+    except Exception as e:
+        logger.error("Job %s failed for agent %s: %s", job_id, agent_id, e, extra={'agent_id': agent_id, 'job_id': job_id})
+        _update_job(job_id, status='failed', finished_at=datetime.utcnow(), error=str(e))
+
+    with _enqueue_lock:
+        follow_up = agent_id in _follow_ups
+        _follow_ups.discard(agent_id)
+    if follow_up and _executor is not None:
+        try:
+            enqueue_process_emails(agent_id)
+        except RuntimeError:
+            # The pool is shutting down; the queued job is picked up by the next start()
+            pass
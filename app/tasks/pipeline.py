@@ -0,0 +1,154 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the stream on a stage's input queue
+_DONE = object()
+
+# Callbacks notified of every stage call (see add_stage_observer)
+_stage_observers = []
+
+def add_stage_observer(callback):
+    """
+    Registers callback(stage_name, seconds, items), called after each stage call of any pipeline
+    with its duration and the number of items it received. The source is reported as the
+    "source" stage, with the time taken to produce each item. Used to collect stage latencies.
+    """
+    _stage_observers.append(callback)
+
+def remove_stage_observer(callback):
+    if callback in _stage_observers:
+        _stage_observers.remove(callback)
+
+def _observe(stage_name: str, seconds: float, items: int):
+    for callback in list(_stage_observers):
+        try:
+            callback(stage_name, seconds, items)
+        except Exception as e:
+            logger.error("Pipeline stage observer failed: %s", e)
+
+class Stage:
+    """
+    One step of a pipeline.
+
+    Args:
+        name (str): Stage name, used in error messages and thread names.
+        func (callable): Called with one item (or with a list of items when batch_size > 1).
+            Returns the item to pass to the next stage, or None to drop it. A batch stage
+            returns a list of items.
+        concurrency (int, optional): Number of worker threads running this stage. Default is 1.
+        batch_size (int, optional): If greater than 1, each call receives the items already
+            waiting in the queue, up to batch_size, instead of a single item. Default is 1.
+    """
+    def __init__(self, name: str, func, concurrency: int = 1, batch_size: int = 1):
+        self.name = name
+        self.func = func
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+
+def _take_batch(inbox: queue.Queue, first, batch_size: int):
+    """
+    Returns `first` plus the items already waiting in `inbox`, up to batch_size, without blocking.
+    The end-of-stream marker, if found, is put back for the other workers.
+    """
+    items = [first]
+    while len(items) < batch_size:
+        try:
+            item = inbox.get_nowait()
+        except queue.Empty:
+            break
+        if item is _DONE:
+            inbox.put(_DONE)
+            break
+        items.append(item)
+    return items
+
+def run_pipeline(source, stages: list, queue_size: int = 10):
+    """
+    Runs `source` (an iterable, consumed in its own thread) through `stages`, connected by
+    bounded queues, and blocks until every item has gone through the last stage.
+    Each stage runs on its own worker threads, so different items are processed by different
+    stages at the same time. An exception raised for one item is reported and only drops that item;
+    one raised by the source ends the stream and is counted under "source".
+    Returns a dictionary with the number of such failures per stage.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    threads = []
+    failures = {"source": 0, **{stage.name: 0 for stage in stages}}
+    failures_lock = threading.Lock()
+
+    def produce():
+        try:
+            iterator = iter(source)
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                if _stage_observers:
+                    _observe("source", time.perf_counter() - started, 1)
+                queues[0].put(item)
+        except Exception as e:
+            logger.exception("Pipeline source failed: %s", e)
+            with failures_lock:
+                failures["source"] += 1
+        finally:
+            queues[0].put(_DONE)
+
+    def work(index: int, stage: Stage, remaining: list, lock: threading.Lock):
+        inbox = queues[index]
+        outbox = queues[index + 1] if index + 1 < len(queues) else None
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                # Let the other workers of this stage see the marker too
+                inbox.put(_DONE)
+                break
+            batch = _take_batch(inbox, item, stage.batch_size) if stage.batch_size > 1 else None
+            started = time.perf_counter()
+            try:
+                if batch is not None:
+                    results = stage.func(batch) or []
+                else:
+                    results = [stage.func(item)]
+            except Exception as e:
+                logger.error("Pipeline stage '%s' failed: %s", stage.name, e)
+                with failures_lock:
+                    failures[stage.name] += 1
+                continue
+            finally:
+                if _stage_observers:
+                    _observe(stage.name, time.perf_counter() - started, len(batch) if batch is not None else 1)
+            if outbox is not None:
+                for result in results:
+                    if result is not None:
+                        outbox.put(result)
+
+        # The last worker to finish closes the next stage's input
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last and outbox is not None:
+            outbox.put(_DONE)
+
+    threads.append(threading.Thread(target=produce, name="pipeline-source", daemon=True))
+    for index, stage in enumerate(stages):
+        remaining = [stage.concurrency]
+        lock = threading.Lock()
+        for worker in range(stage.concurrency):
+            threads.append(threading.Thread(
+                target=work,
+                args=(index, stage, remaining, lock),
+                name=f"pipeline-{stage.name}-{worker}",
+                daemon=True
+            ))
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return failures
@@ -0,0 +1,160 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from app.apis.database_connection import SessionLocal
+from app.models.gmail_agents import GmailAgent
+from app.tasks.config import (
+    SCHEDULER_INTERVAL_SECONDS,
+    SCHEDULER_MAX_INTERVAL_SECONDS,
+    SCHEDULER_MAX_CONCURRENCY
+)
+from app.tasks.tasks import run_email_processing
+
+logger = logging.getLogger(__name__)
+
+class AgentRunState:
+    """
+    Scheduling state and last-run information of one agent.
+    """
+    def __init__(self, agent_id: int, next_run_at: float, interval: float):
+        self.agent_id = agent_id
+        self.next_run_at = next_run_at
+        self.interval = interval
+        self.running = False
+        self.runs = 0
+        self.last_started_at = None
+        self.last_finished_at = None
+        self.last_duration = None
+        self.last_error = None
+        self.last_stats = None
+
+    def to_dict(self) -> dict:
+        return {
+            "agent_id": self.agent_id,
+            "running": self.running,
+            "runs": self.runs,
+            "interval_seconds": self.interval,
+            "next_run_in_seconds": max(0.0, round(self.next_run_at - time.monotonic(), 1)),
+            "last_started_at": self.last_started_at.isoformat() if self.last_started_at else None,
+            "last_finished_at": self.last_finished_at.isoformat() if self.last_finished_at else None,
+            "last_duration_seconds": round(self.last_duration, 3) if self.last_duration is not None else None,
+            "last_error": self.last_error,
+            "last_stats": self.last_stats,
+        }
+
+class AgentScheduler:
+    """
+    Periodically processes the emails of every GmailAgent.
+
+    Agents are run on a shared worker pool capped at `max_concurrency`, at most one run per
+    agent at a time, and the agents that have waited longest since they became due go first,
+    so a busy mailbox cannot starve the others. Agents whose run found no new mail back off
+    (their interval doubles up to `max_interval`) and return to `interval` once mail arrives.
+    """
+    def __init__(self, interval: float = SCHEDULER_INTERVAL_SECONDS,
+                 max_interval: float = SCHEDULER_MAX_INTERVAL_SECONDS,
+                 max_concurrency: int = SCHEDULER_MAX_CONCURRENCY):
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.max_concurrency = max(1, max_concurrency)
+        self._states = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = None
+        self._in_flight = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="agent-scheduler")
+        self._thread = threading.Thread(target=self._loop, name="agent-scheduler-loop", daemon=True)
+        self._thread.start()
+        logger.info("Agent scheduler started (interval %ss, concurrency %d).", self.interval, self.max_concurrency)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+        self._thread = None
+        self._executor = None
+
+    def get_status(self) -> list:
+        with self._lock:
+            return [state.to_dict() for state in sorted(self._states.values(), key=lambda s: s.agent_id)]
+
+    def _sync_agents(self):
+        """
+        Adds newly created agents (spread over the first interval) and forgets deleted ones.
+        """
+        db = SessionLocal()
+        try:
+            agent_ids = {agent_id for (agent_id,) in db.query(GmailAgent.id).all()}
+        finally:
+            db.close()
+
+        now = time.monotonic()
+        with self._lock:
+            for agent_id in agent_ids - self._states.keys():
+                self._states[agent_id] = AgentRunState(agent_id, now + random.uniform(0, self.interval), self.interval)
+            for agent_id in self._states.keys() - agent_ids:
+                if not self._states[agent_id].running:
+                    del self._states[agent_id]
+
+    def _loop(self):
+        last_sync = None
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if last_sync is None or now - last_sync >= self.interval:
+                try:
+                    self._sync_agents()
+                except Exception as e:
+                    logger.error("Agent scheduler could not load agents: %s", e)
+                last_sync = now
+
+            with self._lock:
+                due = sorted(
+                    (state for state in self._states.values() if not state.running and state.next_run_at <= now),
+                    key=lambda state: state.next_run_at
+                )
+                for state in due[:self.max_concurrency - self._in_flight]:
+                    state.running = True
+                    self._in_flight += 1
+                    self._executor.submit(self._run_agent, state)
+
+            self._stop.wait(1.0)
+
+    def _run_agent(self, state: AgentRunState):
+        started = time.monotonic()
+        state.last_started_at = datetime.utcnow()
+        error = None
+        stats = None
+        try:
+            stats = run_email_processing(state.agent_id)
+        except Exception as e:
+            error = str(e)
+            logger.error("Scheduled run failed for agent %s: %s", state.agent_id, e, extra={'agent_id': state.agent_id})
+        finished = time.monotonic()
+
+        with self._lock:
+            state.running = False
+            state.runs += 1
+            state.last_finished_at = datetime.utcnow()
+            state.last_duration = finished - started
+            state.last_error = error
+            state.last_stats = stats
+            # Back off while the mailbox is quiet (or failing), go back to the base interval on new mail
+            if stats and stats['listed'] > 0:
+                state.interval = self.interval
+            else:
+                state.interval = min(state.interval * 2, self.max_interval)
+            state.next_run_at = finished + state.interval
+            self._in_flight -= 1
+
+scheduler = AgentScheduler()
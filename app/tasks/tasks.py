@@ -1,131 +1,385 @@
+import logging
+import threading
+import time
+from collections import defaultdict
 from app.apis.database_connection import SessionLocal
 from app.models.gmail_agents import GmailAgent
-from app.services.encryption import get_cipher_suite
-from app.services.gmail_service import fetch_recent_emails, get_gmail_service, mark_email_as_read, send_email
-from app.apis.gmail_api import fetch_thread_history
+from cryptography.fernet import InvalidToken
+from app.services.gmail_client_cache import get_agent_gmail_credentials, get_thread_gmail_service
+from app.services.gmail_service import (
+    list_recent_messages, list_new_messages, save_history_cursor,
+    iter_fetched_messages, parse_message, send_email
+)
+from app.tasks.config import (
+    GMAIL_SYNC_MODE, GMAIL_BATCH_SIZE, GMAIL_FETCH_MODE,
+    PIPELINE_QUEUE_SIZE, PIPELINE_LLM_CONCURRENCY, PIPELINE_SEND_CONCURRENCY,
+    SUMMARY_MODE, WEBHOOK_PIPELINE_ENABLED, RECIPIENT_URL, REPLY_URL, PROMPT_CLEANING_ENABLED
+)
+from app.tasks.pipeline import Stage, run_pipeline
+from app.services.thread_cache import thread_cache
+from app.services.email_filters import get_agent_rules
+from app.services.email_cleaner import get_agent_cleaning_rules, clean_for_prompt
+from app.services.ack_buffer import AcknowledgementBuffer
+from app.services import message_ledger, webhook_outbox, rate_limiter, metrics
 from app.services.summary_gen import generate_email_summary
 from app.services.response_gen import generate_email_response
+from app.services.context_builder import build_conversation_context
+from app.services.deferred_summaries import submit_deferred_summaries
 
-def build_conversation_context(history, max_messages=6):
+logger = logging.getLogger(__name__)
+
+def process_emails_task(agent_id: int):
     """
-    Builds a textual context of the conversation for the AI, using the latest messages in the thread.
+    Processes the agent's new emails (see run_email_processing), reporting any error
+    instead of raising it. Returns the run statistics, or None if the run failed.
     """
-    context = "Conversa até agora:\n"
-    for msg in history[-max_messages:]:
-        sender = msg['from']
-        body = msg['body'].strip().replace('\n', ' ')
-        context += f"{sender}: {body}\n"
-    context += "---\n"
-    return context
+    try:
+        return run_email_processing(agent_id)
+    except Exception as e:
+        logger.exception("General error processing emails for the agent %s: %s", agent_id, e, extra={'agent_id': agent_id})
+        return None
+
+# One lock per agent, so the scheduler and the job queue never process the same mailbox at once
+_agent_locks = defaultdict(threading.Lock)
+_agent_locks_lock = threading.Lock()
+
+def _agent_lock(agent_id: int) -> threading.Lock:
+    with _agent_locks_lock:
+        return _agent_locks[agent_id]
+
+def run_email_processing(agent_id: int, on_progress=None) -> dict:
+    """
+    Processes the agent's new emails as a streaming pipeline:
+    fetch -> parse -> thread context -> summarize/reply -> send -> acknowledge.
+    Stages are connected by bounded queues and run concurrently, so the LLM calls for
+    one email overlap with the Gmail I/O of others. Every 5 processed emails a
+    consolidated summary is sent to the agent's own address; with SUMMARY_MODE=deferred
+    the summaries are instead submitted as one Batch API job after the run, and the
+    digest is sent when it completes (see app.services.deferred_summaries).
+
+    Returns a dictionary with the number of messages listed, ignored, processed, and
+    failed, and calls on_progress (if given) with a copy of it whenever it changes.
+    Raises if the agent cannot be loaded or its mailbox cannot be listed.
+    """
+    with _agent_lock(agent_id):
+        started = time.perf_counter()
+        stats = None
+        try:
+            stats = _run_email_processing(agent_id, on_progress)
+            return stats
+        finally:
+            metrics.record_run(agent_id, time.perf_counter() - started, stats)
+
+def _run_email_processing(agent_id: int, on_progress) -> dict:
+    stats = {'listed': 0, 'ignored': 0, 'skipped': 0, 'processed': 0, 'failed': 0}
+    stats_lock = threading.Lock()
+    report_lock = threading.Lock()
+
+    def report():
+        # on_progress may write to the database, so it runs outside stats_lock, which every stage
+        # shares. A stage that finds another one reporting skips its report: the snapshot taken
+        # next is newer, and the run's final counts are always reported from the main thread
+        if on_progress is None or not report_lock.acquire(blocking=False):
+            return
+        try:
+            with stats_lock:
+                snapshot = dict(stats)
+            on_progress(snapshot)
+        finally:
+            report_lock.release()
+
+    def count(key: str):
+        with stats_lock:
+            stats[key] += 1
+        report()
 
-def process_emails_task(agent_id: int):
     db = SessionLocal()
     try:
         agent = db.query(GmailAgent).filter(GmailAgent.id == agent_id).first()
         if not agent:
-            print(f"Agent with ID {agent_id} not found.")
-            return
+            raise LookupError(f"Agent with ID {agent_id} not found.")
 
-        cipher = get_cipher_suite()
-        # Descriptografe client_id, client_secret e refresh_token
-        # Make sure these fields are encrypted bytes in the DB
+        # Credentials are decrypted once and reused between runs; each thread gets its own service
         try:
-            client_id = cipher.decrypt(agent.client_id).decode()
-            client_secret = cipher.decrypt(agent.client_secret).decode()
-            refresh_token = cipher.decrypt(agent.refresh_token).decode()
-        except Exception as e:
-            print(f"Error decrypting credentials for agent {agent_id}: {e}")
-            print("Verify that the credentials were saved correctly and that the SECRET_KEY_ENCRYPTION is correct.")
-            return # Exit the function if decryption fails
-        service = get_gmail_service(client_id, client_secret, refresh_token)
-
-        # Search for recent emails (the unwanted category and sender filter is already in gmail_service)
-        # max_results here defines how many emails will be searched per task run.
-        # If you want the consolidated summary to always be 5 emails, even if there are more,
-        # you can keep max_results=5. If you want to process more emails in a single run
-        # and generate multiple consolidated summaries of 5, increase this value.
-        emails = fetch_recent_emails(client_id, client_secret, refresh_token, max_results=10) # Aumentado para 10 para ter mais chance de pegar 5
+            get_agent_gmail_credentials(agent)
+        except InvalidToken as e:
+            logger.error("Error decrypting credentials for agent %s: %s. Verify that the credentials were saved "
+                         "correctly and that the SECRET_KEY_ENCRYPTION is correct.", agent_id, e, extra={'agent_id': agent_id})
+            raise
+
+        agent_email = agent.email_gmail
+        # Rate limiter waits at the start, to report the time this run spent quota-bound
+        waits_before = _rate_limit_waits(agent_id)
+
+        # Search for new emails. The agent's ignore rules are pushed into the Gmail query where
+        # possible; the rest are checked before download (history labels) and in the parse stage
+        rules = get_agent_rules(db, agent_id)
+        # Quoted replies, signatures and other noise are stripped from the bodies sent to the LLM
+        cleaning = get_agent_cleaning_rules(db, agent_id) if PROMPT_CLEANING_ENABLED else None
+        # Ignored and processed emails are marked as read in bulk (batchModify) instead of one call each
+        acks = AcknowledgementBuffer(lambda: get_thread_gmail_service(agent))
+        history_id = None
+        with metrics.stage('list', agent_id):
+            if GMAIL_SYNC_MODE == "incremental":
+                # Only messages added since the last run are fetched, using the stored historyId cursor
+                messages, history_id = list_new_messages(get_thread_gmail_service(agent), db, agent_id, rules, acks)
+            else:
+                # max_results here defines how many emails will be searched per task run.
+                # If you want the consolidated summary to always be 5 emails, even if there are more,
+                # you can keep max_results=5. If you want to process more emails in a single run
+                # and generate multiple consolidated summaries of 5, increase this value.
+                messages = list_recent_messages(get_thread_gmail_service(agent), max_results=10, rules=rules) # Aumentado para 10 para ter mais chance de pegar 5
         
-        if not emails:
-            print(f"Nenhum e-mail recente para processar para o agente {agent_id}.")
-            return # Exit if there are no emails to process
+        stats['listed'] = len(messages)
+        report()
+        if not messages:
+            logger.info("Nenhum e-mail recente para processar para o agente %s.", agent_id, extra={'agent_id': agent_id})
+            acks.flush()
+            if history_id:
+                save_history_cursor(db, agent_id, history_id)
+            return stats # Exit if there are no emails to process
 
-        # Variables for the consolidated summary
+        # Variables for the consolidated summary (only touched by the single acknowledge worker)
         consolidated_summaries_content = []
-        processed_email_count = 0
+        deferred_emails = []
+        processed_ids = set()
+        deferred = SUMMARY_MODE == "deferred"
 
-        for email in emails:
-            # Promotions and spam/category/unwanted senders filtering is already in fetch_recent_emails,
-            # and ignored emails are already marked as read there.
-            # So, if an email reached this point, it should be processed.
-            
-            print(f"Processando e-mail: {email['subject']}")
+        # The ledger records what was already done for each message, so finished work is skipped:
+        # acknowledged messages (e.g. marked unread again by the user) are not processed again, even
+        # if their reply failed, and messages replied to by a run that stopped before acknowledging
+        # them are only acknowledged. In deferred mode those still go through the pipeline, without
+        # a new reply, as the digest is built from their bodies
+        ledger = message_ledger.load_states(agent_id, [msg['id'] for msg in messages])
+        pending = []
+        replied_ids = set()
+        for msg in messages:
+            state = ledger.get(msg['id'])
+            if state is not None and state['acknowledged']:
+                stats['skipped'] += 1
+            elif state is None or not state['replied']:
+                pending.append(msg)
+            elif deferred:
+                replied_ids.add(msg['id'])
+                pending.append(msg)
+            else:
+                acks.add(msg['id'])
+                processed_ids.add(msg['id'])
+                stats['processed'] += 1
+                if state['summary'] is not None:
+                    consolidated_summaries_content.append(
+                        f"Assunto: {state['subject']}\nRemetente: {state['from']}\nSumário: {state['summary']}\n---"
+                    )
+        if len(pending) < len(messages) or replied_ids:
+            logger.info("Agent %s: %d message(s) already replied to, per the ledger.", agent_id,
+                        len(messages) - len(pending) + len(replied_ids), extra={'agent_id': agent_id})
+            report()
+        messages = pending
 
-            # --- Generate Individual Summary and Add to Consolidated List ---
-            individual_summary = generate_email_summary(email['body'])
-            consolidated_summaries_content.append(
-                f"Assunto: {email['subject']}\nRemetente: {email['from']}\nSumário: {individual_summary}\n---"
-            )
-            processed_email_count += 1
-
-            # --- Generate and Send Reply (individual to original sender) ---
-            thread_id = email.get('threadId')
-            context = ""
-            if thread_id:
-                history = fetch_thread_history(service, thread_id)
-                context = build_conversation_context(history)
-            
-            reply_body = generate_email_response(email['body'], context=context)
-            reply_subject = f"Re: {email['subject']}" # Add "Re:" to indicate reply
+        def parse(fetched):
+            msg, msg_data = fetched
+            # Unwanted emails are marked as read here and dropped from the pipeline
+            with metrics.stage('parse', agent_id):
+                email = parse_message(get_thread_gmail_service(agent), msg, msg_data, rules, acks)
+            if email is None:
+                count('ignored')
+            else:
+                # Reused by the thread-context stage instead of being downloaded again
+                thread_cache.remember_message(agent_id, email.get('threadId'), email)
+            return email
+
+        def add_thread_context(emails):
+            # Fetch the conversation history of the waiting emails' threads in batched round trips,
+            # downloading only the messages that are not in the thread cache yet
+            with metrics.stage('thread_context', agent_id):
+                thread_histories = thread_cache.get_histories(
+                    get_thread_gmail_service(agent),
+                    agent_id,
+                    # Emails already replied to need no context
+                    [email['threadId'] for email in emails if email.get('threadId') and email['id'] not in replied_ids]
+                )
+            for email in emails:
+                history = thread_histories.get(email.get('threadId'))
+                if history and cleaning is not None:
+                    # Each earlier message usually quotes the whole conversation before it
+                    history = [{**msg, 'body': cleaning.clean(msg['body'])} for msg in history]
+                email['context'] = build_conversation_context(history, thread_id=email.get('threadId')) if history else ""
+            return emails
+
+        def summarize_and_reply(email):
+            logger.info("Processando e-mail: %s", email['subject'], extra={'agent_id': agent_id, 'message_id': email['id']})
+            if cleaning is not None:
+                with metrics.stage('clean', agent_id):
+                    email['prompt_body'] = clean_for_prompt(email['body'], cleaning)['text']
+            else:
+                email['prompt_body'] = email['body']
+            if not deferred:
+                state = ledger.get(email['id'])
+                if state is not None and state['summary'] is not None:
+                    email['summary'] = state['summary']
+                else:
+                    with metrics.stage('summary', agent_id):
+                        email['summary'] = generate_email_summary(email['prompt_body'])
+                    message_ledger.record_summary(agent_id, email, email['summary'])
+            if email['id'] in replied_ids:
+                return email
+            with metrics.stage('reply', agent_id):
+                email['reply'] = generate_email_response(email['prompt_body'], context=email['context'])
+            return email
 
+        def send_reply(email):
+            if email['id'] in replied_ids:
+                return email
+            reply_subject = f"Re: {email['subject']}" # Add "Re:" to indicate reply
             try:
                 # Send the reply to the original sender of the email
-                send_email(service, 
-                           to_email=email["from"], 
-                           from_email=agent.email_gmail, # The agent is the sender
-                           subject=reply_subject, 
-                           message_body=reply_body,
-                           thread_id=thread_id) # Ensures the reply is in the same thread
-
-                print(f"Response sent to {email['from']}! Subject: {reply_subject}")
+                with metrics.stage('send', agent_id):
+                    sent = send_email(get_thread_gmail_service(agent),
+                                      to_email=email["from"],
+                                      from_email=agent_email, # The agent is the sender
+                                      subject=reply_subject,
+                                      message_body=email['reply'],
+                                      thread_id=email.get('threadId')) # Ensures the reply is in the same thread
+                message_ledger.record_reply(agent_id, email, sent.get('id'))
+                thread_cache.remember_message(agent_id, sent.get('threadId'), {
+                    'id': sent.get('id'), 'from': agent_email, 'date': '', 'body': email['reply']
+                })
+
+                logger.info("Response sent to %s! Subject: %s", email['from'], reply_subject,
+                            extra={'agent_id': agent_id, 'message_id': email['id']})
             except Exception as e:
-                print(f"Error sending response: {e}")
+                logger.error("Error sending response: %s", e, extra={'agent_id': agent_id, 'message_id': email['id']})
+            if WEBHOOK_PIPELINE_ENABLED:
+                push_webhooks(email)
+            return email
+
+        def push_webhooks(email):
+            # Queued in the outbox; the dedupe keys keep a retried run from posting twice
+            metadata = {
+                'agent_id': agent_id, 'message_id': email['id'], 'thread_id': email.get('threadId'),
+                'subject': email['subject'], 'from': email['from'],
+            }
+            try:
+                if email.get('summary'):
+                    webhook_outbox.enqueue(RECIPIENT_URL, {'summary': email['summary'], 'metadata': metadata},
+                                           kind='summary', dedupe_key=f"summary:{agent_id}:{email['id']}")
+                webhook_outbox.enqueue(REPLY_URL, {
+                    'reply': email['reply'], 'recipient_email': email['from'], 'metadata': metadata
+                }, kind='reply', dedupe_key=f"reply:{agent_id}:{email['id']}")
+            except Exception as e:
+                logger.error("Error queueing webhooks for email %s: %s", email['id'], e, extra={'agent_id': agent_id})
+
+        def acknowledge(email):
+            thread_service = get_thread_gmail_service(agent)
+            # Mark email as read after processing (applied in bulk when the buffer is flushed)
+            acks.add(email['id'])
+            processed_ids.add(email['id'])
+            count('processed')
+
+            if deferred:
+                deferred_emails.append(email)
+                return
+
+            consolidated_summaries_content.append(
+                f"Assunto: {email['subject']}\nRemetente: {email['from']}\nSumário: {email['summary']}\n---"
+            )
 
-            # Mark email as read after processing (individually)
-            mark_email_as_read(service, email['id'])
-            
             # --- Verify that 5 emails were processed for the consolidated summary ---
-            if processed_email_count >= 5: # Use >= to ensure the summary is sent even if more than 5 are processed in a single call
-                print(f"Generating consolidated summary for the last {processed_email_count} e-mails...")
-                full_summary_text_for_consolidation = "\n\n".join(consolidated_summaries_content)
-                
-                # Use generate_email_summary to consolidate individual summaries
-                consolidated_summary_final = generate_email_summary(
-                    f"Consolidate the following email summaries into a single coherent summary:\n\n{full_summary_text_for_consolidation}"
-                )
-                
-                consolidated_subject = f"Consolidated Email Summary ({processed_email_count} e-mails)"
-                
-                try:
-                    # Send the consolidated summary to the agent owner
-                    send_email(service, 
-                               to_email=agent.email_gmail, 
-                               from_email=agent.email_gmail,
-                               subject=consolidated_subject, 
-                               message_body=consolidated_summary_final)
-                    print(f"Consolidated summary sent to{agent.email_gmail}!")
-                except Exception as e:
-                    print(f"Error sending consolidated summary: {e}")
-                
-                # Reset counters for the next batch of 5 emails
-                consolidated_summaries_content = []
-                processed_email_count = 0
+            if len(consolidated_summaries_content) >= 5:
+                send_consolidated_summary(thread_service, agent_email, consolidated_summaries_content)
+                # Reset for the next batch of 5 emails
+                consolidated_summaries_content.clear()
 
-    except Exception as e:
-        print(f"General error processing emails for the agent {agent_id}: {e}")
-    finally:
-        db.close()
+        # Bytes of the Gmail responses for the new messages (metadata and bodies)
+        transfer = {}
+
+        def fetched():
+            # A generator, so the service is built in the pipeline's source thread that consumes it
+            yield from iter_fetched_messages(get_thread_gmail_service(agent), messages, rules=rules, acks=acks,
+                                             on_ignored=lambda msg: count('ignored'), transfer=transfer,
+                                             on_error=lambda msg: count('failed'))
+
+        failures = run_pipeline(
+            metrics.timed_iter(fetched(), 'fetch', agent_id),
+            [
+                Stage("parse", parse),
+                Stage("thread-context", add_thread_context, batch_size=GMAIL_BATCH_SIZE),
+                Stage("summarize-reply", summarize_and_reply, concurrency=PIPELINE_LLM_CONCURRENCY),
+                Stage("send", send_reply, concurrency=PIPELINE_SEND_CONCURRENCY),
+                Stage("acknowledge", acknowledge),
+            ],
+            queue_size=PIPELINE_QUEUE_SIZE
+        )
+        logger.info("Agent %s: fetched %d message(s) with %s fetch, %d metadata bytes + %d body bytes.",
+                    agent_id, len(messages), GMAIL_FETCH_MODE, transfer['metadata_bytes'], transfer['body_bytes'],
+                    extra={'agent_id': agent_id})
+        gmail_wait, openai_wait = (after - before for after, before in zip(_rate_limit_waits(agent_id), waits_before))
+        if gmail_wait or openai_wait:
+            logger.info("Agent %s: waited %.2fs for the Gmail quota and %.2fs for the OpenAI rate limits "
+                        "(shared with concurrent runs).", agent_id, gmail_wait, openai_wait, extra={'agent_id': agent_id})
 
+        # Emails whose acknowledgement failed stay unread and are counted as failed
+        with metrics.stage('mark_read', agent_id):
+            unacknowledged = set(acks.flush())
+        processed_unacknowledged = len(unacknowledged & processed_ids)
+        stats['processed'] -= processed_unacknowledged
+        # Fetch failures were already counted as they happened
+        stats['failed'] += sum(failures.values()) + processed_unacknowledged
+        report()
+        message_ledger.record_acknowledged(agent_id, sorted(processed_ids - unacknowledged))
+
+        # Emails left unread are processed again by a later run, which puts them in its digest
+        deferred_emails = [email for email in deferred_emails if email['id'] not in unacknowledged]
+        if deferred_emails:
+            try:
+                submit_deferred_summaries(agent_id, deferred_emails)
+            except Exception as e:
+                logger.error("Error submitting deferred summaries for agent %s: %s", agent_id, e, extra={'agent_id': agent_id})
 
+        # Advance the sync cursor only after the emails were processed, so a crash means a retry.
+        # Failed emails stay unread: keeping the cursor lists them again on the next run, where the
+        # ledger skips the ones this run finished
+        if history_id and not stats['failed']:
+            save_history_cursor(db, agent_id, history_id)
+        elif history_id:
+            logger.warning("Agent %s: %d email(s) failed, keeping the sync cursor to retry them on the next run.",
+                           agent_id, stats['failed'], extra={'agent_id': agent_id})
+        message_ledger.prune_if_due()
+        return stats
+    finally:
+        db.close()
 
+def _rate_limit_waits(agent_id: int) -> tuple:
+    stats = rate_limiter.get_stats()
+    return (
+        rate_limiter.gmail_bucket(agent_id).get_stats()["wait_seconds"],
+        stats["openai_requests"]["wait_seconds"] + stats["openai_tokens"]["wait_seconds"],
+    )
 
+def send_consolidated_summary(service, agent_email: str, summaries: list):
+    """
+    Consolidates the individual summaries into a single one and emails it to the agent owner.
+    Returns whether the email was sent.
+    """
+    logger.info("Generating consolidated summary for the last %d e-mails...", len(summaries))
+    full_summary_text_for_consolidation = "\n\n".join(summaries)
+    
+    # Use generate_email_summary to consolidate individual summaries
+    consolidated_summary_final = generate_email_summary(
+        f"Consolidate the following email summaries into a single coherent summary:\n\n{full_summary_text_for_consolidation}"
+    )
+    
+    consolidated_subject = f"Consolidated Email Summary ({len(summaries)} e-mails)"
+    
+    try:
+        # Send the consolidated summary to the agent owner
+        send_email(service, 
+                   to_email=agent_email, 
+                   from_email=agent_email,
+                   subject=consolidated_subject, 
+                   message_body=consolidated_summary_final)
+        logger.info("Consolidated summary sent to %s!", agent_email)
+        return True
+    except Exception as e:
+        logger.error("Error sending consolidated summary: %s", e)
+        return False
@@ -1,18 +1,42 @@
 
+# Imported first so that startup timings are measured from the beginning of the import
+from app.services.startup_report import (
+    record_phase, mark_imported, mark_app_ready, mark_first_request, first_request_seen, get_startup_report
+)
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends, Request, Query, HTTPException, status
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse, Response
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.apis.database_connection import engine, Base, SessionLocal
+from app.apis.database_connection import engine, Base, get_db, get_async_db, dispose_async_engine
+from app.apis.migrations import run_migrations
+from app.apis import http_clients
 from app.models.gmail_agents import GmailAgent
+from app.models.sync_state import GmailSyncState
+from app.models.jobs import ProcessingJob
+from app.models.llm_cache import LLMCacheEntry
+from app.models.summary_batches import SummaryBatch
+from app.models.filter_rules import EmailFilterRules
+from app.models.cleaning_rules import EmailCleaningRules
+from app.models.message_ledger import ProcessedMessage
+from app.models.webhook_outbox import WebhookDelivery
+from app.models.gmail_watch import GmailWatch
 from app.routers.emailRouter import router as email_router
 from app.routers.summaryRouter import router as summary_router
 from app.routers.tasksRouter import router as tasks_router
+from app.routers.watchRouter import router as watch_router
 from app.models.schemas import AgentIn
 from app.services.encryption import get_cipher_suite
-from google_auth_oauthlib.flow import Flow
+from app.services import metrics
+from app.services.logging_config import configure_logging
+from app.services.gmail_client_cache import invalidate_agent_gmail_client
+from app.tasks.config import SCHEDULER_ENABLED, SUMMARY_MODE, GMAIL_WATCH_ENABLED, METRICS_ENABLED
+from app.tasks.scheduler import scheduler
+from app.tasks import job_queue
+from app.services import deferred_summaries, webhook_outbox, gmail_watch
 from urllib.parse import urlencode
-import google.oauth2.credentials
-import googleapiclient.discovery
+import logging
 import os
 
 
@@ -22,12 +46,39 @@ import httpx
 from dotenv import load_dotenv
 load_dotenv()
 
-SECRET_KEY_ENCRYPTION = os.getenv("SECRET_KEY_ENCRYPTION")
-print(f"Loaded Encryption Key: {SECRET_KEY_ENCRYPTION[:5]}...{SECRET_KEY_ENCRYPTION[-5:]}")
-
-Base.metadata.create_all(bind=engine)
+configure_logging()
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+SECRET_KEY_ENCRYPTION = os.getenv("SECRET_KEY_ENCRYPTION")
+logger.info("Loaded Encryption Key: %s...%s", SECRET_KEY_ENCRYPTION[:5], SECRET_KEY_ENCRYPTION[-5:])
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema creation runs when the server starts, not when the module is imported
+    with record_phase("create_schema"):
+        Base.metadata.create_all(bind=engine)
+    with record_phase("migrations"):
+        run_migrations(engine)
+    webhook_outbox.start_dispatcher()
+    job_queue.start()
+    if SCHEDULER_ENABLED:
+        scheduler.start()
+    if SUMMARY_MODE == "deferred":
+        deferred_summaries.start_poller()
+    if GMAIL_WATCH_ENABLED:
+        gmail_watch.start_renewer()
+    mark_app_ready()
+    yield
+    gmail_watch.stop_renewer()
+    deferred_summaries.stop_poller()
+    scheduler.stop()
+    job_queue.stop()
+    webhook_outbox.stop_dispatcher()
+    await http_clients.close_clients()
+    await dispose_async_engine()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
 
 # --- Google OAuth 2.0 Settings (Get from Google Cloud Console) ---
 # It is highly recommended to load these environment variables (dotenv)
@@ -45,29 +96,47 @@ if not GOOGLE_REDIRECT_URI:
 
 @app.exception_handler(Exception)
 async def generic_exception_handler(request: Request, exc: Exception):
-    print(f"Unexpected error: {exc}") # Add a print for debugging
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    logger.error("Unexpected error: %s", exc, exc_info=exc, extra={"method": request.method, "route": route})
+    metrics.UNHANDLED_ERRORS_TOTAL.inc(route=route)
     return JSONResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         content={"message": f"An unexpected error occurred: {exc}"},
     )
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+@app.middleware("http")
+async def first_request_timer(request: Request, call_next):
+    if not first_request_seen():
+        mark_first_request()
+    return await call_next(request)
+
+@app.get("/startup-report")
+def startup_report():
+    """
+    Returns startup timings (schema creation, deferred imports, time to ready and to first request)
+    so cold-start regressions can be tracked.
+    """
+    return get_startup_report()
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """
+    Returns the pipeline stage, external call, run and request metrics in the Prometheus text format.
+    """
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled.")
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 # --- Endpoint to Initiate OAuth 2.0 Authorization ---
 # This endpoint now receives the agent_id to associate the authorization with.
 @app.get("/authorize/{agent_id}")
-async def google_auth_init(agent_id: int, db: Session = Depends(get_db)):
+async def google_auth_init(agent_id: int, db: AsyncSession = Depends(get_async_db)):
     """
     Initiates the OAuth 2.0 authorization flow with Google for a specific agent.
     Redirects the user to the Google consent page.
     """
     # Optional: Check if agent_id exists in DB before starting authorization
-    db_agent = db.query(GmailAgent).filter(GmailAgent.id == agent_id).first()
+    db_agent = (await db.execute(select(GmailAgent).where(GmailAgent.id == agent_id))).scalars().first()
     if not db_agent:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -96,7 +165,10 @@ async def google_auth_init(agent_id: int, db: Session = Depends(get_db)):
 
 # --- OAuth 2.0 Callback Endpoint---
 @app.get("/auth/callback")
-async def google_auth_callback(request: Request, code: str = None, state: str = None, error: str = None, db: Session = Depends(get_db)):
+async def google_auth_callback(
+    request: Request, code: str = None, state: str = None, error: str = None,
+    db: AsyncSession = Depends(get_async_db), client: httpx.AsyncClient = Depends(http_clients.get_http_client)
+):
     """
     Receives the authorization code from Google, exchanges it for tokens, and saves the agent.    """
     if error:
@@ -125,7 +197,7 @@ async def google_auth_callback(request: Request, code: str = None, state: str =
         )
 
     # Busca o agente no banco de dados
-    db_agent = db.query(GmailAgent).filter(GmailAgent.id == agent_id).first()
+    db_agent = (await db.execute(select(GmailAgent).where(GmailAgent.id == agent_id))).scalars().first()
     if not db_agent:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -142,25 +214,25 @@ async def google_auth_callback(request: Request, code: str = None, state: str =
         "grant_type": "authorization_code"
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            # Google expects form parameters (application/x-www-form-urlencoded)
-            response = await client.post(token_url, data=token_params)
-            response.raise_for_status() # Raises exception for HTTP errors (4xx ou 5xx)
-            tokens = response.json()
-        except httpx.HTTPStatusError as e:
-            # Captures the specific Google error and details it
-            print(f"HTTP error when exchanging code for tokens: {e.response.status_code} - {e.response.text}")
-            raise HTTPException(
-                status_code=e.response.status_code,
-                detail=f"Error exchanging code for tokens with Google: {e.response.text}"
-            )
-        except httpx.RequestError as e:
-            print(f"Network error connecting to Google: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Network error connecting to Google: {e}"
-            )
+    # The shared client keeps the connection to Google open for the userinfo call below
+    try:
+        # Google expects form parameters (application/x-www-form-urlencoded)
+        response = await client.post(token_url, data=token_params)
+        response.raise_for_status() # Raises exception for HTTP errors (4xx ou 5xx)
+        tokens = response.json()
+    except httpx.HTTPStatusError as e:
+        # Captures the specific Google error and details it
+        logger.error("HTTP error when exchanging code for tokens: %s - %s", e.response.status_code, e.response.text)
+        raise HTTPException(
+            status_code=e.response.status_code,
+            detail=f"Error exchanging code for tokens with Google: {e.response.text}"
+        )
+    except httpx.RequestError as e:
+        logger.error("Network error connecting to Google: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Network error connecting to Google: {e}"
+        )
 
     refresh_token = tokens.get("refresh_token")
     access_token = tokens.get("access_token") # The access_token is short-lived, no need to save in the DB
@@ -177,21 +249,20 @@ async def google_auth_callback(request: Request, code: str = None, state: str =
     # It's a good practice to ensure the token is for the expected email address.
     userinfo_url = "https://www.googleapis.com/oauth2/v2/userinfo"
     headers = {"Authorization": f"Bearer {access_token}"}
-    async with httpx.AsyncClient() as client:
-        try:
-            userinfo_response = await client.get(userinfo_url, headers=headers)
-            userinfo_response.raise_for_status()
-            user_info = userinfo_response.json()
-            authorized_email = user_info.get("email")
-            authorized_name = user_info.get("name")
-        except httpx.HTTPStatusError as e:
-            print(f"Error getting user information: {e.response.status_code} - {e.response.text}")
-            authorized_email = "unknown@gmail.com"
-            authorized_name = "Unknown Agent"
-        except httpx.RequestError as e:
-            print(f"Network error while getting user information: {e}")
-            authorized_email = "unknown@gmail.com"
-            authorized_name = "Unknown Agent"
+    try:
+        userinfo_response = await client.get(userinfo_url, headers=headers)
+        userinfo_response.raise_for_status()
+        user_info = userinfo_response.json()
+        authorized_email = user_info.get("email")
+        authorized_name = user_info.get("name")
+    except httpx.HTTPStatusError as e:
+        logger.error("Error getting user information: %s - %s", e.response.status_code, e.response.text)
+        authorized_email = "unknown@gmail.com"
+        authorized_name = "Unknown Agent"
+    except httpx.RequestError as e:
+        logger.error("Network error while getting user information: %s", e)
+        authorized_email = "unknown@gmail.com"
+        authorized_name = "Unknown Agent"
 
     # --- Update the Agent in the Database ---
     # We use the agent_id from the 'state' to find the correct agent.
@@ -206,8 +277,11 @@ async def google_auth_callback(request: Request, code: str = None, state: str =
     # and would not need to be updated here unless you want to.
 
     db.add(db_agent) # Add to persist changes
-    db.commit()
-    db.refresh(db_agent) # Updates the object with data from the DB
+    await db.commit()
+    await db.refresh(db_agent) # Updates the object with data from the DB
+
+    # Drop cached credentials and Gmail service built from the previous refresh token
+    invalidate_agent_gmail_client(db_agent.id)
 
     return {"message": f"Agent {db_agent.name} ({db_agent.email_gmail}) authorized and updated successfully!", "agent_id": db_agent.id}
 
@@ -215,7 +289,7 @@ async def google_auth_callback(request: Request, code: str = None, state: str =
 @app.post("/agents/")
 def create_agent_manual(agent: AgentIn, db: Session = Depends(get_db)):
     # Check if the email already exists to avoid duplicates
-    existing_agent = db.query(GmailAgent).filter(GmailAgent.email_gmail == agent.email_gmail).first()
+    existing_agent = db.query(GmailAgent).filter(func.lower(GmailAgent.email_gmail) == agent.email_gmail.lower()).first()
     if existing_agent:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -243,5 +317,6 @@ def create_agent_manual(agent: AgentIn, db: Session = Depends(get_db)):
 app.include_router(email_router, prefix="/api", tags=["emails"])
 app.include_router(summary_router, prefix="/api", tags=["summary"])
 app.include_router(tasks_router, prefix="/api", tags=["tasks"])
+app.include_router(watch_router, prefix="/api", tags=["gmail-watch"])
 
-
+mark_imported()
@@ -0,0 +1,182 @@
+"""
+Benchmarks the prompt cleaning (app/services/email_cleaner.py) on a corpus of synthetic emails
+shaped like real mail and prints a JSON report per shape: the cleaning time per email
+(p50/p95), emails and MB per second, the extra time of counting the tokens before and after,
+and the tokens the cleaning saves.
+
+Shapes:
+    gmail_reply_chain  top-posted reply over several nested "On ... wrote:" / "> " levels
+    outlook_thread     Outlook "From:/Sent:" blocks with signatures and legal disclaimers
+    mobile_reply       short reply, "Sent from my iPhone" and the quoted message
+    newsletter         text newsletter full of tracking links, with an unsubscribe footer
+    plain              short message with nothing to remove (the cost on clean input)
+    long_report        large body with nothing to remove (the worst case for the regex passes)
+
+Usage:
+    python scripts/bench_cleaner.py [--emails 200] [--repeat 5] [--seed 1] [--long-kb 64]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Importing the models creates the engine; keep it off the real database
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from app.services.context_builder import count_tokens  # noqa: E402
+from app.services.email_cleaner import CleaningRules  # noqa: E402
+
+NAMES = ["Ana Souza", "João Silva", "Maria Oliveira", "Pedro Santos", "Laura Chen", "Mark Evans"]
+SENTENCES = [
+    "Podemos marcar a reunião para quinta-feira às 15h?",
+    "Segue em anexo o relatório do trimestre com os números atualizados.",
+    "I reviewed the proposal and left a few comments on the pricing section.",
+    "O cliente pediu para antecipar a entrega para o fim do mês.",
+    "Could you confirm the shipping address before we send the invoice?",
+    "Precisamos revisar o contrato antes da assinatura.",
+    "Let me know if the new timeline works for your team.",
+    "A equipe de suporte já abriu o chamado e deve responder hoje.",
+]
+DISCLAIMERS = [
+    "AVISO LEGAL: Esta mensagem e seus anexos são confidenciais e destinados exclusivamente ao "
+    "destinatário. Se você não for o destinatário, fica proibida a divulgação, cópia ou uso. "
+    "Caso tenha recebido esta mensagem por engano, apague-a e avise o remetente.",
+    "CONFIDENTIALITY NOTICE: This e-mail and any attachments are confidential and may be privileged. "
+    "If you are not the intended recipient, please notify the sender and delete this message. "
+    "Any unauthorized review, use or distribution is prohibited.",
+    "Please consider the environment before printing this e-mail.",
+]
+
+def _text(rng: random.Random, sentences: int) -> str:
+    return " ".join(rng.choice(SENTENCES) for _ in range(sentences))
+
+def _address(name: str) -> str:
+    return name.lower().replace(" ", ".").replace("ã", "a").replace("ç", "c") + "@example.com"
+
+def _signature(rng: random.Random, name: str) -> str:
+    return (
+        f"{rng.choice(['Atenciosamente,', 'Best regards,', 'Abraços,'])}\n{name}\n"
+        f"Gerente de Contas | ACME Comércio Ltda\nTel: +55 11 9{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}\n"
+        f"www.acme.com.br\n"
+    )
+
+def gmail_reply_chain(rng: random.Random) -> str:
+    body = ""
+    for level in range(rng.randint(2, 6)):
+        name = rng.choice(NAMES)
+        quoted = "\n".join("> " + line for line in body.split("\n")) if body else ""
+        header = (f"On Mon, Jun {rng.randint(1, 28)}, 2024 at {rng.randint(8, 18)}:{rng.randint(10, 59)} AM "
+                  f"{name} <{_address(name)}>\nwrote:\n") if quoted else ""
+        body = f"{_text(rng, rng.randint(1, 4))}\n\n{_signature(rng, name)}\n{header}{quoted}"
+    return body
+
+def outlook_thread(rng: random.Random) -> str:
+    parts = []
+    for level in range(rng.randint(2, 5)):
+        name = rng.choice(NAMES)
+        block = f"Olá,\n\n{_text(rng, rng.randint(2, 5))}\n\n{_signature(rng, name)}\n{rng.choice(DISCLAIMERS)}\n"
+        if level:
+            block = (f"________________________________\nDe: {name} <{_address(name)}>\nEnviado: segunda-feira, "
+                     f"{rng.randint(1, 28)} de junho de 2024 10:{rng.randint(10, 59)}\nPara: equipe@example.com\n"
+                     f"Assunto: RE: Proposta comercial\n\n") + block
+        parts.append(block)
+    return "\n".join(parts)
+
+def mobile_reply(rng: random.Random) -> str:
+    name = rng.choice(NAMES)
+    quoted = "\n".join("> " + line for line in (_text(rng, 5) + "\n\n" + _signature(rng, name)).split("\n"))
+    return (f"{_text(rng, 1)}\n\nEnviado do meu iPhone\n\n"
+            f"Em 3 de jun. de 2024, às 10:12, {name} <{_address(name)}> escreveu:\n\n{quoted}\n")
+
+def newsletter(rng: random.Random) -> str:
+    token = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(120))
+    lines = ["View this email in your browser: https://mailchi.mp/acme/news?e=" + token[:10], ""]
+    for item in range(rng.randint(4, 10)):
+        lines.append(f"{_text(rng, 2)}")
+        lines.append(f"Leia mais: https://click.acme-news.com/ls/click?upn={token}{item}"
+                     f"&utm_source=newsletter&utm_medium=email&utm_campaign=jun24&mc_eid={token[:10]}")
+        lines.append(f"https://acme.com/blog/post-{item}?utm_source=newsletter&utm_medium=email&id={item}")
+        lines.append("")
+    lines.append("You are receiving this email because you signed up at acme.com.")
+    lines.append("Unsubscribe: https://acme.us1.list-manage.com/unsubscribe?u=" + token)
+    lines.append("Manage your email preferences: https://acme.us1.list-manage.com/profile?u=" + token)
+    return "\n".join(lines)
+
+def plain(rng: random.Random) -> str:
+    return f"Oi,\n\n{_text(rng, rng.randint(2, 6))}\n\nObrigado!"
+
+def build_corpus(count: int, seed: int, long_kb: int) -> dict:
+    """
+    Returns `count` emails of each shape (a few of the large long_report ones), generated from `seed`.
+    """
+    rng = random.Random(seed)
+    shapes = {
+        "gmail_reply_chain": gmail_reply_chain,
+        "outlook_thread": outlook_thread,
+        "mobile_reply": mobile_reply,
+        "newsletter": newsletter,
+        "plain": plain,
+    }
+    corpus = {name: [build(rng) for _ in range(count)] for name, build in shapes.items()}
+    paragraph = _text(rng, 8) + "\n\n"
+    report = (paragraph * (long_kb * 1024 // len(paragraph) + 1))[:long_kb * 1024]
+    corpus["long_report"] = [report] * max(1, count // 20)
+    return corpus
+
+def _percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def measure(rules: CleaningRules, emails: list, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        for body in emails:
+            start = time.perf_counter()
+            rules.clean(body)
+            timings.append(time.perf_counter() - start)
+    total = sum(timings) / repeat
+    chars = sum(len(body) for body in emails)
+
+    cleaned = [rules.clean(body) for body in emails]
+    start = time.perf_counter()
+    original_tokens = sum(count_tokens(body) for body in emails)
+    cleaned_tokens = sum(count_tokens(body) for body in cleaned)
+    counting = time.perf_counter() - start
+    return {
+        "emails": len(emails),
+        "mean_chars": round(chars / len(emails)),
+        "p50_us": round(_percentile(timings, 0.5) * 1e6, 1),
+        "p95_us": round(_percentile(timings, 0.95) * 1e6, 1),
+        "emails_per_second": round(len(emails) / total) if total else None,
+        "mb_per_second": round(chars / 1024 / 1024 / total, 1) if total else None,
+        "token_counting_us_per_email": round(counting / len(emails) * 1e6, 1),
+        "original_tokens": original_tokens,
+        "cleaned_tokens": cleaned_tokens,
+        "saved_fraction": round(1 - cleaned_tokens / original_tokens, 3) if original_tokens else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=200, help="Emails per shape")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--long-kb", type=int, default=64, help="Body size of the long_report emails")
+    args = parser.parse_args()
+
+    rules = CleaningRules()
+    count_tokens("warm-up")  # loads the tokenizer outside the timings
+    corpus = build_corpus(args.emails, args.seed, args.long_kb)
+    report = {"emails_per_shape": args.emails, "repeat": args.repeat, "shapes": {}}
+    for name, emails in corpus.items():
+        report["shapes"][name] = measure(rules, emails, args.repeat)
+    shapes = report["shapes"].values()
+    original = sum(shape["original_tokens"] for shape in shapes)
+    report["saved_fraction"] = round(1 - sum(shape["cleaned_tokens"] for shape in shapes) / original, 3)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
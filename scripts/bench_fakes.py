@@ -0,0 +1,475 @@
+"""
+In-process fakes of the Gmail REST surface and of OpenAI chat completions used by the
+pipeline benchmark (scripts/bench_pipeline.py). They answer like the real services for the
+calls this project makes, after a configurable latency, and can inject errors.
+
+Gmail: users.messages list/get/send/modify/batchModify, users.threads.get,
+users.history.list, users.getProfile and batch requests (new_batch_http_request).
+Requests carry the same methodId as googleapiclient's, so the rate limiter charges them
+the same quota units. OpenAI: chat.completions.create, sync and async (with stream=True).
+"""
+import asyncio
+import base64
+import json
+import random
+import threading
+import time
+from collections import Counter
+from email import message_from_bytes
+
+import httpx
+import httplib2
+import openai
+from googleapiclient.errors import HttpError
+
+SENDERS = [
+    'Ana Souza <ana.souza@example.com>',
+    'Bruno Lima <bruno@example.org>',
+    'Carla Mendes <carla.mendes@example.net>',
+    'Diego Alves <diego@example.com>',
+]
+# Senders ignored by the default filter rules, so the filters are exercised too
+IGNORED_SENDERS = ['noreply@mail.instagram.com', 'Loja <ofertas@promo.example.com>']
+
+class Faults:
+    """
+    Latency and error injection shared by the calls of one fake service.
+
+    Args:
+        latency_ms (float): Latency of each HTTP round trip (a batch is one round trip).
+        jitter_ms (float): Random extra latency, uniform between 0 and jitter_ms.
+        error_rate (float): Share of calls that fail with a server error (HTTP 500).
+        rate_limit_rate (float): Share of calls rejected as rate-limited (HTTP 429).
+        retry_after (float): Retry-After of the rate-limited responses, in seconds (None to omit it).
+        seed (int): Seed of the random generator, for reproducible runs.
+    """
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0,
+                 rate_limit_rate: float = 0, retry_after: float = None, seed: int = None):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.errors = Counter()
+
+    def _uniform(self) -> float:
+        with self._lock:
+            return self._random.random()
+
+    def delay(self) -> float:
+        return self.latency + (self.jitter * self._uniform() if self.jitter else 0)
+
+    def sleep(self):
+        delay = self.delay()
+        if delay > 0:
+            time.sleep(delay)
+
+    def record(self, method: str):
+        with self._lock:
+            self.calls[method] += 1
+
+    def draw_error(self, method: str):
+        """
+        Returns None, 500 or 429, the injected outcome of one call.
+        """
+        if not self.error_rate and not self.rate_limit_rate:
+            return None
+        draw = self._uniform()
+        status = None
+        if draw < self.rate_limit_rate:
+            status = 429
+        elif draw < self.rate_limit_rate + self.error_rate:
+            status = 500
+        if status is not None:
+            with self._lock:
+                self.errors[f"{method}:{status}"] += 1
+        return status
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"calls": dict(self.calls), "injected_errors": dict(self.errors)}
+
+# --- Gmail ---
+
+def _encode(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode()
+
+def _gmail_error(status: int, retry_after: float = None) -> HttpError:
+    headers = {'status': str(status)}
+    if status == 429 and retry_after is not None:
+        headers['retry-after'] = str(retry_after)
+    reason = 'rateLimitExceeded' if status == 429 else 'backendError'
+    content = json.dumps({"error": {"code": status, "errors": [{"reason": reason}]}}).encode()
+    return HttpError(httplib2.Response(headers), content, uri='https://gmail.googleapis.com/fake')
+
+class FakeMailbox:
+    """
+    The state of one Gmail mailbox: messages, threads, labels and a history of added messages.
+    """
+    def __init__(self, address: str, seed: int = None):
+        self.address = address
+        self.messages = {}  # message ID -> message resource (format=full)
+        self.threads = {}  # thread ID -> list of message IDs
+        self.history = []  # (historyId, message ID) of each added message
+        self.history_id = 1000
+        self.sent = []
+        self._next_id = 0
+        self._random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def _new_id(self, prefix: str) -> str:
+        self._next_id += 1
+        return f"{prefix}{self._next_id:08x}"
+
+    def add_message(self, sender: str, subject: str, body: str, thread_id: str = None,
+                    label_ids: list = None) -> dict:
+        with self.lock:
+            message_id = self._new_id('m')
+            thread_id = thread_id or self._new_id('t')
+            payload = {
+                'mimeType': 'multipart/alternative',
+                'filename': '',
+                'headers': [
+                    {'name': 'From', 'value': sender},
+                    {'name': 'To', 'value': self.address},
+                    {'name': 'Subject', 'value': subject},
+                    {'name': 'Date', 'value': time.strftime('%a, %d %b %Y %H:%M:%S +0000', time.gmtime())},
+                    {'name': 'Content-Type', 'value': 'multipart/alternative; boundary="b1"'},
+                    {'name': 'Message-ID', 'value': f'<{message_id}@example.com>'},
+                ] + [{'name': 'Received', 'value': f'from mx{n}.example.com by relay{n}.example.com'} for n in range(8)],
+                'body': {'size': 0},
+                'parts': [
+                    {'mimeType': 'text/plain', 'filename': '', 'headers': [], 'body': {'size': len(body), 'data': _encode(body)}},
+                    {'mimeType': 'text/html', 'filename': '', 'headers': [],
+                     'body': {'size': len(body) + 26, 'data': _encode(f"<html><body><p>{body}</p></body></html>")}},
+                ],
+            }
+            message = {
+                'id': message_id,
+                'threadId': thread_id,
+                'labelIds': list(label_ids or ['INBOX', 'UNREAD', 'CATEGORY_PERSONAL']),
+                'snippet': body[:100],
+                'sizeEstimate': len(body) * 2 + 800,
+                'payload': payload,
+            }
+            self.messages[message_id] = message
+            self.threads.setdefault(thread_id, []).append(message_id)
+            self.history_id += 1
+            self.history.append((self.history_id, message_id))
+            return message
+
+    def add_incoming(self, count: int, body_chars: int = 1200, ignored_share: float = 0.1,
+                     reply_share: float = 0.3, tag: str = '') -> list:
+        """
+        Adds `count` unread messages: some from ignored senders, some in existing threads.
+        """
+        paragraph = ("Olá, tudo bem? Gostaria de confirmar os detalhes do pedido e o prazo de entrega "
+                     "combinado na última reunião. Pode me enviar a proposta atualizada? ")
+        added = []
+        for n in range(count):
+            draw = self._random.random()
+            sender = self._random.choice(IGNORED_SENDERS if draw < ignored_share else SENDERS)
+            thread_id = None
+            if self.threads and self._random.random() < reply_share:
+                thread_id = self._random.choice(list(self.threads))
+            body = f"[{tag}-{n}] " + (paragraph * (body_chars // len(paragraph) + 1))[:body_chars]
+            label_ids = ['INBOX', 'UNREAD', 'CATEGORY_PROMOTIONS' if 'promo' in sender else 'CATEGORY_PERSONAL']
+            added.append(self.add_message(sender, f"Pedido {tag}-{n}", body, thread_id, label_ids))
+        return added
+
+    def unread_count(self) -> int:
+        with self.lock:
+            return sum(1 for message in self.messages.values() if 'UNREAD' in message['labelIds'])
+
+def _header(message: dict, name: str) -> str:
+    return next((h['value'] for h in message['payload']['headers'] if h['name'].lower() == name.lower()), '')
+
+def _matches_query(message: dict, query: str) -> bool:
+    """
+    Evaluates the subset of the Gmail search syntax used by the filter rules:
+    "{term term}" (any term) and "-{...}" (none), with from: and category: terms.
+    """
+    if not query:
+        return True
+    negate = query.startswith('-')
+    terms = query.lstrip('-').strip('{}').split()
+    sender = _header(message, 'From').lower()
+    labels = message['labelIds']
+    hit = False
+    for term in terms:
+        key, _, value = term.partition(':')
+        if key == 'from' and value.strip('"').lower() in sender:
+            hit = True
+        elif key == 'category' and f"CATEGORY_{'PERSONAL' if value == 'primary' else value.upper()}" in labels:
+            hit = True
+    return hit != negate
+
+def _project(message: dict, format: str, metadata_headers: list = None, fields: str = None) -> dict:
+    if format == 'minimal':
+        return {'id': message['id'], 'threadId': message['threadId'], 'labelIds': message['labelIds']}
+    if format == 'metadata':
+        wanted = {name.lower() for name in metadata_headers or []}
+        headers = [h for h in message['payload']['headers'] if not wanted or h['name'].lower() in wanted]
+        return {'id': message['id'], 'threadId': message['threadId'], 'labelIds': message['labelIds'],
+                'payload': {'headers': headers}}
+    if fields and fields.startswith('id,payload('):
+        # The body phase of the two-phase fetch: parts without the top-level headers
+        return {'id': message['id'], 'payload': {k: v for k, v in message['payload'].items() if k != 'headers'}}
+    return message
+
+class FakeRequest:
+    """
+    A Gmail API request (googleapiclient HttpRequest): execute() is one HTTP round trip.
+    """
+    def __init__(self, service, method_id: str, func):
+        self._service = service
+        self.methodId = method_id
+        self._func = func
+
+    def _call(self):
+        faults = self._service.faults
+        faults.record(self.methodId)
+        status = faults.draw_error(self.methodId)
+        if status is not None:
+            raise _gmail_error(status, faults.retry_after)
+        return self._func()
+
+    def execute(self, num_retries: int = 0):
+        self._service.faults.sleep()
+        return self._call()
+
+class FakeBatch:
+    """
+    A batch request: all the requests are answered in one round trip, each with its own
+    response or error passed to the callback, like the multipart batch endpoint.
+    """
+    def __init__(self, service, callback):
+        self._service = service
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request: FakeRequest, callback=None, request_id: str = None):
+        self._requests.append((request_id or str(len(self._requests)), request, callback or self._callback))
+
+    def execute(self):
+        self._service.faults.record('batch')
+        self._service.faults.sleep()
+        for request_id, request, callback in self._requests:
+            try:
+                response, error = request._call(), None
+            except Exception as e:
+                response, error = None, e
+            callback(request_id, response, error)
+
+class FakeGmailService:
+    """
+    The Gmail service object (users() resource chain) of one mailbox.
+    """
+    def __init__(self, mailbox: FakeMailbox, faults: Faults):
+        self.mailbox = mailbox
+        self.faults = faults
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return _Messages(self)
+
+    def threads(self):
+        return _Threads(self)
+
+    def history(self):
+        return _History(self)
+
+    def getProfile(self, userId: str):
+        mailbox = self.mailbox
+        return FakeRequest(self, 'gmail.users.getProfile', lambda: {
+            'emailAddress': mailbox.address, 'messagesTotal': len(mailbox.messages), 'historyId': str(mailbox.history_id)
+        })
+
+class _Messages:
+    def __init__(self, service: FakeGmailService):
+        self._service = service
+        self._mailbox = service.mailbox
+
+    def list(self, userId: str, maxResults: int = 100, q: str = None, labelIds: list = None,
+             fields: str = None, pageToken: str = None):
+        def run():
+            with self._mailbox.lock:
+                # Newest first, as Gmail lists them
+                found = [
+                    message for message in reversed(list(self._mailbox.messages.values()))
+                    if all(label in message['labelIds'] for label in labelIds or []) and _matches_query(message, q)
+                ][:maxResults]
+            return {'messages': [{'id': m['id'], 'threadId': m['threadId']} for m in found],
+                    'resultSizeEstimate': len(found)}
+        return FakeRequest(self._service, 'gmail.users.messages.list', run)
+
+    def get(self, userId: str, id: str, format: str = 'full', metadataHeaders: list = None, fields: str = None):
+        def run():
+            message = self._mailbox.messages.get(id)
+            if message is None:
+                raise HttpError(httplib2.Response({'status': '404'}), b'{"error": {"code": 404}}', uri='fake')
+            return _project(message, format, metadataHeaders, fields)
+        return FakeRequest(self._service, 'gmail.users.messages.get', run)
+
+    def send(self, userId: str, body: dict):
+        def run():
+            mime = message_from_bytes(base64.urlsafe_b64decode(body['raw']))
+            payload = mime.get_payload(decode=True) or b''
+            sent = self._mailbox.add_message(
+                self._mailbox.address, mime['subject'] or '', payload.decode('utf-8', errors='replace'),
+                thread_id=body.get('threadId'), label_ids=['SENT']
+            )
+            with self._mailbox.lock:
+                self._mailbox.sent.append(sent['id'])
+            return {'id': sent['id'], 'threadId': sent['threadId'], 'labelIds': ['SENT']}
+        return FakeRequest(self._service, 'gmail.users.messages.send', run)
+
+    def _change_labels(self, ids: list, body: dict):
+        with self._mailbox.lock:
+            for message_id in ids:
+                message = self._mailbox.messages.get(message_id)
+                if message is None:
+                    continue
+                labels = [label for label in message['labelIds'] if label not in body.get('removeLabelIds', [])]
+                message['labelIds'] = labels + [label for label in body.get('addLabelIds', []) if label not in labels]
+
+    def modify(self, userId: str, id: str, body: dict):
+        def run():
+            self._change_labels([id], body)
+            return {'id': id}
+        return FakeRequest(self._service, 'gmail.users.messages.modify', run)
+
+    def batchModify(self, userId: str, body: dict):
+        def run():
+            self._change_labels(body['ids'], body)
+            return ''
+        return FakeRequest(self._service, 'gmail.users.messages.batchModify', run)
+
+class _Threads:
+    def __init__(self, service: FakeGmailService):
+        self._service = service
+        self._mailbox = service.mailbox
+
+    def get(self, userId: str, id: str, format: str = 'full', fields: str = None):
+        def run():
+            with self._mailbox.lock:
+                message_ids = list(self._mailbox.threads.get(id, []))
+            if not message_ids:
+                raise HttpError(httplib2.Response({'status': '404'}), b'{"error": {"code": 404}}', uri='fake')
+            if fields == 'messages/id':
+                return {'messages': [{'id': message_id} for message_id in message_ids]}
+            return {'id': id, 'messages': [_project(self._mailbox.messages[m], format) for m in message_ids]}
+        return FakeRequest(self._service, 'gmail.users.threads.get', run)
+
+class _History:
+    def __init__(self, service: FakeGmailService):
+        self._service = service
+        self._mailbox = service.mailbox
+
+    def list(self, userId: str, startHistoryId: str, historyTypes: list = None, labelId: str = None,
+             pageToken: str = None, maxResults: int = 500):
+        def run():
+            start = int(pageToken or startHistoryId)
+            with self._mailbox.lock:
+                records = [(hid, mid) for hid, mid in self._mailbox.history if hid > start]
+                page, rest = records[:maxResults], records[maxResults:]
+                history = []
+                for hid, message_id in page:
+                    message = self._mailbox.messages[message_id]
+                    if labelId and labelId not in message['labelIds']:
+                        continue
+                    history.append({'id': str(hid), 'messagesAdded': [{'message': {
+                        'id': message_id, 'threadId': message['threadId'], 'labelIds': list(message['labelIds'])
+                    }}]})
+                response = {'history': history, 'historyId': str(self._mailbox.history_id)}
+                if rest:
+                    response['nextPageToken'] = str(page[-1][0])
+            return response
+        return FakeRequest(self._service, 'gmail.users.history.list', run)
+
+# --- OpenAI ---
+
+class _Obj:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+def _openai_error(status: int, retry_after: float = None):
+    headers = {'retry-after': str(retry_after)} if status == 429 and retry_after is not None else {}
+    response = httpx.Response(status, headers=headers,
+                              request=httpx.Request('POST', 'https://api.openai.com/v1/chat/completions'))
+    if status == 429:
+        return openai.RateLimitError("Rate limit reached (injected)", response=response, body=None)
+    return openai.InternalServerError("Server error (injected)", response=response, body=None)
+
+class FakeOpenAI:
+    """
+    Stands in for openai.OpenAI and openai.AsyncOpenAI (chat.completions.create only).
+    The latency of a completion is the round trip latency plus ms_per_token for each
+    generated token; the text is a deterministic function of the prompt.
+    """
+    def __init__(self, faults: Faults, ms_per_token: float = 0, completion_tokens: int = 60,
+                 asynchronous: bool = False):
+        self.faults = faults
+        self.ms_per_token = ms_per_token
+        self.completion_tokens = completion_tokens
+        completions = _AsyncCompletions(self) if asynchronous else _Completions(self)
+        self.chat = _Obj(completions=completions)
+
+    def _duration(self, max_tokens: int) -> float:
+        return self.faults.delay() + self.ms_per_token * min(max_tokens, self.completion_tokens) / 1000
+
+    def _start(self, request: dict):
+        self.faults.record('chat.completions.create')
+        status = self.faults.draw_error('chat.completions.create')
+        if status is not None:
+            raise _openai_error(status, self.faults.retry_after)
+
+    def _text(self, request: dict) -> str:
+        prompt = request['messages'][-1]['content']
+        words = prompt.split()[-self.completion_tokens:]
+        return "Resumo: " + " ".join(words[:max(1, min(len(words), request.get('max_tokens', 300)))])
+
+    def _response(self, request: dict) -> _Obj:
+        text = self._text(request)
+        prompt_tokens = sum(len(m.get('content') or '') for m in request['messages']) // 4
+        completion_tokens = len(text) // 4
+        return _Obj(
+            choices=[_Obj(message=_Obj(role='assistant', content=text), finish_reason='stop', index=0)],
+            usage=_Obj(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                       total_tokens=prompt_tokens + completion_tokens),
+        )
+
+class _Completions:
+    def __init__(self, client: FakeOpenAI):
+        self._client = client
+
+    def create(self, **request):
+        self._client._start(request)
+        time.sleep(self._client._duration(request.get('max_tokens', 300)))
+        return self._client._response(request)
+
+class _AsyncCompletions:
+    def __init__(self, client: FakeOpenAI):
+        self._client = client
+
+    async def create(self, stream: bool = False, **request):
+        self._client._start(request)
+        duration = self._client._duration(request.get('max_tokens', 300))
+        if not stream:
+            await asyncio.sleep(duration)
+            return self._client._response(request)
+        return self._stream(self._client._text(request), duration)
+
+    async def _stream(self, text: str, duration: float):
+        words = text.split(' ')
+        for word in words:
+            await asyncio.sleep(duration / len(words))
+            yield _Obj(choices=[_Obj(delta=_Obj(content=word + ' '), index=0)])
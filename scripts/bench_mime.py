@@ -0,0 +1,104 @@
+"""
+Benchmarks the email body extraction (app/services/mime_body.py) on large synthetic Gmail
+payloads and prints a JSON report with the parse time and peak memory per message shape,
+next to the previous top-level-only extraction for comparison.
+
+Usage:
+    python scripts/bench_mime.py [--size-mb 5] [--repeat 5] [--max-bytes 65536]
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.services.mime_body import extract_body  # noqa: E402
+
+def _encode(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode()
+
+def _part(mime_type: str, text: str, filename: str = '') -> dict:
+    return {
+        'mimeType': mime_type,
+        'filename': filename,
+        'headers': [{'name': 'Content-Type', 'value': f'{mime_type}; charset="UTF-8"'}],
+        'body': {'size': len(text), 'data': _encode(text)},
+    }
+
+def build_payloads(size: int) -> dict:
+    """
+    Returns Gmail payloads of about `size` bytes of body each, in the shapes that matter:
+    a single part, nested multipart/alternative with an attachment, and HTML only.
+    """
+    plain = ("Olá, segue o relatório do trimestre com os números atualizados. " * (size // 64 + 1))[:size]
+    markup = "<html><head><style>p{color:red}</style></head><body>" + (
+        "<p>Olá, segue o <b>relatório</b> do trimestre &amp; os números.</p>" * (size // 72 + 1)
+    ) + "</body></html>"
+    attachment = _part('application/pdf', "%PDF-1.4 " * (size // 9 + 1), filename='report.pdf')
+    return {
+        'single_part_plain': _part('text/plain', plain),
+        'nested_alternative_with_attachment': {
+            'mimeType': 'multipart/mixed',
+            'parts': [
+                attachment,
+                {'mimeType': 'multipart/alternative', 'parts': [_part('text/plain', plain), _part('text/html', markup)]},
+            ],
+        },
+        'html_only': {'mimeType': 'multipart/mixed', 'parts': [_part('text/html', markup), attachment]},
+    }
+
+def legacy_extract_body(payload: dict) -> str:
+    """
+    The extraction used before mime_body: top-level text/plain parts only, decoded whole.
+    """
+    body = ''
+    if 'parts' in payload:
+        for part in payload['parts']:
+            if part['mimeType'] == 'text/plain' and 'body' in part and 'data' in part['body']:
+                body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
+                break
+    else:
+        if 'body' in payload and 'data' in payload['body']:
+            body = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
+    return body
+
+def measure(func, payload: dict, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = func(payload)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "best_ms": round(min(timings) * 1000, 3),
+        "mean_ms": round(sum(timings) / len(timings) * 1000, 3),
+        "peak_memory_kb": round(peak / 1024, 1),
+        "body_chars": len(body),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=5.0, help="Body size of each message")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-bytes", type=int, default=65536, help="Byte limit of the extractor (0 for none)")
+    args = parser.parse_args()
+
+    report = {"size_bytes": int(args.size_mb * 1024 * 1024), "max_bytes": args.max_bytes, "messages": {}}
+    for name, payload in build_payloads(report["size_bytes"]).items():
+        report["messages"][name] = {
+            "extract_body": measure(lambda p: extract_body(p, max_bytes=args.max_bytes), payload, args.repeat),
+            "legacy": measure(legacy_extract_body, payload, args.repeat),
+        }
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
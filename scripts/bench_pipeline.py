@@ -0,0 +1,411 @@
+"""
+End-to-end throughput benchmark of the email pipeline against in-process fakes of Gmail and
+OpenAI (scripts/bench_fakes.py), so changes can be measured without live services.
+
+Scenarios:
+    pipeline       process_emails_task for every agent, `--concurrency` agents at a time,
+                   after `--emails` new messages arrive in each mailbox (`--iterations` rounds)
+    emails-recent  GET /api/emails/recent, `--requests` calls spread over the agents
+    summary        POST /api/summary, `--requests` calls with distinct email bodies
+
+The report (JSON, printed or written to --output) has the emails per second, the p50/p95/p99
+latency of each pipeline stage and of each request, the calls and injected errors seen by the
+fakes, the rate limiter waits and the peak memory, for comparing runs. The app runs on a
+temporary SQLite database; its settings can be changed through the usual environment
+variables (e.g. PIPELINE_LLM_CONCURRENCY, GMAIL_BATCH_SIZE, GMAIL_FETCH_MODE).
+
+Usage:
+    python scripts/bench_pipeline.py [--agents 4] [--emails 50] [--concurrency 4] [--iterations 3]
+        [--requests 100] [--scenarios pipeline,emails-recent,summary]
+        [--gmail-latency-ms 40] [--openai-latency-ms 300] [--openai-ms-per-token 5]
+        [--gmail-error-rate 0.01] [--openai-rate-limit-rate 0.02] [--tracemalloc] [--output report.json]
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCENARIOS = ("pipeline", "emails-recent", "summary")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", type=int, default=4, help="Number of agents (mailboxes)")
+    parser.add_argument("--emails", type=int, default=50, help="New emails per mailbox in each round")
+    parser.add_argument("--concurrency", type=int, default=4, help="Agents processed / requests sent at once")
+    parser.add_argument("--iterations", type=int, default=3, help="Rounds of the pipeline scenario")
+    parser.add_argument("--requests", type=int, default=100, help="Requests of the HTTP scenarios")
+    parser.add_argument("--recent-limit", type=int, default=10, help="`limit` of /api/emails/recent")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios to run")
+    parser.add_argument("--body-chars", type=int, default=1200, help="Size of the email bodies")
+    parser.add_argument("--ignored-share", type=float, default=0.1, help="Share of emails from ignored senders")
+    parser.add_argument("--reply-share", type=float, default=0.3, help="Share of emails in existing threads")
+    parser.add_argument("--gmail-latency-ms", type=float, default=40)
+    parser.add_argument("--gmail-jitter-ms", type=float, default=10)
+    parser.add_argument("--gmail-error-rate", type=float, default=0.0, help="Share of Gmail calls failing with HTTP 500")
+    parser.add_argument("--gmail-rate-limit-rate", type=float, default=0.0, help="Share of Gmail calls failing with HTTP 429")
+    parser.add_argument("--openai-latency-ms", type=float, default=300)
+    parser.add_argument("--openai-jitter-ms", type=float, default=100)
+    parser.add_argument("--openai-ms-per-token", type=float, default=5, help="Generation time per completion token")
+    parser.add_argument("--openai-error-rate", type=float, default=0.0, help="Share of completions failing with HTTP 500")
+    parser.add_argument("--openai-rate-limit-rate", type=float, default=0.0, help="Share of completions failing with HTTP 429")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After of the injected 429 responses")
+    parser.add_argument("--no-rate-limit", action="store_true", help="Disable the client-side rate limiter")
+    parser.add_argument("--llm-cache", action="store_true", help="Keep the LLM response cache enabled")
+    parser.add_argument("--tracemalloc", action="store_true", help="Trace the peak Python heap (slows the run)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="Show the app's output")
+    parser.add_argument("--output", default=None, help="Write the report to this file instead of stdout")
+    return parser.parse_args()
+
+def configure_environment(args, workdir: str):
+    """
+    Points the app at a temporary database and sets the benchmark's settings. Must run before
+    the app is imported, since its configuration is read at import time.
+    """
+    from cryptography.fernet import Fernet
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.pop("DATABASE_ASYNC_URL", None)
+    os.environ["SECRET_KEY_ENCRYPTION"] = Fernet.generate_key().decode()
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ.setdefault("GOOGLE_CLIENT_ID", "bench")
+    os.environ.setdefault("GOOGLE_CLIENT_SECRET", "bench")
+    os.environ.setdefault("GOOGLE_REDIRECT_URI", "http://127.0.0.1:8000/auth/callback")
+    # The first run of each agent resyncs; the measured rounds use the history cursor
+    os.environ.setdefault("GMAIL_RESYNC_MAX_RESULTS", str(max(10, args.emails)))
+    os.environ["RATE_LIMIT_ENABLED"] = "false" if args.no_rate_limit else os.getenv("RATE_LIMIT_ENABLED", "true")
+    os.environ["LLM_CACHE_ENABLED"] = "true" if args.llm_cache else "false"
+    for name in ("SCHEDULER_ENABLED", "GMAIL_WATCH_ENABLED", "WEBHOOK_PIPELINE_ENABLED"):
+        os.environ[name] = "false"
+    os.environ["SUMMARY_MODE"] = "sync"
+    if not args.verbose:
+        os.environ["LOG_LEVEL"] = "CRITICAL"
+
+def percentiles(values: list) -> dict:
+    """
+    Returns the count, mean, p50, p95, p99 and max of durations in seconds, in milliseconds.
+    """
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        # Nearest-rank percentile
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+        "p50_ms": round(rank(50) * 1000, 2),
+        "p95_ms": round(rank(95) * 1000, 2),
+        "p99_ms": round(rank(99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+class StageTimings:
+    """
+    Collects the duration of every pipeline stage call (see pipeline.add_stage_observer).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations = defaultdict(list)
+        self.items = Counter()
+
+    def __call__(self, stage_name: str, seconds: float, items: int):
+        with self._lock:
+            self.durations[stage_name].append(seconds)
+            self.items[stage_name] += items
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                name: {**percentiles(durations), "items": self.items[name]}
+                for name, durations in self.durations.items()
+            }
+
+class Bench:
+    def __init__(self, args):
+        import bench_fakes
+        from app.services import rate_limiter
+
+        self.args = args
+        self.fakes = bench_fakes
+        self.rate_limiter = rate_limiter
+        self.gmail_faults = bench_fakes.Faults(
+            args.gmail_latency_ms, args.gmail_jitter_ms, args.gmail_error_rate,
+            args.gmail_rate_limit_rate, args.retry_after, seed=args.seed
+        )
+        self.openai_faults = bench_fakes.Faults(
+            args.openai_latency_ms, args.openai_jitter_ms, args.openai_error_rate,
+            args.openai_rate_limit_rate, args.retry_after, seed=args.seed + 1
+        )
+        self.mailboxes = {}  # agent ID -> FakeMailbox
+        self.agent_ids = []
+
+    def install_fakes(self):
+        """
+        Replaces the Gmail credentials, the Gmail service and the OpenAI clients with the fakes.
+        """
+        from app.apis import openai_api
+        from app.services import gmail_client_cache
+
+        def build_credentials(client_id, client_secret, refresh_token):
+            # An access token that never needs a refresh
+            return SimpleNamespace(token="bench", expiry=datetime.utcnow() + timedelta(days=1), refresh_token=refresh_token)
+
+        def build_gmail_service(creds, quota_key=None):
+            service = self.fakes.FakeGmailService(self.mailboxes[quota_key], self.gmail_faults)
+            return self.rate_limiter.bind_gmail_service(service, quota_key)
+
+        gmail_client_cache.build_credentials = build_credentials
+        gmail_client_cache.refresh_credentials = lambda creds: None
+        gmail_client_cache.build_gmail_service = build_gmail_service
+
+        sync_client = self.fakes.FakeOpenAI(self.openai_faults, self.args.openai_ms_per_token)
+        async_client = self.fakes.FakeOpenAI(self.openai_faults, self.args.openai_ms_per_token, asynchronous=True)
+        openai_api.get_client = lambda: sync_client
+        openai_api.get_async_client = lambda: async_client
+
+    def create_agents(self):
+        from app.apis.database_connection import SessionLocal
+        from app.models.gmail_agents import GmailAgent
+        from app.services.encryption import get_cipher_suite
+
+        cipher = get_cipher_suite()
+        db = SessionLocal()
+        try:
+            for n in range(self.args.agents):
+                agent = GmailAgent(
+                    name=f"Bench agent {n}",
+                    email_gmail=f"agent{n}@bench.local",
+                    client_id=cipher.encrypt(b"bench-client-id"),
+                    client_secret=cipher.encrypt(b"bench-client-secret"),
+                    refresh_token=cipher.encrypt(f"bench-refresh-{n}".encode()),
+                )
+                db.add(agent)
+                db.commit()
+                self.agent_ids.append(agent.id)
+                self.mailboxes[agent.id] = self.fakes.FakeMailbox(agent.email_gmail, seed=self.args.seed + n)
+        finally:
+            db.close()
+
+    def deliver(self, tag: str):
+        for mailbox in self.mailboxes.values():
+            mailbox.add_incoming(self.args.emails, self.args.body_chars, self.args.ignored_share,
+                                 self.args.reply_share, tag=tag)
+
+    def _fake_stats(self, gmail_before: dict, openai_before: dict) -> dict:
+        def delta(after: dict, before: dict) -> dict:
+            return {
+                key: {name: count - before[key].get(name, 0) for name, count in after[key].items()
+                      if count - before[key].get(name, 0)}
+                for key in after
+            }
+        return {
+            "gmail": delta(self.gmail_faults.get_stats(), gmail_before),
+            "openai": delta(self.openai_faults.get_stats(), openai_before),
+        }
+
+    @contextlib.contextmanager
+    def measure(self, report: dict):
+        """
+        Adds the wall time, the fakes' calls, the rate limiter waits and the memory of the block to report.
+        """
+        gmail_before, openai_before = self.gmail_faults.get_stats(), self.openai_faults.get_stats()
+        limiter_before = self.rate_limiter.get_stats()
+        if self.args.tracemalloc:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            report["wall_seconds"] = round(time.perf_counter() - started, 3)
+            if self.args.tracemalloc:
+                report["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+                tracemalloc.stop()
+            limiter_after = self.rate_limiter.get_stats()
+            report["rate_limiter"] = {
+                "wait_seconds": round(limiter_after["total_wait_seconds"] - limiter_before["total_wait_seconds"], 3),
+                "throttled": limiter_after["total_throttled"] - limiter_before["total_throttled"],
+            }
+            report["fakes"] = self._fake_stats(gmail_before, openai_before)
+            report["peak_rss_mb"] = peak_rss_mb()
+
+    def run_pipeline_scenario(self) -> dict:
+        from app.tasks import pipeline
+        from app.tasks.tasks import process_emails_task
+
+        # Empty mailboxes: the first run of each agent only stores its history cursor
+        for agent_id in self.agent_ids:
+            process_emails_task(agent_id)
+
+        timings = StageTimings()
+        run_durations = []
+        totals = Counter()
+        failed_runs = 0
+
+        def run(agent_id: int):
+            started = time.perf_counter()
+            stats = process_emails_task(agent_id)
+            return time.perf_counter() - started, stats
+
+        report = {}
+        pipeline.add_stage_observer(timings)
+        try:
+            with self.measure(report):
+                with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+                    for iteration in range(self.args.iterations):
+                        self.deliver(tag=f"r{iteration}")
+                        for seconds, stats in pool.map(run, self.agent_ids):
+                            run_durations.append(seconds)
+                            if stats is None:
+                                failed_runs += 1
+                            else:
+                                totals.update(stats)
+        finally:
+            pipeline.remove_stage_observer(timings)
+
+        report.update({
+            "runs": len(run_durations),
+            "failed_runs": failed_runs,
+            "emails": dict(totals),
+            "emails_per_second": round(totals["processed"] / report["wall_seconds"], 2) if report["wall_seconds"] else None,
+            "run_latency": percentiles(run_durations),
+            "stages": timings.report(),
+            "unread_left": sum(mailbox.unread_count() for mailbox in self.mailboxes.values()),
+        })
+        return report
+
+    def _run_requests(self, send) -> dict:
+        """
+        Calls send(n) for n in range(--requests), --concurrency at a time. send returns
+        (status code, number of emails in the response).
+        """
+        durations = []
+        statuses = Counter()
+        emails = 0
+        lock = threading.Lock()
+
+        def timed(n: int):
+            nonlocal emails
+            started = time.perf_counter()
+            status, count = send(n)
+            seconds = time.perf_counter() - started
+            with lock:
+                durations.append(seconds)
+                statuses[str(status)] += 1
+                emails += count
+
+        report = {}
+        with self.measure(report):
+            with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+                list(pool.map(timed, range(self.args.requests)))
+        report.update({
+            "requests": len(durations),
+            "status_codes": dict(statuses),
+            "requests_per_second": round(len(durations) / report["wall_seconds"], 2) if report["wall_seconds"] else None,
+            "emails_per_second": round(emails / report["wall_seconds"], 2) if report["wall_seconds"] else None,
+            "latency": percentiles(durations),
+        })
+        return report
+
+    def run_emails_recent_scenario(self, client) -> dict:
+        self.deliver(tag="recent")
+
+        def send(n: int):
+            agent_id = self.agent_ids[n % len(self.agent_ids)]
+            response = client.get("/api/emails/recent", params={"agent_id": agent_id, "limit": self.args.recent_limit})
+            return response.status_code, len(response.json()) if response.status_code == 200 else 0
+
+        return self._run_requests(send)
+
+    def run_summary_scenario(self, client) -> dict:
+        paragraph = "Prezados, segue em anexo o relatório mensal com os indicadores de vendas e as metas do próximo trimestre. "
+
+        def send(n: int):
+            body = f"[summary-{n}] " + (paragraph * (self.args.body_chars // len(paragraph) + 1))[:self.args.body_chars]
+            response = client.post("/api/summary", json={"email_body": body, "use_cache": self.args.llm_cache})
+            return response.status_code, 1 if response.status_code == 200 else 0
+
+        return self._run_requests(send)
+
+def main():
+    args = parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory(prefix="bench-pipeline-") as workdir:
+        configure_environment(args, workdir)
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+        with quiet:
+            from fastapi.testclient import TestClient
+            from app.apis.database_connection import engine
+            from app.tasks import config
+            from main import app
+
+            bench = Bench(args)
+            results = {}
+            # The lifespan creates the schema, as when the server starts
+            with TestClient(app) as client:
+                bench.install_fakes()
+                bench.create_agents()
+                if "pipeline" in scenarios:
+                    results["pipeline"] = bench.run_pipeline_scenario()
+                if "emails-recent" in scenarios:
+                    results["emails_recent"] = bench.run_emails_recent_scenario(client)
+                if "summary" in scenarios:
+                    results["summary"] = bench.run_summary_scenario(client)
+            engine.dispose()
+
+    report = {
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {
+            "agents": args.agents, "emails": args.emails, "concurrency": args.concurrency,
+            "iterations": args.iterations, "requests": args.requests, "body_chars": args.body_chars,
+            "gmail": {"latency_ms": args.gmail_latency_ms, "jitter_ms": args.gmail_jitter_ms,
+                      "error_rate": args.gmail_error_rate, "rate_limit_rate": args.gmail_rate_limit_rate},
+            "openai": {"latency_ms": args.openai_latency_ms, "jitter_ms": args.openai_jitter_ms,
+                       "ms_per_token": args.openai_ms_per_token, "error_rate": args.openai_error_rate,
+                       "rate_limit_rate": args.openai_rate_limit_rate},
+            "settings": {name: getattr(config, name) for name in (
+                "GMAIL_SYNC_MODE", "GMAIL_FETCH_MODE", "GMAIL_BATCH_SIZE", "PIPELINE_QUEUE_SIZE",
+                "PIPELINE_LLM_CONCURRENCY", "PIPELINE_SEND_CONCURRENCY", "RATE_LIMIT_ENABLED", "LLM_CACHE_ENABLED",
+                "PROMPT_CLEANING_ENABLED",
+            )},
+        },
+        "scenarios": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
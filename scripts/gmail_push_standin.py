@@ -0,0 +1,63 @@
+"""
+Local stand-in for the Pub/Sub push subscription of Gmail watches: posts synthetic
+notifications ({"emailAddress", "historyId"}, base64-encoded in a Pub/Sub push envelope)
+to POST /api/gmail/push, so push ingestion can be tested without Google Cloud.
+
+Each notification carries a higher historyId than the previous one and can be repeated
+--duplicates times, as Pub/Sub does on redelivery. A JSON report counts the endpoint's
+actions (queued, coalesced, follow_up, duplicate, stale, unknown_agent).
+
+Usage:
+    python scripts/gmail_push_standin.py --email agent@gmail.com [--count 10] [--duplicates 1]
+        [--interval 0.2] [--url http://127.0.0.1:8000/api/gmail/push] [--token TOKEN]
+"""
+import argparse
+import base64
+import json
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+import httpx
+
+def push_envelope(email_address: str, history_id: int, subscription: str) -> dict:
+    data = json.dumps({"emailAddress": email_address, "historyId": history_id}).encode()
+    return {
+        "message": {
+            "data": base64.b64encode(data).decode(),
+            "messageId": uuid.uuid4().hex,
+            "publishTime": datetime.now(timezone.utc).isoformat(),
+        },
+        "subscription": subscription,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000/api/gmail/push")
+    parser.add_argument("--email", required=True, help="Mailbox address of the agent (GmailAgent.email_gmail)")
+    parser.add_argument("--history-id", type=int, default=None, help="First historyId (default: based on the time)")
+    parser.add_argument("--count", type=int, default=10, help="Number of distinct notifications")
+    parser.add_argument("--duplicates", type=int, default=1, help="Times each notification is sent")
+    parser.add_argument("--interval", type=float, default=0.2, help="Seconds between notifications")
+    parser.add_argument("--token", default=None, help="Value of GMAIL_PUSH_TOKEN, if set")
+    parser.add_argument("--subscription", default="projects/local/subscriptions/gmail-push-standin")
+    args = parser.parse_args()
+
+    history_id = args.history_id if args.history_id is not None else int(time.time() * 1000)
+    params = {"token": args.token} if args.token else {}
+    actions = Counter()
+    with httpx.Client(timeout=10) as client:
+        for _ in range(args.count):
+            history_id += 1
+            envelope = push_envelope(args.email, history_id, args.subscription)
+            for _ in range(args.duplicates):
+                response = client.post(args.url, json=envelope, params=params)
+                result = response.json() if response.headers.get("content-type", "").startswith("application/json") else {}
+                actions[result.get("action", f"http_{response.status_code}")] += 1
+                print(f"historyId {history_id}: HTTP {response.status_code} {result}")
+            time.sleep(args.interval)
+
+    print(json.dumps({"notifications": args.count * args.duplicates, "actions": dict(actions)}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Local stand-in for the OpenAI endpoints used by the deferred summary mode and the summary
+stream: file upload and download, the Batch API and chat completions (plain and streamed).
+Batches complete after --delay seconds with a canned completion per request, so
+SUMMARY_MODE=deferred and /api/summary/stream can be tested without an API key.
+
+Usage:
+    python scripts/openai_batch_standin.py [--port 8001] [--delay 5]
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=test SUMMARY_MODE=deferred uvicorn main:app
+
+GET /stats returns the number of calls per endpoint and of requests answered in batches.
+"""
+import argparse
+import asyncio
+import email
+import email.policy
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+
+app = FastAPI()
+app.state.delay = 5.0
+
+_files = {}    # file ID -> {"meta": file object, "content": bytes}
+_batches = {}  # batch ID -> {"batch": batch object, "ready_at": monotonic time}
+_calls = Counter()
+_lock = threading.Lock()
+
+def _completion(prompt: str, model: str) -> dict:
+    words = prompt.split()
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": "Stand-in summary: " + " ".join(words[-12:])},
+        }],
+        "usage": {"prompt_tokens": len(words), "completion_tokens": 14, "total_tokens": len(words) + 14},
+    }
+
+def _store_file(filename: str, content: bytes, purpose: str) -> dict:
+    meta = {
+        "id": f"file-{uuid.uuid4().hex}",
+        "object": "file",
+        "bytes": len(content),
+        "created_at": int(time.time()),
+        "filename": filename,
+        "purpose": purpose,
+        "status": "processed",
+    }
+    with _lock:
+        _files[meta["id"]] = {"meta": meta, "content": content}
+    return meta
+
+def _parse_multipart(content_type: str, body: bytes) -> dict:
+    """
+    Returns the form fields of a multipart/form-data body as {name: (filename, bytes)}.
+    """
+    message = email.message_from_bytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body, policy=email.policy.HTTP
+    )
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        fields[name] = (part.get_filename(), part.get_payload(decode=True))
+    return fields
+
+def _finish_batch(batch: dict):
+    # Called with the lock held, once the batch is due
+    input_file = _files[batch["input_file_id"]]["content"]
+    output_lines = []
+    for line in input_file.decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        body = request["body"]
+        prompt = body["messages"][-1]["content"]
+        output_lines.append(json.dumps({
+            "id": f"batch_req_{uuid.uuid4().hex}",
+            "custom_id": request["custom_id"],
+            "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": _completion(prompt, body["model"])},
+            "error": None,
+        }))
+        _calls["batched_requests"] += 1
+
+    content = ("\n".join(output_lines) + "\n").encode("utf-8")
+    output_id = f"file-{uuid.uuid4().hex}"
+    _files[output_id] = {"meta": {
+        "id": output_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+        "filename": "batch_output.jsonl", "purpose": "batch_output", "status": "processed",
+    }, "content": content}
+    batch.update({
+        "status": "completed",
+        "output_file_id": output_id,
+        "completed_at": int(time.time()),
+        "request_counts": {"total": len(output_lines), "completed": len(output_lines), "failed": 0},
+    })
+
+@app.post("/v1/files")
+async def upload_file(request: Request):
+    _calls["files.create"] += 1
+    fields = _parse_multipart(request.headers.get("content-type", ""), await request.body())
+    if "file" not in fields:
+        raise HTTPException(status_code=400, detail="Missing 'file' field.")
+    filename, content = fields["file"]
+    purpose = fields.get("purpose", (None, b"batch"))[1].decode()
+    return _store_file(filename or "upload.jsonl", content, purpose)
+
+@app.get("/v1/files/{file_id}/content")
+def file_content(file_id: str):
+    _calls["files.content"] += 1
+    with _lock:
+        stored = _files.get(file_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="File not found.")
+    return Response(content=stored["content"], media_type="application/jsonl")
+
+@app.post("/v1/batches")
+async def create_batch(request: Request):
+    _calls["batches.create"] += 1
+    params = await request.json()
+    with _lock:
+        if params.get("input_file_id") not in _files:
+            raise HTTPException(status_code=400, detail="Unknown input_file_id.")
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex}",
+            "object": "batch",
+            "endpoint": params.get("endpoint"),
+            "input_file_id": params["input_file_id"],
+            "completion_window": params.get("completion_window", "24h"),
+            "status": "in_progress",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "completed_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        _batches[batch["id"]] = {"batch": batch, "ready_at": time.monotonic() + app.state.delay}
+    return batch
+
+@app.get("/v1/batches/{batch_id}")
+def retrieve_batch(batch_id: str):
+    _calls["batches.retrieve"] += 1
+    with _lock:
+        entry = _batches.get(batch_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Batch not found.")
+        if entry["batch"]["status"] == "in_progress" and time.monotonic() >= entry["ready_at"]:
+            _finish_batch(entry["batch"])
+        return dict(entry["batch"])
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    _calls["chat.completions"] += 1
+    body = await request.json()
+    completion = _completion(body["messages"][-1]["content"], body.get("model", "gpt-3.5-turbo"))
+    if body.get("stream"):
+        return StreamingResponse(_stream_completion(completion), media_type="text/event-stream")
+    return completion
+
+async def _stream_completion(completion: dict):
+    # One chunk per word, as chat.completion.chunk events
+    words = completion["choices"][0]["message"]["content"].split(" ")
+    for index, word in enumerate(words):
+        chunk = {
+            "id": completion["id"],
+            "object": "chat.completion.chunk",
+            "created": completion["created"],
+            "model": completion["model"],
+            "choices": [{
+                "index": 0,
+                "delta": {"content": word if index == 0 else " " + word},
+                "finish_reason": "stop" if index == len(words) - 1 else None,
+            }],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+        await asyncio.sleep(0.01)
+    yield "data: [DONE]\n\n"
+
+@app.get("/stats")
+def stats():
+    with _lock:
+        return dict(_calls)
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--delay", type=float, default=5.0, help="Seconds before a batch completes")
+    args = parser.parse_args()
+    app.state.delay = args.delay
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,56 @@
+"""
+Measures the import-time cost of the application with `python -X importtime`
+and prints a JSON report with the total and the most expensive modules.
+
+Usage:
+    python scripts/startup_report.py [--top 20]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def measure_imports(module: str = "main"):
+    """
+    Imports `module` in a fresh interpreter and returns a list of
+    (module_name, self_us, cumulative_us) tuples parsed from -X importtime.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    modules = measure_imports(args.module)
+    top_level = {name: cumulative for name, _, cumulative in modules if name == args.module}
+    heaviest = sorted(modules, key=lambda m: m[2], reverse=True)[:args.top]
+    report = {
+        "module": args.module,
+        "total_import_ms": round(top_level.get(args.module, 0) / 1000, 2),
+        "heaviest_modules_ms": [
+            {"module": name, "self_ms": round(self_us / 1000, 2), "cumulative_ms": round(cumulative_us / 1000, 2)}
+            for name, self_us, cumulative_us in heaviest
+        ],
+    }
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
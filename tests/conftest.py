@@ -0,0 +1,4 @@
+import os
+
+# Importing the models creates the engine; keep the tests off the real database
+os.environ.setdefault("DATABASE_URL", "sqlite://")
@@ -0,0 +1,39 @@
+"""
+Runs scripts/bench_pipeline.py on a tiny workload so the Gmail/OpenAI fakes of the benchmark
+keep matching the code they exercise.
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_bench(tmp_path, *extra) -> dict:
+    output = tmp_path / "report.json"
+    subprocess.run(
+        [sys.executable, os.path.join(ROOT, "scripts", "bench_pipeline.py"),
+         "--agents", "1", "--emails", "3", "--iterations", "1", "--requests", "2",
+         "--ignored-share", "0", "--gmail-latency-ms", "0", "--gmail-jitter-ms", "0",
+         "--openai-latency-ms", "0", "--openai-jitter-ms", "0", "--openai-ms-per-token", "0",
+         "--output", str(output), *extra],
+        cwd=ROOT, check=True, timeout=120,
+    )
+    return json.loads(output.read_text(encoding="utf-8"))
+
+def test_pipeline_processes_every_email(tmp_path):
+    report = run_bench(tmp_path)
+    pipeline = report["scenarios"]["pipeline"]
+
+    assert pipeline["failed_runs"] == 0
+    assert pipeline["emails"]["listed"] == 3
+    assert pipeline["emails"]["processed"] == 3
+    assert pipeline["emails"]["failed"] == 0
+    assert pipeline["unread_left"] == 0
+    assert pipeline["fakes"]["gmail"]["calls"]["gmail.users.messages.send"] == 3
+
+def test_http_scenarios_succeed(tmp_path):
+    report = run_bench(tmp_path, "--scenarios", "emails-recent,summary")
+
+    for name in ("emails_recent", "summary"):
+        assert report["scenarios"][name]["status_codes"] == {"200": 2}
@@ -0,0 +1,81 @@
+from app.services.email_cleaner import CleaningRules, clean_for_prompt, default_rules
+
+def clean(text: str, **options) -> str:
+    return CleaningRules(**options).clean(text)
+
+def test_bare_double_dash_is_content():
+    assert clean("Agenda:\n--\nItem 1: budget\nItem 2: hiring\n") == "Agenda:\n--\nItem 1: budget\nItem 2: hiring"
+
+def test_signature_delimiter_cuts_signature():
+    assert clean("See you tomorrow.\n-- \nAna Souza\n+55 11 91234-5678\n") == "See you tomorrow."
+
+def test_double_dash_inside_a_line_is_content():
+    text = "The old flag --verbose is gone -- use --log-level instead."
+    assert clean(text) == text
+
+def test_gmail_reply_header_cuts_quote():
+    text = ("Sounds good.\n\nOn Mon, Jun 3, 2024 at 10:12 AM Ana Souza <ana@example.com>\nwrote:\n"
+            "> Can we meet on Thursday?\n")
+    assert clean(text) == "Sounds good."
+
+def test_portuguese_reply_header_cuts_quote():
+    text = "Combinado.\n\nEm seg., 3 de jun. de 2024 às 10:12, Ana <ana@example.com> escreveu:\n\nPodemos marcar?\n"
+    assert clean(text) == "Combinado."
+
+def test_wrote_in_a_sentence_is_content():
+    text = "On Monday he wrote: the budget is approved.\nPlease update the forecast."
+    assert clean(text) == text
+
+def test_wrote_at_line_end_without_a_date_is_content():
+    text = "Hi team,\n\nOn second thought, here is what Ana wrote:\n\nThe budget is approved for next quarter."
+    assert clean(text) == text
+
+def test_forwarded_message_is_kept():
+    text = ("---------- Forwarded message ---------\nFrom: Ana <a@x.com>\nDate: Mon, 1 Jan 2024\n"
+            "Subject: Contract\n\nPlease review the attached contract by Friday.")
+    assert clean_for_prompt(text, default_rules(), record=False)["text"] == text
+
+def test_forwarded_message_keeps_content_and_drops_its_quote():
+    forwarded = ("FYI, see below.\n\n---------- Mensagem encaminhada ---------\nDe: Ana <a@x.com>\n"
+                 "Date: seg., 1 de jan. de 2024\nSubject: Contrato\n\nRevise o contrato.")
+    text = forwarded + "\n\nOn Mon, Jan 1, 2024 at 9:00 AM Bob <b@x.com> wrote:\n> Segue o contrato."
+    assert clean(text) == forwarded
+
+def test_quoting_disabled_keeps_reply():
+    text = "Ok.\n\nOn Mon, Jun 3, 2024 at 10:12 AM Ana wrote:\n> Hi"
+    assert clean(text, strip_quotes=False) == text
+
+def test_opening_thanks_is_not_a_signature():
+    text = "Thanks!\nThe report is at www.acme.com/reports and I can call +55 11 91234-5678 later."
+    assert clean(text) == text
+
+def test_contact_block_below_sign_off_is_removed():
+    text = ("The contract is attached.\n\nBest regards,\nAna Souza\nAccount Manager | ACME\n"
+            "Tel: +55 11 91234-5678\nwww.acme.com.br\n")
+    assert clean(text) == "The contract is attached.\n\nBest regards,\nAna Souza"
+
+def test_long_block_below_sign_off_is_content():
+    lines = [f"Step {n}: check www.acme.com/step-{n}" for n in range(12)]
+    text = "Here is the plan.\n\nThanks,\nAna\n" + "\n".join(lines)
+    assert clean(text) == text
+
+def test_disclaimer_paragraph_is_removed():
+    text = ("Please review the draft.\n\nCONFIDENTIALITY NOTICE: This e-mail is confidential. "
+            "If you are not the intended recipient, delete it.")
+    assert clean(text) == "Please review the draft."
+
+def test_tracking_params_are_removed():
+    text = "Read it at https://acme.com/post?id=7&utm_source=newsletter&fbclid=abc#top"
+    assert clean(text) == "Read it at https://acme.com/post?id=7#top"
+
+def test_quote_only_body_is_kept():
+    text = "> Can we meet on Thursday?\n> Ana"
+    assert clean(text) == text
+
+def test_custom_patterns_are_removed():
+    assert clean("[EXTERNAL] Please review.", custom_patterns=[r"^\[external\]\s*"]) == "Please review."
+
+def test_backtracking_custom_pattern_times_out(caplog):
+    text = "a" * 40 + "!"
+    assert clean(text, custom_patterns=[r"(a|aa)+$", r"!"]) == "a" * 40
+    assert "timed out" in caplog.text